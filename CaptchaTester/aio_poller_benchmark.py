@@ -0,0 +1,66 @@
+"""
+Нагрузка цикла событий при большом кол-ве ожидающих капч: цикл опроса на каждую капчу(`polling.aio_result_poller`
+с `asyncio.sleep`) и `AioBackgroundPoller`. На локальной заглушке сервиса капчи не решаются до конца замера,
+все отправлены одновременно. За `окно` секунд после начала ожидания выводятся процессорное время цикла событий
+на одну ожидающую капчу в секунду, наибольшее опоздание цикла событий(как долго готовый обработчик ждёт своей
+очереди) и кол-во запросов к res.php.
+
+python CaptchaTester/aio_poller_benchmark.py [кол-во капч] [интервал опроса] [окно]
+"""
+import sys
+import time
+import asyncio
+
+from python_rucaptcha.config import url_request_2captcha, url_response_2captcha
+from python_rucaptcha.polling import new_result, aio_result_poller
+from python_rucaptcha.background import AioBackgroundPoller
+from python_rucaptcha.transport import FakeServer, AioFakeTransport
+
+
+async def lag_probe(interval: float, lags: list):
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(time.monotonic() - start - interval)
+
+
+async def run(mode: str, captchas: int, sleep_time: float, window: float):
+    server = FakeServer(ready_after = 10 ** 9)
+    poller = AioBackgroundPoller()
+    transport = AioFakeTransport(server)
+    if mode == 'poller':
+        transport = poller.aio_transport(transport)
+    ids = [server.handle(url_request_2captcha, {'key': 'key'})['request'] for _ in range(captchas)]
+
+    loop = asyncio.get_event_loop()
+    waiters = [loop.create_task(aio_result_poller(transport, url_response_2captcha,
+                                                  {'key': 'key', 'action': 'get', 'id': captcha_id, 'json': 1},
+                                                  sleep_time, new_result()))
+               for captcha_id in ids]
+    # первый оборот: все задачи запущены и ждут первого опроса
+    await asyncio.sleep(sleep_time)
+
+    lags = []
+    probe = loop.create_task(lag_probe(0.01, lags))
+    requests = server.stats['get'] + server.stats['get_many']
+    cpu = time.process_time()
+    await asyncio.sleep(window)
+    cpu = time.process_time() - cpu
+    requests = server.stats['get'] + server.stats['get_many'] - requests
+
+    probe.cancel()
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(probe, *waiters, return_exceptions = True)
+    await poller.close()
+    print(f'{mode:>8} {cpu / window / captchas * 1e6:>16.2f} {max(lags) * 1000:>12.1f} {requests:>9}')
+
+
+if __name__ == '__main__':
+    captchas = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sleep_time = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    window = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f'{"способ":>8} {"мкс CPU/капча/с":>16} {"опоздание,мс":>12} {"запросов":>9}')
+    loop = asyncio.get_event_loop()
+    for mode in ('loops', 'poller'):
+        loop.run_until_complete(run(mode, captchas, sleep_time, window))
@@ -0,0 +1,63 @@
+"""
+Сравнение ожидания решения синхронных капч: поток на капчу с собственным опросом res.php и `BackgroundPoller`.
+На локальной заглушке сервиса(решение за 2-10 опросов) одинаковое кол-во капч решается тремя способами:
+    threads  - поток на каждую капчу, каждый опрашивает свою капчу
+    blocking - поток на каждую капчу, ожидание в фоновом опросе
+    submit   - `BackgroundPoller.submit`, без потока на капчу
+Выводятся время решения всех капч, наибольшее кол-во потоков процесса и кол-во запросов к res.php.
+
+python CaptchaTester/background_poller_benchmark.py [кол-во капч] [интервал опроса]
+"""
+import sys
+import time
+import random
+import threading
+
+from python_rucaptcha import TextCaptcha
+from python_rucaptcha.background import BackgroundPoller
+from python_rucaptcha.transport import FakeServer, FakeTransport
+
+
+def solve_threads(captcha, captchas: int):
+    threads = [threading.Thread(target = captcha.captcha_handler, kwargs = {'captcha_text': f'{i}'})
+               for i in range(captchas)]
+    for thread in threads:
+        thread.start()
+    peak = threading.active_count()
+    for thread in threads:
+        thread.join()
+    return peak
+
+
+def solve_submit(poller: BackgroundPoller, captcha, captchas: int):
+    futures = [poller.submit(captcha.captcha_handler, captcha_text = f'{i}') for i in range(captchas)]
+    peak = threading.active_count()
+    for future in futures:
+        future.result()
+    return max(peak, threading.active_count())
+
+
+def run(mode: str, captchas: int, sleep_time: float):
+    server = FakeServer(ready_after = lambda: random.randint(2, 10))
+    poller = BackgroundPoller(workers = 4, tick = sleep_time / 10)
+    transport = FakeTransport(server) if mode == 'threads' else poller.transport(FakeTransport(server))
+    captcha = TextCaptcha.TextCaptcha(rucaptcha_key = 'key', transport = transport)
+    captcha.sleep_time = sleep_time
+    start = time.monotonic()
+    if mode == 'submit':
+        peak = solve_submit(poller, captcha, captchas)
+    else:
+        peak = solve_threads(captcha, captchas)
+    elapsed = time.monotonic() - start
+    poller.close()
+    requests = server.stats['get'] + server.stats['get_many']
+    print(f'{mode:>9} {elapsed:>8.2f} {peak:>7} {requests:>9}')
+
+
+if __name__ == '__main__':
+    captchas = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    sleep_time = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    print(f'{"способ":>9} {"секунд":>8} {"потоков":>7} {"запросов":>9}')
+    for mode in ('threads', 'blocking', 'submit'):
+        random.seed(1)
+        run(mode, captchas, sleep_time)
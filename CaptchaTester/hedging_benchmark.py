@@ -0,0 +1,67 @@
+"""
+Замер дублирующей отправки на локальной заглушке сервиса с долгим хвостом времени решения.
+Большая часть капч решается за 10-25 опросов, каждая десятая - за 100-300.
+Одинаковый набор капч решается без дублирования и с `HedgePolicy`, выводятся p50/p99 времени решения
+и доля дополнительных отправок.
+
+python CaptchaTester/hedging_benchmark.py [кол-во капч] [перцентиль] [макс. доля дубликатов] [одновременных капч]
+"""
+import sys
+import time
+import random
+import asyncio
+
+from python_rucaptcha import aioReCaptchaV2
+from python_rucaptcha.hedging import HedgePolicy
+from python_rucaptcha.transport import FakeServer, AioFakeTransport
+
+# время между опросами в бенчмарке вместо минимальных 10 секунд
+TICK = 0.02
+
+
+def ready_after():
+    if random.random() < 0.1:
+        return random.randint(100, 300)
+    return random.randint(10, 25)
+
+
+async def run(captchas: int, concurrency: int, policy: HedgePolicy = None, seed: int = 1):
+    random.seed(seed)
+    semaphore = asyncio.Semaphore(concurrency)
+    server = FakeServer(ready_after = ready_after)
+    transport = AioFakeTransport(server)
+    latencies = []
+
+    async def one():
+        captcha = aioReCaptchaV2(rucaptcha_key = 'key', transport = transport, hedging = policy)
+        captcha.sleep_time = TICK
+        async with semaphore:
+            start = time.monotonic()
+            await captcha.captcha_handler(site_key = 'A' * 40, page_url = 'https://example.com')
+            latencies.append((time.monotonic() - start) / TICK)
+
+    # первые капчи набирают статистику времени решения
+    await asyncio.gather(*[one() for _ in range(captchas // 4)])
+    latencies.clear()
+    submitted = server.stats['submit']
+    await asyncio.gather(*[one() for _ in range(captchas)])
+    latencies.sort()
+    return latencies, server.stats['submit'] - submitted
+
+
+def report(name: str, latencies: list, submits: int, captchas: int):
+    print(f'{name:<20} p50: {latencies[len(latencies) // 2]:6.0f} опросов   '
+          f'p99: {latencies[int(len(latencies) * 0.99)]:6.0f} опросов   '
+          f'отправок: {submits} (+{(submits - captchas) / captchas:.1%})')
+
+
+if __name__ == '__main__':
+    captchas = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    percentile = float(sys.argv[2]) if len(sys.argv) > 2 else 0.9
+    max_ratio = float(sys.argv[3]) if len(sys.argv) > 3 else 0.25
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+
+    report('без дублирования', *asyncio.run(run(captchas, concurrency)), captchas)
+    policy = HedgePolicy(percentile = percentile, max_ratio = max_ratio)
+    report(f'p{percentile * 100:.0f} дублирование', *asyncio.run(run(captchas, concurrency, policy)), captchas)
+    print(policy.stats())
@@ -0,0 +1,141 @@
+"""
+Сравнение HTTP/1.1 и HTTP/2 транспортов при большом кол-ве одновременных опросов res.php.
+Заданное кол-во капч отправляется одновременно, затем каждая опрашивается до готовности решения.
+Для HTTP/2 поднимается локальный сервер-заглушка без TLS(h2c), для HTTP/1.1 - сервер из `transport_benchmark.py`.
+Выводится скорость, кол-во открытых TCP соединений и максимум одновременных запросов.
+Требует `pip install httpx[http2]`.
+
+python CaptchaTester/http2_benchmark.py [кол-во капч] [запросов до решения] [потоков для синхронного httpx]
+"""
+import sys
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import h2.config
+import h2.events
+import h2.settings
+import h2.connection
+
+from transport_benchmark import serve
+from python_rucaptcha.transport import FakeServer, AiohttpTransport, HttpxTransport, AioHttpxTransport
+
+
+class H2Protocol(asyncio.Protocol):
+    """
+    Соединение HTTP/2 сервера-заглушки, запросы обрабатываются `FakeServer`
+    """
+    connections = 0
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side = False,
+                                                                         header_encoding = 'utf-8'))
+        # ID потока -> (заголовки, тело запроса)
+        self.requests = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        H2Protocol.connections += 1
+        self.transport = transport
+        self.conn.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 1000})
+        self.conn.initiate_connection()
+        transport.write(self.conn.data_to_send())
+
+    def data_received(self, data: bytes):
+        for event in self.conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                self.requests[event.stream_id] = (dict(event.headers), bytearray())
+            elif isinstance(event, h2.events.DataReceived):
+                self.requests[event.stream_id][1].extend(event.data)
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                self.respond(event.stream_id)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.transport.close()
+        self.transport.write(self.conn.data_to_send())
+
+    def respond(self, stream_id: int):
+        headers, body = self.requests.pop(stream_id)
+        data = {key: value[0] for key, value in parse_qs(body.decode()).items()}
+        answer = json.dumps(self.server.handle(headers[':path'], data)).encode()
+        self.conn.send_headers(stream_id, [(':status', '200'),
+                                           ('content-type', 'application/json'),
+                                           ('content-length', str(len(answer)))])
+        self.conn.send_data(stream_id, answer, end_stream = True)
+
+
+def serve_h2(server: FakeServer):
+    """
+    Запускает HTTP/2 сервер-заглушку в отдельном потоке
+    :return: адрес сервера
+    """
+    loop = asyncio.new_event_loop()
+    h2_server = loop.run_until_complete(loop.create_server(lambda: H2Protocol(server), '127.0.0.1', 0))
+    threading.Thread(target = loop.run_forever, daemon = True).start()
+    return f'http://127.0.0.1:{h2_server.sockets[0].getsockname()[1]}'
+
+
+def solve(transport, base: str):
+    captcha_id = transport.submit(f'{base}/in.php', {'key': 'key', 'method': 'post', 'json': 1})['request']
+    while transport.get(f'{base}/res.php', {'key': 'key', 'action': 'get', 'id': captcha_id, 'json': 1})['status'] == 0:
+        pass
+
+
+async def aio_solve(transport, base: str):
+    answer = await transport.submit(f'{base}/in.php', {'key': 'key', 'method': 'post', 'json': 1})
+    payload = {'key': 'key', 'action': 'get', 'id': answer['request'], 'json': 1}
+    while (await transport.get(f'{base}/res.php', payload))['status'] == 0:
+        pass
+
+
+async def bench_aio(transport, base: str, captchas: int):
+    start = time.perf_counter()
+    await asyncio.gather(*[aio_solve(transport, base) for _ in range(captchas)])
+    elapsed = time.perf_counter() - start
+    await transport.close()
+    return elapsed
+
+
+def bench_sync(transport, base: str, captchas: int, threads: int):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda _: solve(transport, base), range(captchas)))
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return elapsed
+
+
+def report(name: str, server: FakeServer, elapsed: float, connections: int, max_in_flight = '-'):
+    requests = sum(server.stats.values())
+    print(f'{name:<28} {requests / elapsed:8.0f} запросов/с   соединений: {connections:<5} '
+          f'одновременных запросов: {max_in_flight}')
+
+
+if __name__ == '__main__':
+    captchas = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    polls = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    server = FakeServer(ready_after = polls)
+    httpd, base = serve(server)
+    elapsed = asyncio.run(bench_aio(AiohttpTransport(), base, captchas))
+    report('aio aiohttp HTTP/1.1', server, elapsed, httpd.connections)
+    httpd.shutdown()
+
+    server = FakeServer(ready_after = polls)
+    base = serve_h2(server)
+    transport = AioHttpxTransport(http1 = False)
+    elapsed = asyncio.run(bench_aio(transport, base, captchas))
+    report('aio httpx HTTP/2', server, elapsed, H2Protocol.connections, transport.health()['max_in_flight'])
+
+    server = FakeServer(ready_after = polls)
+    base = serve_h2(server)
+    H2Protocol.connections = 0
+    transport = HttpxTransport(http1 = False)
+    elapsed = bench_sync(transport, base, captchas, threads)
+    report(f'httpx HTTP/2, {threads} потоков', server, elapsed, H2Protocol.connections,
+           transport.health()['max_in_flight'])
@@ -0,0 +1,55 @@
+"""
+Замер времени импорта библиотеки.
+Каждый сценарий запускается в отдельном процессе несколько раз, выводится медиана времени
+и список загруженных HTTP библиотек.
+
+python CaptchaTester/import_time_benchmark.py [кол-во запусков]
+"""
+import sys
+import json
+import statistics
+import subprocess
+
+SCENARIOS = {
+    # только импорт модуля
+    'import python_rucaptcha.ImageCaptcha': 'import python_rucaptcha.ImageCaptcha',
+    # синхронный вариант - загружается только `requests`
+    'sync ImageCaptcha()': 'from python_rucaptcha import ImageCaptcha\n'
+                           'ImageCaptcha.ImageCaptcha(rucaptcha_key="key")',
+    # асинхронный вариант - загружается только `aiohttp`
+    'async aioImageCaptcha()': 'import asyncio\n'
+                               'from python_rucaptcha import aioImageCaptcha\n'
+                               'async def main():\n'
+                               '    captcha = aioImageCaptcha(rucaptcha_key="key")\n'
+                               '    captcha.transport._get_session()\n'
+                               '    await captcha.close()\n'
+                               'asyncio.run(main())',
+}
+
+RUNNER = '''
+import sys, time, json
+start = time.perf_counter()
+exec(compile(%r, "<scenario>", "exec"))
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed,
+                  "loaded": [name for name in ("requests", "urllib3", "aiohttp", "asyncio") if name in sys.modules]}))
+'''
+
+
+def run(code: str, runs: int):
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-W', 'ignore', '-c', RUNNER % code],
+                                check = True, stdout = subprocess.PIPE).stdout
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        timings.append(result['elapsed'])
+        loaded = result['loaded']
+    return statistics.median(timings), loaded
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, code in SCENARIOS.items():
+        median, loaded = run(code, runs)
+        print(f'{name:<40} {median * 1000:8.1f} ms   загружены: {", ".join(loaded) or "-"}')
@@ -0,0 +1,37 @@
+"""
+Замер разбора ответов res.php.
+Сравнивается прежний вариант(ответ разбирался стандартным `json` до трёх раз за опрос), разбор каждой установленной
+JSON библиотекой один раз и `decoding.decode_json`(быстрая проверка `CAPCHA_NOT_READY` + лучшая библиотека).
+
+python CaptchaTester/json_decode_benchmark.py [кол-во повторов]
+"""
+import sys
+import json
+import timeit
+import importlib
+
+from python_rucaptcha.decoding import decode_json, JSON_LIBRARY
+
+BODIES = {
+    'CAPCHA_NOT_READY': b'{"status":0,"request":"CAPCHA_NOT_READY"}',
+    'решение': b'{"status":1,"request":"03AGdBq24PBCbwiDRaS_MJ7Z8hXCKOPs0K9LGHsk5fXnCx8aTpxL3Cyj5jEk2a1"}',
+}
+
+
+def loaders():
+    yield 'json x3 (прежний вариант)', lambda body: (json.loads(body)['request'], json.loads(body)['status'],
+                                                      json.loads(body)['status'])
+    for name in ('json', 'ujson', 'orjson'):
+        try:
+            yield f'{name} x1', importlib.import_module(name).loads
+        except ImportError:
+            print(f'{name} не установлен, пропущен')
+    yield f'decode_json ({JSON_LIBRARY})', decode_json
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for name, loader in loaders():
+        timings = '   '.join(f'{body_name}: {min(timeit.repeat(lambda: loader(body), number = number, repeat = 3)) / number * 1e9:7.0f} нс'
+                             for body_name, body in BODIES.items())
+        print(f'{name:<28} {timings}')
@@ -0,0 +1,102 @@
+"""
+Замер памяти при длительной работе: решение большого кол-ва капч на локальной заглушке сервиса.
+Несколько долгоживущих объектов `ImageCaptcha`, `TextCaptcha` и `ReCaptchaV2` по очереди решают капчи через транспорт
+с выключателем, повторами и планировщиком. По мере работы выводятся RSS процесса, кол-во объектов под сборщиком мусора
+и размер данных капчи, оставшихся в объектах после вызовов - все три значения не должны расти.
+
+python CaptchaTester/memory_benchmark.py [кол-во решений] [кол-во объектов каждого класса]
+"""
+import gc
+import os
+import sys
+import time
+import base64
+import resource
+
+from python_rucaptcha import ImageCaptcha, TextCaptcha, ReCaptchaV2
+from python_rucaptcha.retry import RetryPolicy
+from python_rucaptcha.breaker import CircuitBreaker
+from python_rucaptcha.scheduler import SubmitScheduler
+from python_rucaptcha.transport import FakeServer, FakeTransport
+
+# изображения разного содержимого, 30 КБ каждое
+IMAGES = [base64.b64encode(b'\x89PNG\r\n\x1a\n' + bytes([i]) * 30 * 1024).decode() for i in range(8)]
+
+
+def rss() -> int:
+    """
+    Текущий RSS процесса в байтах, без /proc - максимальный RSS
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def retained(solvers: list) -> int:
+    """
+    Размер строк, оставшихся в атрибутах объектов капчи
+    """
+    size = 0
+    for solver in solvers:
+        for value in vars(solver).values():
+            if isinstance(value, dict):
+                size += sum(len(item) for item in value.values() if isinstance(item, str))
+    return size
+
+
+def make_solvers(count: int, transport) -> list:
+    solvers = []
+    for _ in range(count):
+        solvers.append(ImageCaptcha.ImageCaptcha(rucaptcha_key = 'key', transport = transport))
+        solvers.append(TextCaptcha.TextCaptcha(rucaptcha_key = 'key', transport = transport))
+        solvers.append(ReCaptchaV2.ReCaptchaV2(rucaptcha_key = 'key', transport = transport))
+    for solver in solvers:
+        solver.sleep_time = 0
+    return solvers
+
+
+def solve(solver, number: int) -> dict:
+    if isinstance(solver, ImageCaptcha.ImageCaptcha):
+        return solver.captcha_handler(captcha_base64 = IMAGES[number % len(IMAGES)])
+    if isinstance(solver, TextCaptcha.TextCaptcha):
+        return solver.captcha_handler(captcha_text = f'Сколько будет {number} + 1?')
+    return solver.captcha_handler(site_key = 'A' * 40, page_url = f'https://example.com/{number}')
+
+
+def run(solves: int, instances: int):
+    server = FakeServer(ready_after = 2)
+    scheduler = SubmitScheduler(max_in_flight = 10)
+    transport = CircuitBreaker().transport(RetryPolicy().transport(scheduler.transport('normal', FakeTransport(server))))
+    solvers = make_solvers(instances, transport)
+
+    checkpoints = 10
+    step = max(solves // checkpoints, 1)
+    # первые решения прогревают кэши интерпретатора и аллокатора
+    for number in range(min(step, 10000)):
+        solve(solvers[number % len(solvers)], number)
+    # `vars()` создаёт словари атрибутов объектов, поэтому вызывается до замера кол-ва объектов
+    retained(solvers)
+    gc.collect()
+    base_rss, base_objects = rss(), len(gc.get_objects())
+
+    print(f'{"решений":>10} {"RSS, МБ":>9} {"прирост RSS, МБ":>16} {"прирост объектов":>17} '
+          f'{"данные в объектах, КБ":>22} {"решений/с":>10}')
+    start = time.perf_counter()
+    for number in range(1, solves + 1):
+        answer = solve(solvers[number % len(solvers)], number)
+        if answer['error']:
+            raise RuntimeError(answer['errorBody'])
+        if number % step == 0:
+            gc.collect()
+            current = rss()
+            print(f'{number:>10} {current / 2 ** 20:>9.1f} {(current - base_rss) / 2 ** 20:>16.1f} '
+                  f'{len(gc.get_objects()) - base_objects:>17} {retained(solvers) / 1024:>22.1f} '
+                  f'{number / (time.perf_counter() - start):>10.0f}')
+    print('задач в ожидании сервера:', len(server._polls), ' планировщик:', scheduler.stats()['normal']['in_flight'])
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100)
@@ -0,0 +1,75 @@
+"""
+Сравнение настроек опроса на записанном профиле трафика.
+Профиль из файла `TrafficRecorder` воспроизводится `ReplayServer`(время ответов, сетевые ошибки, ошибки in.php,
+время и итоги решения), одинаковый набор капч решается с разными интервалами опроса. Выводятся p50/p99 времени решения
+в секундах записи, кол-во запросов к res.php на капчу и кол-во ошибок.
+Если файла записи нет, он записывается на локальной заглушке сервиса со случайным временем решения.
+
+python CaptchaTester/replay_benchmark.py [файл записи] [кол-во капч] [ускорение] [одновременных капч] [интервалы,через,запятую]
+"""
+import os
+import sys
+import time
+import base64
+import random
+import asyncio
+
+from python_rucaptcha import ImageCaptcha
+from python_rucaptcha.recording import TrafficRecorder, TrafficProfile, ReplayServer
+from python_rucaptcha.transport import FakeServer, FakeTransport, AioFakeTransport
+
+IMAGE = base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'\0' * 2048).decode()
+
+
+def record_demo(path: str, captchas: int = 100):
+    """
+    Запись демонстрационного профиля: решение за 2-20 опросов с интервалом 0.02 секунды
+    """
+    server = FakeServer(ready_after = lambda: random.randint(2, 20), latency = 0.005)
+    with TrafficRecorder(path) as recorder:
+        captcha = ImageCaptcha.ImageCaptcha(rucaptcha_key = 'key', transport = recorder.transport(FakeTransport(server)))
+        captcha.sleep_time = 0.02
+        for _ in range(captchas):
+            captcha.captcha_handler(captcha_base64 = IMAGE)
+
+
+async def run(profile: TrafficProfile, captchas: int, time_scale: float, concurrency: int, sleep_time: float,
+              seed: int = 1):
+    server = ReplayServer(profile, time_scale = time_scale, seed = seed)
+    captcha = ImageCaptcha.aioImageCaptcha(rucaptcha_key = 'key', transport = AioFakeTransport(server))
+    # интервал опроса тоже ускоряется
+    captcha.sleep_time = sleep_time * time_scale
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.monotonic()
+            answer = await captcha.captcha_handler(captcha_base64 = IMAGE)
+            latencies.append((time.monotonic() - start) / time_scale)
+            errors += answer['error']
+
+    await asyncio.gather(*[one() for _ in range(captchas)])
+    latencies.sort()
+    return latencies, server.stats['get'] / captchas, errors
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'traffic.jsonl.gz'
+    captchas = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    time_scale = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+    sleep_times = [float(value) for value in (sys.argv[5] if len(sys.argv) > 5 else '0.02,0.05,0.1,0.2').split(',')]
+
+    if not os.path.exists(path):
+        print(f'{path} не найден, записывается демонстрационный профиль')
+        record_demo(path)
+    profile = TrafficProfile.load(path)
+    print(profile.summary())
+    for sleep_time in sleep_times:
+        latencies, polls, errors = asyncio.run(run(profile, captchas, time_scale, concurrency, sleep_time))
+        print(f'интервал {sleep_time:>6} с   p50: {latencies[len(latencies) // 2]:7.3f} с   '
+              f'p99: {latencies[int(len(latencies) * 0.99)]:7.3f} с   '
+              f'res.php на капчу: {polls:5.1f}   ошибок: {errors}')
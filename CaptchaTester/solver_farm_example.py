@@ -0,0 +1,35 @@
+import asyncio
+
+from python_rucaptcha import ImageCaptcha, ReCaptchaV2
+from python_rucaptcha.farm import SolverFarm
+
+"""
+Этот пример показывает работу многопроцессной фермы SolverFarm.
+Процессы-воркеры скачивают изображения, кодируют их и отправляют капчу на сервер,
+а один процесс-координатор опрашивает сервер о решении сразу для всех капч.
+Классы ImageCaptcha/aioImageCaptcha и ReCaptchaV2/aioReCaptchaV2 работают через ферму, если передать её в `farm`.
+"""
+# Введите ключ от рукапчи из своего аккаунта
+RUCAPTCHA_KEY = ""
+SITE_KEY = '6Lf77CsUAAAAALLFD1wIhbfQRD07VxhvPbyQFaQJ'
+PAGE_URL = 'http://85.255.8.26/'
+IMAGE_LINK = 'http://85.255.8.26/static/image/common_image_example/800070.png'
+
+if __name__ == '__main__':
+    with SolverFarm(workers = 4) as farm:
+        # синхронная работа через ферму
+        answer = ImageCaptcha.ImageCaptcha(rucaptcha_key = RUCAPTCHA_KEY, farm = farm)\
+            .captcha_handler(captcha_link = IMAGE_LINK, timeout = 120)
+        print(answer)
+
+        # асинхронная работа через ферму - все капчи ожидают решения в одном процессе-координаторе
+        async def run():
+            recaptcha = ReCaptchaV2.aioReCaptchaV2(rucaptcha_key = RUCAPTCHA_KEY, farm = farm)
+            return await asyncio.gather(*[recaptcha.captcha_handler(site_key = SITE_KEY, page_url = PAGE_URL)
+                                          for _ in range(10)])
+
+        for answer in asyncio.get_event_loop().run_until_complete(run()):
+            if not answer['error']:
+                print(answer['captchaSolve'])
+            else:
+                print(answer['errorBody'])
@@ -0,0 +1,20 @@
+from python_rucaptcha import ImageCaptcha
+from python_rucaptcha.spool import SpoolWatcher
+
+"""
+Этот пример показывает режим наблюдения за папкой-спулом.
+Изображения, появляющиеся в папке `spool`(их туда кладут другие программы), сразу отправляются на решение.
+Решённые изображения переносятся в `spool/done` вместе с файлом ответа `<имя>.txt`,
+нерешённые - в `spool/failed` с файлом ошибки `<имя>.error`. Все ответы также пишутся в журнал `answers.jsonl`.
+Остановка - Ctrl+C, изображения оставшиеся в спуле будут решены при следующем запуске.
+"""
+# Введите ключ от рукапчи из своего аккаунта
+RUCAPTCHA_KEY = ""
+
+if __name__ == '__main__':
+    solver = ImageCaptcha.aioImageCaptcha(rucaptcha_key = RUCAPTCHA_KEY)
+    watcher = SpoolWatcher(solver, 'spool', results_log = 'answers.jsonl', concurrency = 500)
+    try:
+        watcher.run_forever()
+    finally:
+        print(watcher.stats())
@@ -0,0 +1,103 @@
+"""
+Сравнение HTTP транспортов на локальном сервере-заглушке in.php/res.php.
+Для каждого установленного бэкенда выполняется `submit` + `get` заданное кол-во раз,
+асинхронные бэкенды - с заданным кол-вом одновременных запросов.
+
+python CaptchaTester/transport_benchmark.py [кол-во запросов] [одновременных запросов]
+"""
+import sys
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from python_rucaptcha.transport import FakeServer, TRANSPORTS, AIO_TRANSPORTS
+
+
+def serve(server: FakeServer):
+    """
+    Запускает HTTP/1.1 сервер, отвечающий как in.php/res.php
+    :return: (HTTP сервер, адрес), `сервер.connections` - кол-во принятых соединений
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # заголовки и тело отправляются отдельно, без этого ответы задерживаются алгоритмом Нейгла
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            httpd.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            data = {key: value[0] for key, value in parse_qs(body.decode()).items()}
+            answer = json.dumps(server.handle(self.path, data)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer)
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.connections = 0
+    threading.Thread(target = httpd.serve_forever, daemon = True).start()
+    return httpd, f'http://127.0.0.1:{httpd.server_address[1]}'
+
+
+def bench_sync(transport, base: str, requests: int):
+    start = time.perf_counter()
+    for _ in range(requests):
+        captcha_id = transport.submit(f'{base}/in.php', {'key': 'key', 'method': 'post', 'json': 1})['request']
+        transport.get(f'{base}/res.php', {'key': 'key', 'action': 'get', 'id': captcha_id, 'json': 1})
+    return time.perf_counter() - start
+
+
+async def bench_aio(transport, base: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            answer = await transport.submit(f'{base}/in.php', {'key': 'key', 'method': 'post', 'json': 1})
+            await transport.get(f'{base}/res.php', {'key': 'key', 'action': 'get', 'id': answer['request'], 'json': 1})
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+    await transport.close()
+    return elapsed
+
+
+def report(name: str, requests: int, elapsed: float):
+    print(f'{name:<20} {requests * 2 / elapsed:10.0f} запросов/с   {elapsed * 1000 / requests:8.3f} мс на капчу')
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    fake_server = FakeServer()
+    httpd, base = serve(fake_server)
+
+    for name, transport_class in TRANSPORTS.items():
+        try:
+            transport = transport_class(server = fake_server) if name == 'fake' else transport_class()
+        except ImportError as error:
+            print(f'{name:<20} пропущен: {error}')
+            continue
+        with transport:
+            report(name, requests, bench_sync(transport, base, requests))
+
+    for name, transport_class in AIO_TRANSPORTS.items():
+        try:
+            transport = transport_class(server = fake_server) if name == 'fake' else transport_class()
+        except ImportError as error:
+            print(f'aio {name:<16} пропущен: {error}')
+            continue
+        report(f'aio {name}', requests, asyncio.run(bench_aio(transport, base, requests, concurrency)))
+
+    httpd.shutdown()
@@ -0,0 +1,46 @@
+"""
+Замер отправки изображения на in.php двумя способами `upload_method` класса `ImageCaptcha`:
+`base64` - изображение строкой base64 в url-encoded форме(+33% на base64, затем каждый `+`, `/` и `=` формы
+превращается в три байта) и `post` - байты изображения в multipart запросе.
+Для изображений разного размера выводится размер тела запроса, его отношение к размеру изображения и время
+подготовки запроса(кодирование base64 + сборка тела запроса библиотекой `requests`).
+
+python CaptchaTester/upload_benchmark.py [кол-во повторов]
+"""
+import os
+import sys
+import timeit
+import base64
+
+import requests
+
+from python_rucaptcha.config import app_key, url_request_2captcha
+
+# размеры изображений в байтах
+SIZES = (4 * 1024, 32 * 1024, 256 * 1024, 1024 * 1024)
+
+
+def payload(method: str) -> dict:
+    return {'key': '0' * 32, 'method': method, 'json': 1, 'soft_id': app_key}
+
+
+def prepare_base64(image: bytes) -> bytes:
+    data = dict(payload('base64'), body = base64.b64encode(image).decode('utf-8'))
+    return requests.Request('POST', url_request_2captcha, data = data).prepare().body
+
+
+def prepare_post(image: bytes) -> bytes:
+    return requests.Request('POST', url_request_2captcha, data = payload('post'),
+                            files = {'file': image}).prepare().body
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f'{"изображение":>12} {"способ":>7} {"тело запроса":>13} {"x размер":>9} {"мс на запрос":>13}')
+    for size in SIZES:
+        # сжатое изображение по распределению байтов близко к случайным данным
+        image = b'\x89PNG\r\n\x1a\n' + os.urandom(size - 8)
+        for name, prepare in (('base64', prepare_base64), ('post', prepare_post)):
+            wire = len(prepare(image))
+            seconds = min(timeit.repeat(lambda: prepare(image), number = number, repeat = 3)) / number
+            print(f'{size // 1024:>9} КБ {name:>7} {wire:>13} {wire / size:>9.2f} {seconds * 1000:>13.3f}')
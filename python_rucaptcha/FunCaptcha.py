@@ -1,13 +1,10 @@
-import requests
-import time
-import asyncio
-import aiohttp
-from requests.adapters import HTTPAdapter
-from urllib3.exceptions import MaxRetryError
-
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, app_key, \
-    JSON_RESPONSE
-from .errors import RuCaptchaError
+from .config import app_key
+from .errors import RuCaptchaError, LocalValidationError
+from .validators import validate_funcaptcha
+from .transport import service_urls, make_transport, make_aio_transport
+from .polling import CancelToken, SolveTask, make_deadline, request_timeout, result_poller, aio_result_poller
+from .tracing import traced, aio_traced
+from .hedging import HedgePolicy, hedged_result_poller, aio_hedged_result_poller
 
 
 class FunCaptcha:
@@ -17,13 +14,17 @@ class FunCaptcha:
 	И так же ссылку на сайт.
 	"""
 
-    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, **kwargs):
+    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, timeout: float=None,
+                 transport=None, hedging: HedgePolicy=None, **kwargs):
         """
 		Инициализация нужных переменных.
 		:param rucaptcha_key:  АПИ ключ капчи из кабинета пользователя
 		:param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
 		:param sleep_time: Вермя ожидания решения капчи
+		:param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
+		:param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
+		:param hedging: `hedging.HedgePolicy` - дублирующая отправка капчи, не решённой за перцентиль времени решения
 		:param kwargs: Для передачи дополнительных параметров
 		"""
         # проверка введённого времени и изменение если минимальный порог нарушен
@@ -31,17 +32,11 @@ class FunCaptcha:
             raise ValueError(f'\nПараметр `sleep_time` должен быть не менее 10(рекомендуемое - 20 секунд). '
                              f'\n\tВы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад POST запроса на отправку капчи на сервер
         self.post_payload = {"key": rucaptcha_key,
@@ -58,88 +53,65 @@ class FunCaptcha:
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
 
-        # создаём сессию
-        self.session = requests.Session()
-        # выставляем кол-во попыток подключения к серверу при ошибке
-        self.session.mount('http://', HTTPAdapter(max_retries=5))
+        # HTTP транспорт
+        self.transport = make_transport(transport)
+        # политика дублирующей отправки
+        self.hedging = hedging
 
     # Работа с капчей
-    def captcha_handler(self, public_key: str, page_url: str):
+    @traced
+    def captcha_handler(self, public_key: str, page_url: str, timeout: float=None, cancel_token: CancelToken=None):
         '''
 		Метод отвечает за передачу данных на сервер для решения капчи
 		:param site_key: Ключ сайта
 		:param page_url: Ссылка на страницу на которой находится капча
+		:param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
+		:param cancel_token: `CancelToken` для отмены ожидания решения из другого потока
     	:return: В качестве ответа передаётся JSON с данными для решения капчи
 		'''
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        # локальная проверка параметров до отправки на сервер
+        try:
+            validate_funcaptcha(public_key, page_url)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
+            return task.result
+
         # добавляем в пайлоад параметры капчи переданные пользователем
-        self.post_payload.update({'publickey': public_key,
+        task.post_payload.update({'publickey': public_key,
                                   'pageurl': page_url})
         # получаем ID капчи
-        captcha_id = self.session.post(self.url_request, data=self.post_payload).json()
+        captcha_id = self.transport.submit(self.url_request, task.post_payload, timeout=request_timeout(deadline))
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
-        # Ожидаем решения капчи 20 секунд
         # Ожидаем решения капчи
-        time.sleep(self.sleep_time)
-        while True:
-            try:
-                # отправляем запрос на результат решения капчи, если не решена ожидаем
-                captcha_response = self.session.post(self.url_response, data=self.get_payload)
-
-                # если капча ещё не решена - ожидаем
-                if captcha_response.json()['request'] == 'CAPCHA_NOT_READY':
-                    time.sleep(self.sleep_time)
-
-                # при ошибке во время решения
-                elif captcha_response.json()["status"] == 0:
-                    self.result.update({'error': True,
-                                        'errorBody': RuCaptchaError().errors(captcha_response.json()["request"])
-                                        }
-                                       )
-                    return self.result
-
-                # при решении капчи
-                elif captcha_response.json()["status"] == 1:
-                    self.result.update({
-                                        'captchaSolve': captcha_response.json()['request']
-                                        }
-                                       )
-                    return self.result
-
-            except (TimeoutError, ConnectionError, MaxRetryError) as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
-
-            except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        if self.hedging is not None:
+            return hedged_result_poller(self.transport, self.url_request, self.url_response, task.post_payload,
+                                        task.get_payload, self.sleep_time, task.result, self.hedging,
+                                        deadline = deadline, cancel_token = cancel_token)
+        return result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time, task.result,
+                             deadline = deadline, cancel_token = cancel_token)
 
 
 # асинхронный метод для решения FunCaptcha
@@ -150,13 +122,17 @@ class aioFunCaptcha:
     И так же ссылку на сайт.
     """
 
-    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, **kwargs):
+    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, timeout: float=None,
+                 transport=None, hedging: HedgePolicy=None, **kwargs):
         """
         Инициализация нужных переменных.
         :param rucaptcha_key:  АПИ ключ капчи из кабинета пользователя
         :param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
         :param sleep_time: Вермя ожидания решения капчи
+        :param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
+        :param transport: HTTP транспорт: объект `transport.AioTransport` или название бэкенда(`aiohttp`, `httpx`, `fake`)
+        :param hedging: `hedging.HedgePolicy` - дублирующая отправка капчи, не решённой за перцентиль времени решения
         :param kwargs: Для передачи дополнительных параметров
         """
         # проверка введённого времени и изменение если минимальный порог нарушен
@@ -164,17 +140,11 @@ class aioFunCaptcha:
             raise ValueError(f'\nПараметр `sleep_time` должен быть не менее 10(рекомендуемое - 20 секунд). '
                              f'\n\tВы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад POST запроса на отправку капчи на сервер
         self.post_payload = {"key": rucaptcha_key,
@@ -191,73 +161,66 @@ class aioFunCaptcha:
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
+
+        # HTTP транспорт
+        self.transport = make_aio_transport(transport)
+        # политика дублирующей отправки
+        self.hedging = hedging
+
+    async def close(self):
+        """
+        Закрывает соединения транспорта
+        """
+        await self.transport.close()
 
     # Работа с капчей
-    async def captcha_handler(self, public_key: str, page_url: str):
+    @aio_traced
+    async def captcha_handler(self, public_key: str, page_url: str, timeout: float=None):
         '''
     	Метод отвечает за передачу данных на сервер для решения капчи
 		:param site_key: Ключ сайта
     	:param page_url: Ссылка на страницу на которой находится капча
+		:param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
     	:return: В качестве ответа передаётся JSON с данными для решения капчи
 		'''
-        self.post_payload.update({'publickey': public_key,
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        # локальная проверка параметров до отправки на сервер
+        try:
+            validate_funcaptcha(public_key, page_url)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
+            return task.result
+
+        task.post_payload.update({'publickey': public_key,
                                   'pageurl': page_url})
         # получаем ID капчи
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url_request, data=self.post_payload) as resp:
-                captcha_id = await resp.json()
+        captcha_id = await self.transport.submit(self.url_request, task.post_payload)
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
         # Ожидаем решения капчи
-        await asyncio.sleep(self.sleep_time)
-        # отправляем запрос на результат решения капчи, если не решена ожидаем
-        async with aiohttp.ClientSession() as session:
-            while True:
-                try:
-                    async with session.post(self.url_response, data=self.get_payload) as resp:
-                        captcha_response = await resp.json()
-
-                        # если капча ещё не решена - ожидаем
-                        if captcha_response['request'] == 'CAPCHA_NOT_READY':
-                            await asyncio.sleep(self.sleep_time)
-
-                        # при ошибке во время решения
-                        elif captcha_response["status"] == 0:
-                            self.result.update({'error': True,
-                                                'errorBody': RuCaptchaError().errors(captcha_response["request"])
-                                                }
-                                               )
-                            return self.result
-
-                        # при успешном решении капчи
-                        elif captcha_response["status"] == 1:
-                            self.result.update({
-                                                'captchaSolve': captcha_response['request']
-                                                }
-                                               )
-                            return self.result
-
-                except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        if self.hedging is not None:
+            return await aio_hedged_result_poller(self.transport, self.url_request, self.url_response, task.post_payload,
+                                                  task.get_payload, self.sleep_time, task.result, self.hedging,
+                                                  deadline = deadline)
+        return await aio_result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time,
+                                       task.result, deadline = deadline)
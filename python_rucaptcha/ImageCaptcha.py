@@ -1,17 +1,20 @@
-import requests
 import time
 import tempfile
-import hashlib
 import os
-import asyncio
-import aiohttp
 import base64
-from urllib3.exceptions import MaxRetryError
-from requests.adapters import HTTPAdapter
 
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, app_key, \
-    JSON_RESPONSE
-from .errors import RuCaptchaError, ReadError
+from .config import app_key
+from .errors import RuCaptchaError, ReadError, LocalValidationError
+from .preprocessing import ImagePipeline
+from .validators import validate_image, validate_image_base64, validate_image_head
+from .download import MAX_DOWNLOAD_SIZE, stream_download, aio_stream_download
+from .transport import service_urls, make_transport, make_aio_transport
+from .polling import CancelToken, SolveTask, make_deadline, request_timeout, timeout_error, result_poller, aio_result_poller, \
+    when_done
+from .tracing import traced, aio_traced, span, set_attributes
+from .hedging import HedgePolicy, hedged_result_poller, aio_hedged_result_poller
+from .proxies import ProxyPool, proxied, aio_proxied, measure_download
+from .singleflight import SingleFlight
 
 
 class ImageCaptcha:
@@ -24,18 +27,36 @@ class ImageCaptcha:
 
     def __init__(self, rucaptcha_key: str, sleep_time: int = 5, save_format: str = 'temp',
                  service_type: str = '2captcha', img_clearing: bool = True, img_path: str = 'PythonRuCaptchaImages',
-                 **kwargs):
+                 timeout: float = None, farm = None, preprocessing: ImagePipeline = None,
+                 validation: bool = True, download_max_bytes: int = MAX_DOWNLOAD_SIZE, transport = None, hedging: HedgePolicy = None,
+                 proxy_pool: ProxyPool = None, single_flight: SingleFlight = None,
+                 local_tier = None, upload_method: str = 'base64', **kwargs):
         """
         Инициализация нужных переменных, создание папки для изображений и кэша
         После завершения работы - удалются временные фалйы и папки
         :param rucaptcha_key:  АПИ ключ капчи из кабинета пользователя
         :param sleep_time: Вермя ожидания решения капчи
+        :param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
         :param save_format: Формат в котором будет сохраняться изображение, либо как временный фпйл - 'temp',
                             либо как обычное изображение в папку созданную библиотекой - 'const'.
         :param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
         :param img_path: Папка для сохранения изображений капчи;
         :param img_clearing: True - удалять файл после решения, False - не удалять файл после решения;
+        :param farm: `SolverFarm` - скачивание, кодирование и ожидание решения выполняются процессами фермы,
+                     изображения при этом не сохраняются на диск, `preprocessing` и `local_tier` не поддерживаются
+        :param preprocessing: `ImagePipeline` - обработка и проверка изображения перед отправкой на сервер
+        :param validation: True - проверять размер и формат изображения до отправки на сервер
+        :param download_max_bytes: Максимальный размер скачиваемого по ссылке изображения в байтах
+        :param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
+        :param hedging: `hedging.HedgePolicy` - дублирующая отправка капчи, не решённой за перцентиль времени решения
+        :param proxy_pool: `proxies.ProxyPool` - изображения по ссылке скачиваются через прокси из пула
+        :param single_flight: `singleflight.SingleFlight` - одинаковые одновременно решаемые изображения
+                              отправляются на сервер один раз, не используется вместе с `hedging`
+        :param local_tier: `tiers.LocalTier` - изображение сначала распознаётся локально, на сервер отправляется
+                           только при низкой уверенности ответа
+        :param upload_method: Способ отправки изображения: `base64` - строкой base64 в форме запроса(стандартный),
+                              `post` - байтами в multipart запросе, на треть меньше данных и без кодирования
         :param kwargs: Служит для передачи необязательных параметров в пайлоад для запроса к RuCaptcha
 
         Подробней с примерами можно ознакомиться в 'CaptchaTester/image_captcha_example.py'
@@ -43,6 +64,22 @@ class ImageCaptcha:
         if sleep_time < 5:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 10. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
+        # многопроцессная ферма для решения капчи
+        if farm is not None and (preprocessing is not None or local_tier is not None):
+            raise ValueError('Параметры `preprocessing` и `local_tier` не поддерживаются при работе через `farm`')
+        self.farm = farm
+        # обработка изображения перед отправкой
+        self.preprocessing = preprocessing
+        # локальная проверка изображения
+        self.validation = validation
+        # ограничение размера скачиваемого изображения
+        self.download_max_bytes = download_max_bytes
+        # способ отправки изображения
+        if upload_method not in ('base64', 'post'):
+            raise ValueError(f'Параметр `upload_method` должен быть `base64` или `post`. Вы передали - `{upload_method}`')
+        self.upload_method = upload_method
         # проверяем переданный параметр способа сохранения капчи
         if save_format in ['const', 'temp']:
             self.save_format = save_format
@@ -71,98 +108,127 @@ class ImageCaptcha:
                 self.post_payload.update({key: kwargs[key]})
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError(
-                '\nПередан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                f'\n\tВы передали - `{service_type}`'
-                '\nWrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.'
-                f'\n\tYour param - `{service_type}`')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': rucaptcha_key,
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
-
-        # создаём сессию
-        self.session = requests.Session()
-        # выставляем кол-во попыток подключения к серверу при ошибке
-        self.session.mount('http://', HTTPAdapter(max_retries = 5))
 
-    def image_temp_saver(self, content: bytes):
+        # HTTP транспорт
+        self.transport = make_transport(transport)
+        # объединение одинаковых капч
+        if single_flight is not None:
+            # дублирующая отправка с тем же пайлоадом присоединилась бы к исходной капче
+            if hedging is not None:
+                raise ValueError('Параметры `single_flight` и `hedging` не используются вместе')
+            self.transport = single_flight.transport(self.transport)
+        # политика дублирующей отправки
+        self.hedging = hedging
+        # пул прокси для скачивания изображений
+        self.proxy_pool = proxy_pool
+        # локальное распознавание до отправки на сервер
+        self.local_tier = local_tier
+
+    def _encode_image(self, content: bytes) -> str:
         """
-        Метод сохраняет файл изображения как временный и отправляет его сразу на сервер для расшифровки.
-        :return: Возвращает ID капчи из сервиса
+        Обрабатывает изображение через `preprocessing`(если передан) и кодирует его в base64
+        :param content: Изображение
+        :return: Изображение в кодировке base64
         """
-        captcha_id = None
-        try:
-            with tempfile.NamedTemporaryFile(suffix = '.png') as out:
-                out.write(content)
-                captcha_image = open(out.name, 'rb')
-                # Отправляем на рукапча изображение капчи и другие парметры,
-                # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
-                self.post_payload.update({"body": base64.b64encode(captcha_image.read()).decode('utf-8')})
-                captcha_id = self.session.post(self.url_request, data = self.post_payload).json()
-
-        except (IOError, FileNotFoundError) as error:
-            self.result.update({'error': True,
-                                'errorBody': {
-                                    'text': error
-                                    }
-                                }
-                               )
-
-        except Exception as error:
-            self.result.update({'error': True,
-                                'errorBody': {
-                                    'text': error
-                                    }
-                                }
-                               )
-
-        finally:
-            return captcha_id
-
-    def image_const_saver(self, content: bytes):
+        with span('rucaptcha.encode', image_bytes = len(content)) as encode_span:
+            if self.preprocessing is not None:
+                content = self.preprocessing(content)
+            # локальная проверка размера и формата изображения
+            if self.validation:
+                validate_image(content)
+            body = base64.b64encode(content).decode('utf-8')
+            set_attributes(encode_span, payload_bytes = len(body))
+            return body
+
+    def _attach_image(self, task: SolveTask, content: bytes):
         """
-        Метод создаёт папку и сохраняет в неё изображение, затем передаёт его на расшифровку и удалет файл.
-        :param content: Файл для сохранения;
-        :return: Возвращает ID капчи из сервиса
+        Вносит изображение в запрос: при `upload_method='post'` - байтами(после `preprocessing` и проверки)
+        в multipart запрос, иначе - в кодировке base64 в пайлоад
+        :param task: Данные решаемой капчи
+        :param content: Изображение
+        """
+        if self.upload_method == 'base64':
+            task.post_payload.update({"body": self._encode_image(content)})
+            return
+        with span('rucaptcha.encode', image_bytes = len(content)) as encode_span:
+            if self.preprocessing is not None:
+                content = self.preprocessing(content)
+            # локальная проверка размера и формата изображения
+            if self.validation:
+                validate_image(content)
+            set_attributes(encode_span, payload_bytes = len(content))
+        task.post_payload.update({"method": "post"})
+        task.files = {'file': content}
+
+    def _submit(self, task: SolveTask, deadline: float = None):
+        """
+        Отправляет капчу на сервер, если её не распознал локально `local_tier`
+        :param task: Данные решаемой капчи, изображение уже в `post_payload`
+        :param deadline: Общий дедлайн решения капчи
+        :return: JSON ответ in.php или None - капча распознана локально, ответ записан в `task.result`
+        """
+        if self.local_tier is not None:
+            answer = self.local_tier.recognize(task.files['file'] if task.files else task.post_payload['body'])
+            if answer is not None:
+                task.result.update({'captchaSolve': answer, 'tier': 'local'})
+                return None
+            task.result['tier'] = 'service'
+        return self.transport.submit(self.url_request, task.post_payload, files = task.files,
+                                     timeout = request_timeout(deadline))
+
+    def local_image_captcha(self, content: str, task: SolveTask, content_type: str = "file", deadline: float = None):
+        """
+        Метод получает в качестве параметра ссылку на локальный файл(или файл в кодировке base64), считывает изображение и отправляет его на РуКапчу
+        для проверки и получения её ID
+        :param content: Ссылка на локальный файл
+        :param content_type: Тип передаваемого файла, Может быть `file`(если передан локальный адрес) или
+                            `base64`(если передано изображение в кодировке base64)
+        :param task: Данные решаемой капчи
+        :param deadline: Общий дедлайн решения капчи
+        :return: ID капчи в сервисе
         """
         captcha_id = None
 
         try:
-            # Высчитываем хэш изображения, для того что бы сохранить его под уникальным именем
-            image_hash = hashlib.sha224(content).hexdigest()
-            # создаём папку для сохранения капч
-            if not os.path.exists(self.img_path):
-                os.mkdir(self.img_path)
-
-            # сохраняем в папку изображение
-            with open(os.path.join(self.img_path, f'im-{image_hash}.png'), 'wb') as out_image:
-                out_image.write(content)
-
-            with open(os.path.join(self.img_path, f'im-{image_hash}.png'), 'rb') as captcha_image:
-                # Отправляем на рукапча изображение капчи и другие парметры,
-                # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
-                self.post_payload.update({"body": base64.b64encode(captcha_image.read()).decode('utf-8')})
-                captcha_id = self.session.post(self.url_request, data = self.post_payload).json()
+            # пробуем открыть файл, закодировать в base64, затем вносим закодированный файл в payload для отправки на
+            # рукапчу для решения
+            if content_type == 'file':
+                with open(content, 'rb') as captcha_image:
+                    self._attach_image(task, captcha_image.read())
 
-            # если передано True для удаления файла капчи после решения
-            if self.img_clearing:
-                # удаляем файл капчи
-                os.remove(os.path.join(self.img_path, f"im-{image_hash}.png"))
+            # вносим закодированный файл в payload для отправки на рукапчу для решения
+            elif content_type == "base64":
+                # изображение декодируется только для обработки через `preprocessing` или отправки байтами
+                if self.preprocessing is not None or self.upload_method == 'post':
+                    self._attach_image(task, base64.b64decode(content))
+                else:
+                    if self.validation:
+                        validate_image_base64(content)
+                    task.post_payload.update({"body": content})
+
+            else:
+                raise ValueError(f'Передан неверный тип контента! Допустимые: `file` и `base64`. '
+                                 f'Вы передали: `{content_type}`')
+
+            # Отправляем на рукапча изображение капчи и другие парметры,
+            # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
+            captcha_id = self._submit(task, deadline)
+
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
 
         except (IOError, FileNotFoundError) as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -170,7 +236,7 @@ class ImageCaptcha:
                                )
 
         except Exception as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -178,41 +244,69 @@ class ImageCaptcha:
                                )
 
         finally:
-
             return captcha_id
 
-    def local_image_captcha(self, content: str, content_type: str = "file"):
+    def stream_image_captcha(self, captcha_link: str, task: SolveTask, deadline: float = None, **kwargs):
         """
-        Метод получает в качестве параметра ссылку на локальный файл(или файл в кодировке base64), считывает изображение и отправляет его на РуКапчу
-        для проверки и получения её ID
-        :param content: Ссылка на локальный файл
-        :param content_type: Тип передаваемого файла, Может быть `file`(если передан локальный адрес) или
-                            `base64`(если передано изображение в кодировке base64)
-        :return: ID капчи в сервисе
+        Метод потоково скачивает изображение по ссылке(не более `download_max_bytes`), по мере скачивания
+        считает хэш и base64, при `save_format='const'` пишет изображение в папку, и отправляет его на сервер.
+        :param captcha_link: Ссылка на изображение
+        :param task: Данные решаемой капчи
+        :param deadline: Общий дедлайн решения капчи
+        :param kwargs: Параметры для библиотеки `requests`
+        :return: Возвращает ID капчи из сервиса
         """
         captcha_id = None
+        out_file = None
 
         try:
-            # пробуем открыть файл, закодировать в base64, затем вносим закодированный файл в payload для отправки на
-            # рукапчу для решения
-            if content_type == 'file':
-                with open(content, 'rb') as captcha_image:
-                    self.post_payload.update({"body": base64.b64encode(captcha_image.read()).decode('utf-8')})
-
-            # вносим закодированный файл в payload для отправки на рукапчу для решения
-            elif content_type == "base64":
-                self.post_payload.update({"body": content})
-
+            if self.save_format == 'const':
+                # создаём папку для сохранения капч
+                if not os.path.exists(self.img_path):
+                    os.mkdir(self.img_path)
+                # имя файла известно только после скачивания, поэтому сначала пишем во временный файл
+                out_file = tempfile.NamedTemporaryFile(dir = self.img_path, suffix = '.part', delete = False)
+
+            # исходное изображение сохраняем только если его нужно обработать или отправить байтами
+            with measure_download(self.proxy_pool, kwargs.get('proxies', {}).get('https')):
+                image = stream_download(self.transport, captcha_link, max_bytes = self.download_max_bytes,
+                                        deadline = deadline, keep_content = self.preprocessing is not None or self.upload_method == 'post',
+                                        out_file = out_file, **kwargs)
+
+            image_path = None
+            if out_file is not None:
+                out_file.close()
+                image_path = os.path.join(self.img_path, f'im-{image.sha224}.png')
+                os.replace(out_file.name, image_path)
+                out_file = None
+
+            if image.content is not None:
+                self._attach_image(task, image.content)
             else:
-                raise ValueError(f'Передан неверный тип контента! Допустимые: `file` и `base64`. '
-                                 f'Вы передали: `{content_type}`')
+                # локальная проверка размера и формата изображения
+                if self.validation:
+                    validate_image_head(image.head, image.size)
+                task.post_payload.update({"body": image.body})
 
             # Отправляем на рукапча изображение капчи и другие парметры,
             # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
-            captcha_id = self.session.post(self.url_request, data = self.post_payload).json()
+            captcha_id = self._submit(task, deadline)
+
+            # если передано True для удаления файла капчи после решения
+            if image_path and self.img_clearing:
+                os.remove(image_path)
+
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
+
+        except TimeoutError:
+            timeout_error(task.result)
 
         except (IOError, FileNotFoundError) as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -220,7 +314,7 @@ class ImageCaptcha:
                                )
 
         except Exception as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -228,16 +322,25 @@ class ImageCaptcha:
                                )
 
         finally:
+            # недокачанный файл удаляем
+            if out_file is not None:
+                out_file.close()
+                os.remove(out_file.name)
             return captcha_id
 
     # Работа с капчёй
-    def captcha_handler(self, captcha_link: str = None, captcha_file: str = None, captcha_base64: str = None, **kwargs):
+    @traced
+    @proxied('requests')
+    def captcha_handler(self, captcha_link: str = None, captcha_file: str = None, captcha_base64: str = None,
+                        timeout: float = None, cancel_token: CancelToken = None, **kwargs):
         """
         Метод получает от вас ссылку на изображение, скачивает его, отправляет изображение на сервер
         RuCaptcha, дожидается решения капчи и вовзращает вам результат
         :param captcha_link: Ссылка на изображение
         :param captcha_file: Адрес(локальный) по которому находится изображение для отправки на расшифровку
         :param captcha_base64: Изображение переданное в кодировке base64
+        :param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
+        :param cancel_token: `CancelToken` для отмены ожидания решения из другого потока
         :param kwargs: Параметры для библиотеки `requests`
         :return: Ответ на капчу в виде JSON строки с полями:
                     captchaSolve - решение капчи,
@@ -249,102 +352,74 @@ class ImageCaptcha:
                             id - уникальный номер ошибка в ЭТОЙ бибилотеке
                         }
         """
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+
+        # работа через многопроцессную ферму
+        if self.farm is not None:
+            return self.farm.solve(self.url_request, self.url_response, task.post_payload,
+                                   captcha_link = captcha_link, captcha_file = captcha_file,
+                                   captcha_base64 = captcha_base64,
+                                   timeout = timeout if timeout is not None else self.timeout,
+                                   validation = self.validation, download_max_bytes = self.download_max_bytes,
+                                   upload_method = self.upload_method, cancel_token = cancel_token, **kwargs)
+
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        start = time.monotonic()
 
         # если передана локальная ссылка на файл
         if captcha_file:
-            captcha_id = self.local_image_captcha(captcha_file)
+            captcha_id = self.local_image_captcha(captcha_file, task, deadline = deadline)
         # если передан файл в кодировке base64
         elif captcha_base64:
-            captcha_id = self.local_image_captcha(captcha_base64, content_type = "base64")
+            captcha_id = self.local_image_captcha(captcha_base64, task, content_type = "base64", deadline = deadline)
         # если передан URL
         elif captcha_link:
-            try:
-                content = self.session.get(url = captcha_link, **kwargs).content
-            except Exception as error:
-                self.result.update({'error': True,
-                                    'errorBody': {
-                                        'text': error
-                                        }
-                                    }
-                                   )
-                return self.result
-
-            # согласно значения переданного параметра выбираем функцию для сохранения изображения
-            if self.save_format == 'const':
-                captcha_id = self.image_const_saver(content)
-            elif self.save_format == 'temp':
-                captcha_id = self.image_temp_saver(content)
+            # изображение скачивается потоково, с ограничением размера
+            captcha_id = self.stream_image_captcha(captcha_link, task, deadline = deadline, **kwargs)
 
         else:
             # если не передан ни один из параметров
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': 'You did not send any file local link or URL.',
                                 }
                                )
-            return self.result
+            return task.result
         # проверяем наличие ошибок при скачивании/передаче файла на сервер
-        if self.result['error']:
-            return self.result
+        if task.result['error']:
+            return task.result
 
+        # капча распознана локально
+        elif captcha_id is None:
+            return task.result
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         elif captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
         # Ожидаем решения капчи
-        time.sleep(self.sleep_time)
-        while True:
-            try:
-                # отправляем запрос на результат решения капчи, если не решена ожидаем
-                captcha_response = self.session.post(self.url_response, data = self.get_payload)
-
-                # если капча ещё не решена - ожидаем
-                if captcha_response.json()['request'] == 'CAPCHA_NOT_READY':
-                    time.sleep(self.sleep_time)
-
-                # при ошибке во время решения
-                elif captcha_response.json()["status"] == 0:
-                    self.result.update({'error': 1,
-                                        'errorBody': RuCaptchaError().errors(captcha_response.json()["request"])
-                                        }
-                                       )
-                    return self.result
-
-                # при решении капчи
-                elif captcha_response.json()["status"] == 1:
-                    self.result.update({
-                        'captchaSolve': captcha_response.json()['request']
-                    }
-                    )
-                    return self.result
-
-            except (TimeoutError, ConnectionError, MaxRetryError) as error:
-                self.result.update({'error': True,
-                                    'errorBody': {
-                                        'text': error
-                                        }
-                                    }
-                                   )
-                return self.result
-
-            except Exception as error:
-                self.result.update({'error': True,
-                                    'errorBody': {
-                                        'text': error
-                                        }
-                                    }
-                                   )
-                return self.result
+        if self.hedging is not None:
+            answer = hedged_result_poller(self.transport, self.url_request, self.url_response, task.post_payload,
+                                          task.get_payload, self.sleep_time, task.result, self.hedging,
+                                          deadline = deadline, cancel_token = cancel_token, files = task.files)
+        else:
+            answer = result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time, task.result,
+                                   deadline = deadline, cancel_token = cancel_token)
+        if self.local_tier is not None:
+            answer = when_done(answer, lambda answer: self.local_tier.record_service(time.monotonic() - start,
+                                                                                     answer['error']))
+        return answer
 
 
 class aioImageCaptcha:
@@ -357,18 +432,36 @@ class aioImageCaptcha:
 
     def __init__(self, rucaptcha_key: str, sleep_time: int = 5, save_format: str = 'temp',
                  service_type: str = '2captcha', img_clearing: bool = True, img_path: str = 'PythonRuCaptchaImages',
-                 **kwargs):
+                 timeout: float = None, farm = None, preprocessing: ImagePipeline = None,
+                 validation: bool = True, download_max_bytes: int = MAX_DOWNLOAD_SIZE, transport = None, hedging: HedgePolicy = None,
+                 proxy_pool: ProxyPool = None, single_flight: SingleFlight = None,
+                 local_tier = None, upload_method: str = 'base64', **kwargs):
         """
         Инициализация нужных переменных, создание папки для изображений и кэша
         После завершения работы - удалются временные фалйы и папки
         :param rucaptcha_key:  АПИ ключ капчи из кабинета пользователя
         :param sleep_time: Вермя ожидания решения капчи
+        :param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
         :param save_format: Формат в котором будет сохраняться изображение, либо как временный фпйл - 'temp',
                             либо как обычное изображение в папку созданную библиотекой - 'const'.
 		:param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
         :param img_path: Папка для сохранения изображений капчи;
         :param img_clearing: True - удалять файл после решения, False - не удалять файл после решения;
+        :param farm: `SolverFarm` - скачивание, кодирование и ожидание решения выполняются процессами фермы,
+                     изображения при этом не сохраняются на диск, `preprocessing` и `local_tier` не поддерживаются
+        :param preprocessing: `ImagePipeline` - обработка и проверка изображения перед отправкой на сервер
+        :param validation: True - проверять размер и формат изображения до отправки на сервер
+        :param download_max_bytes: Максимальный размер скачиваемого по ссылке изображения в байтах
+        :param transport: HTTP транспорт: объект `transport.AioTransport` или название бэкенда(`aiohttp`, `httpx`, `fake`)
+        :param hedging: `hedging.HedgePolicy` - дублирующая отправка капчи, не решённой за перцентиль времени решения
+        :param proxy_pool: `proxies.ProxyPool` - изображения по ссылке скачиваются через прокси из пула
+        :param single_flight: `singleflight.SingleFlight` - одинаковые одновременно решаемые изображения
+                              отправляются на сервер один раз, не используется вместе с `hedging`
+        :param local_tier: `tiers.LocalTier` - изображение сначала распознаётся локально, на сервер отправляется
+                           только при низкой уверенности ответа
+        :param upload_method: Способ отправки изображения: `base64` - строкой base64 в форме запроса(стандартный),
+                              `post` - байтами в multipart запросе, на треть меньше данных и без кодирования
         :param kwargs: Служит для передачи необязательных параметров в пайлоад для запроса к RuCaptcha
 
         Подробней с примерами можно ознакомиться в 'CaptchaTester/image_captcha_example.py'
@@ -376,6 +469,22 @@ class aioImageCaptcha:
         if sleep_time < 5:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 5. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
+        # многопроцессная ферма для решения капчи
+        if farm is not None and (preprocessing is not None or local_tier is not None):
+            raise ValueError('Параметры `preprocessing` и `local_tier` не поддерживаются при работе через `farm`')
+        self.farm = farm
+        # обработка изображения перед отправкой
+        self.preprocessing = preprocessing
+        # локальная проверка изображения
+        self.validation = validation
+        # ограничение размера скачиваемого изображения
+        self.download_max_bytes = download_max_bytes
+        # способ отправки изображения
+        if upload_method not in ('base64', 'post'):
+            raise ValueError(f'Параметр `upload_method` должен быть `base64` или `post`. Вы передали - `{upload_method}`')
+        self.upload_method = upload_method
 
         # проверяем переданный параметр способа сохранения капчи
         if save_format in ['const', 'temp']:
@@ -404,95 +513,128 @@ class aioImageCaptcha:
                 self.post_payload.update({key: kwargs[key]})
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError(
-                '\nПередан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                f'\n\tВы передали - `{service_type}`'
-                '\nWrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.'
-                f'\n\tYour param - `{service_type}`')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': rucaptcha_key,
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
 
-    async def image_temp_saver(self, content: bytes):
+        # HTTP транспорт, соединения с сайтом и сервисом переиспользуются между вызовами
+        self.transport = make_aio_transport(transport)
+        # объединение одинаковых капч
+        if single_flight is not None:
+            # дублирующая отправка с тем же пайлоадом присоединилась бы к исходной капче
+            if hedging is not None:
+                raise ValueError('Параметры `single_flight` и `hedging` не используются вместе')
+            self.transport = single_flight.aio_transport(self.transport)
+        # политика дублирующей отправки
+        self.hedging = hedging
+        # пул прокси для скачивания изображений
+        self.proxy_pool = proxy_pool
+        # локальное распознавание до отправки на сервер
+        self.local_tier = local_tier
+
+    async def close(self):
         """
-        Метод сохраняет файл изображения как временный и отправляет его сразу на сервер для расшифровки.
-        :return: Возвращает ID капчи из сервиса
+        Закрывает соединения транспорта
         """
-        captcha_id = None
-
-        try:
-            with tempfile.NamedTemporaryFile(suffix = '.png') as out:
-                out.write(content)
-                captcha_image = open(out.name, 'rb')
-                # Отправляем изображение файлом
-                self.post_payload.update({"body": base64.b64encode(captcha_image.read()).decode('utf-8')})
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(self.url_request, data = self.post_payload) as resp:
-                        captcha_id = await resp.json()
-
-        except (IOError, FileNotFoundError) as error:
-            self.result.update({'error': True,
-                                'errorBody': {
-                                    'text': error
-                                    }
-                                }
-                               )
-
-        except Exception as error:
-            self.result.update({'error': True,
-                                'errorBody': {
-                                    'text': error
-                                    }
-                                }
-                               )
-
-        finally:
-            return captcha_id
+        await self.transport.close()
 
-    async def image_const_saver(self, content: bytes):
+    def _encode_image(self, content: bytes) -> str:
         """
-        Метод создаёт папку и сохраняет в неё изображение, затем передаёт его на расшифровку и удалет файл.
-        :return: Возвращает ID капчи из сервиса
+        Обрабатывает изображение через `preprocessing`(если передан) и кодирует его в base64
+        :param content: Изображение
+        :return: Изображение в кодировке base64
+        """
+        with span('rucaptcha.encode', image_bytes = len(content)) as encode_span:
+            if self.preprocessing is not None:
+                content = self.preprocessing(content)
+            # локальная проверка размера и формата изображения
+            if self.validation:
+                validate_image(content)
+            body = base64.b64encode(content).decode('utf-8')
+            set_attributes(encode_span, payload_bytes = len(body))
+            return body
+
+    def _attach_image(self, task: SolveTask, content: bytes):
+        """
+        Вносит изображение в запрос: при `upload_method='post'` - байтами(после `preprocessing` и проверки)
+        в multipart запрос, иначе - в кодировке base64 в пайлоад
+        :param task: Данные решаемой капчи
+        :param content: Изображение
+        """
+        if self.upload_method == 'base64':
+            task.post_payload.update({"body": self._encode_image(content)})
+            return
+        with span('rucaptcha.encode', image_bytes = len(content)) as encode_span:
+            if self.preprocessing is not None:
+                content = self.preprocessing(content)
+            # локальная проверка размера и формата изображения
+            if self.validation:
+                validate_image(content)
+            set_attributes(encode_span, payload_bytes = len(content))
+        task.post_payload.update({"method": "post"})
+        task.files = {'file': content}
+
+    async def _submit(self, task: SolveTask, deadline: float = None):
+        """
+        Асинхронный вариант `ImageCaptcha._submit`
+        """
+        if self.local_tier is not None:
+            answer = await self.local_tier.aio_recognize(task.files['file'] if task.files else task.post_payload['body'])
+            if answer is not None:
+                task.result.update({'captchaSolve': answer, 'tier': 'local'})
+                return None
+            task.result['tier'] = 'service'
+        return await self.transport.submit(self.url_request, task.post_payload, files = task.files,
+                                           timeout = request_timeout(deadline))
+
+    async def local_image_captcha(self, content: str, task: SolveTask, content_type: str = 'file',
+                                  deadline: float = None):
+        """
+        Метод получает в качестве параметра ссылку на локальный файл(или файл в кодировке base64), считывает изображение и отправляет его на РуКапчу
+        для проверки и получения её ID
+        :param content: Ссылка на локальный файл
+        :param content_type: Тип передаваемого файла, Может быть `file`(если передан локальный адрес) или
+                            `base64`(если передано изображение в кодировке base64)
+        :param task: Данные решаемой капчи
+        :param deadline: Общий дедлайн решения капчи
+        :return: ID капчи в сервисе
         """
         captcha_id = None
-        try:
 
-            if not os.path.exists(self.img_path):
-                os.mkdir(self.img_path)
+        try:
+            if content_type == 'file':
+                with open(content, 'rb') as captcha_image:
+                    # Отправляем на рукапча изображение капчи и другие парметры,
+                    # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
+                    self._attach_image(task, captcha_image.read())
 
-            # Высчитываем хэш изображения, для того что бы сохранить его под уникальным именем
-            image_hash = hashlib.sha224(content).hexdigest()
+            elif content_type == "base64":
+                # изображение декодируется только для обработки через `preprocessing` или отправки байтами
+                if self.preprocessing is not None or self.upload_method == 'post':
+                    self._attach_image(task, base64.b64decode(content))
+                else:
+                    if self.validation:
+                        validate_image_base64(content)
+                    task.post_payload.update({"body": content})
 
-            with open(os.path.join(self.img_path, f'im-{image_hash}.png'), 'wb') as out_image:
-                out_image.write(content)
+            else:
+                raise ValueError(f'Передан неверный тип контента! Допустимые: `file` и `base64`. '
+                                 f'Вы передали: `{content_type}`')
 
-            with open(os.path.join(self.img_path, f'im-{image_hash}.png'), 'rb') as captcha_image:
-                # Отправляем на рукапча изображение капчи и другие парметры,
-                # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
-                self.post_payload.update({"body": base64.b64encode(captcha_image.read()).decode('utf-8')})
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(self.url_request, data = self.post_payload) as resp:
-                        captcha_id = await resp.json()
+            captcha_id = await self._submit(task, deadline)
 
-            # если передано True для удаления файла капчи после решения
-            if self.img_clearing:
-                # удаляем файл капчи
-                os.remove(os.path.join(self.img_path, f"im-{image_hash}.png"))
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
 
         except (IOError, FileNotFoundError) as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -500,7 +642,7 @@ class aioImageCaptcha:
                                )
 
         except Exception as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -509,35 +651,71 @@ class aioImageCaptcha:
         finally:
             return captcha_id
 
-    async def local_image_captcha(self, content: str, content_type: str = 'file'):
+    async def stream_image_captcha(self, captcha_link: str, task: SolveTask, proxy: str = None, deadline: float = None):
         """
-        Метод получает в качестве параметра ссылку на локальный файл(или файл в кодировке base64), считывает изображение и отправляет его на РуКапчу
-        для проверки и получения её ID
-        :param content: Ссылка на локальный файл
-        :param content_type: Тип передаваемого файла, Может быть `file`(если передан локальный адрес) или
-                            `base64`(если передано изображение в кодировке base64)
-        :return: ID капчи в сервисе
+        Асинхронный вариант `ImageCaptcha.stream_image_captcha`: потоково скачивает изображение по ссылке
+        (не более `download_max_bytes`) и отправляет его на сервер.
+        :param captcha_link: Ссылка на изображение
+        :param task: Данные решаемой капчи
+        :param proxy: Прокси для aiohttp модуля
+        :param deadline: Общий дедлайн решения капчи
+        :return: Возвращает ID капчи из сервиса
         """
+        import asyncio
+
         captcha_id = None
+        out_file = None
 
         try:
-            if content_type == 'file':
-                with open(content, 'rb') as captcha_image:
-                    # Отправляем на рукапча изображение капчи и другие парметры,
-                    # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
-                    self.post_payload.update({"body": base64.b64encode(captcha_image.read()).decode('utf-8')})
+            if self.save_format == 'const':
+                # создаём папку для сохранения капч
+                if not os.path.exists(self.img_path):
+                    os.mkdir(self.img_path)
+                # имя файла известно только после скачивания, поэтому сначала пишем во временный файл
+                out_file = tempfile.NamedTemporaryFile(dir = self.img_path, suffix = '.part', delete = False)
+
+            # исходное изображение сохраняем только если его нужно обработать или отправить байтами
+            with measure_download(self.proxy_pool, proxy):
+                image = await asyncio.wait_for(
+                    aio_stream_download(self.transport, captcha_link, max_bytes = self.download_max_bytes,
+                                        deadline = deadline, keep_content = self.preprocessing is not None or self.upload_method == 'post',
+                                        out_file = out_file, **({'proxy': proxy} if proxy else {})),
+                    timeout = request_timeout(deadline))
+
+            image_path = None
+            if out_file is not None:
+                out_file.close()
+                image_path = os.path.join(self.img_path, f'im-{image.sha224}.png')
+                os.replace(out_file.name, image_path)
+                out_file = None
+
+            if image.content is not None:
+                self._attach_image(task, image.content)
+            else:
+                # локальная проверка размера и формата изображения
+                if self.validation:
+                    validate_image_head(image.head, image.size)
+                task.post_payload.update({"body": image.body})
 
-            elif content_type == "base64":
-                self.post_payload.update({"body": content})
+            # Отправляем на рукапча изображение капчи и другие парметры,
+            # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
+            captcha_id = await self._submit(task, deadline)
 
-            else:
-                raise ValueError(f'Передан неверный тип контента! Допустимые: `file` и `base64`. '
-                                 f'Вы передали: `{content_type}`')
+            # если передано True для удаления файла капчи после решения
+            if image_path and self.img_clearing:
+                os.remove(image_path)
+
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
 
-            captcha_id = requests.post(self.url_request, data = self.post_payload).json()
+        except (TimeoutError, asyncio.TimeoutError):
+            timeout_error(task.result)
 
         except (IOError, FileNotFoundError) as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
@@ -545,18 +723,26 @@ class aioImageCaptcha:
                                )
 
         except Exception as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
                                 }
                                )
+
         finally:
-            return captcha_id
+            # недокачанный файл удаляем
+            if out_file is not None:
+                out_file.close()
+                os.remove(out_file.name)
+
+        return captcha_id
 
     # Работа с капчёй
+    @aio_traced
+    @aio_proxied('aiohttp')
     async def captcha_handler(self, captcha_link: str = None, captcha_file: str = None, captcha_base64: str = None,
-                              proxy: str = None):
+                              proxy: str = None, timeout: float = None):
         """
         Метод получает от вас ссылку на изображение, скачивает его, отправляет изображение на сервер
         RuCaptcha, дожидается решения капчи и вовзращает вам результат
@@ -564,6 +750,7 @@ class aioImageCaptcha:
         :param captcha_file: Адрес(локальный) по которому находится изображение для отправки на расшифровку
         :param captcha_base64: Изображение переданное в кодировке base64
         :param proxy: Прокси для aiohttp модуля
+        :param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
         :return: Ответ на капчу в виде JSON строки с полями:
                     captchaSolve - решение капчи,
                     taskId - находится Id задачи на решение капчи, можно использовать при жалобах и прочем,
@@ -574,94 +761,75 @@ class aioImageCaptcha:
                             id - уникальный номер ошибка в ЭТОЙ бибилотеке
                         }
         """
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+
+        # работа через многопроцессную ферму
+        if self.farm is not None:
+            import asyncio
+
+            kwargs = {'proxies': {'http': proxy, 'https': proxy}} if proxy else {}
+            return await asyncio.wrap_future(
+                self.farm.submit(self.url_request, self.url_response, task.post_payload,
+                                 captcha_link = captcha_link, captcha_file = captcha_file,
+                                 captcha_base64 = captcha_base64,
+                                 timeout = timeout if timeout is not None else self.timeout,
+                                 validation = self.validation, download_max_bytes = self.download_max_bytes,
+                                 upload_method = self.upload_method, **kwargs))
+
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        start = time.monotonic()
 
         # если передана локальная ссылка н файл - работаем с ним
         if captcha_file:
-            captcha_id = await self.local_image_captcha(captcha_file)
+            captcha_id = await self.local_image_captcha(captcha_file, task, deadline = deadline)
         # если передан файл в кодировке base64
         elif captcha_base64:
-            captcha_id = self.local_image_captcha(captcha_base64, content_type = "base64")
+            captcha_id = await self.local_image_captcha(captcha_base64, task, content_type = "base64",
+                                                        deadline = deadline)
 
         elif captcha_link:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url = captcha_link, proxy = proxy) as resp:
-                        content = await resp.content.read()
-            except Exception as error:
-                self.result.update({'error': True,
-                                    'errorBody': {
-                                        'text': error
-                                        }
-                                    }
-                                   )
-                return self.result
-
-            # согласно значения переданного параметра выбираем функцию для сохранения изображения
-            if self.save_format == 'const':
-                captcha_id = await self.image_const_saver(content)
-            elif self.save_format == 'temp':
-                captcha_id = await self.image_temp_saver(content)
+            # изображение скачивается потоково, с ограничением размера
+            captcha_id = await self.stream_image_captcha(captcha_link, task, proxy = proxy, deadline = deadline)
 
         else:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': 'You did not send any file local link or URL.',
                                 }
                                )
-            return self.result
+            return task.result
 
         # проверяем наличие ошибок при скачивании/передаче файла на сервер
-        if self.result['error']:
-            return self.result
+        if task.result['error']:
+            return task.result
 
+        # капча распознана локально
+        elif captcha_id is None:
+            return task.result
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         elif captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
         # Ожидаем решения капчи
-        await asyncio.sleep(self.sleep_time)
-        # отправляем запрос на результат решения капчи, если не решена ожидаем
-        async with aiohttp.ClientSession() as session:
-            while True:
-                try:
-                    async with session.post(self.url_response, data = self.get_payload) as resp:
-                        captcha_response = await resp.json()
-
-                        # если капча ещё не решена - ожидаем
-                        if captcha_response['request'] == 'CAPCHA_NOT_READY':
-                            await asyncio.sleep(self.sleep_time)
-
-                        # при ошибке во время решения
-                        elif captcha_response["status"] == 0:
-                            self.result.update({'error': True,
-                                                'errorBody': RuCaptchaError().errors(captcha_response["request"])
-                                                }
-                                               )
-                            return self.result
-
-                        # при решении капчи
-                        elif captcha_response["status"] == 1:
-                            self.result.update({
-                                'captchaSolve': captcha_response['request']
-                            }
-                            )
-                            return self.result
-
-                except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        if self.hedging is not None:
+            answer = await aio_hedged_result_poller(self.transport, self.url_request, self.url_response,
+                                                    task.post_payload, task.get_payload, self.sleep_time, task.result,
+                                                    self.hedging, deadline = deadline, files = task.files)
+        else:
+            answer = await aio_result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time,
+                                             task.result, deadline = deadline)
+        if self.local_tier is not None:
+            self.local_tier.record_service(time.monotonic() - start, answer['error'])
+        return answer
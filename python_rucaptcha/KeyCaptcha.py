@@ -1,13 +1,9 @@
-import requests
-import time
-import aiohttp
-import asyncio
-from urllib3.exceptions import MaxRetryError
-from requests.adapters import HTTPAdapter
-
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, app_key, \
-    JSON_RESPONSE
-from .errors import RuCaptchaError
+from .config import app_key
+from .errors import RuCaptchaError, LocalValidationError
+from .validators import validate_keycaptcha
+from .transport import service_urls, make_transport, make_aio_transport
+from .polling import CancelToken, SolveTask, make_deadline, request_timeout, result_poller, aio_result_poller
+from .tracing import traced, aio_traced
 
 
 class KeyCaptcha:
@@ -15,77 +11,76 @@ class KeyCaptcha:
     Класс служит для решения KeyCaptcha
     '''
 
-    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15):
+    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, timeout: float=None,
+                 transport=None):
         '''
 
         :param rucaptcha_key: АПИ ключ капчи из кабинета пользователя
         :param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
         :param sleep_time: Время ожидания решения капчи
+        :param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
+        :param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
         '''
         self.RUCAPTCHA_KEY = rucaptcha_key
         if sleep_time < 15:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 5. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': self.RUCAPTCHA_KEY,
                             'action': 'get',
                             'json': 1,
                             }
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
-
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
-
-        # создаём сессию
-        self.session = requests.Session()
-        # выставляем кол-во попыток подключения к серверу при ошибке
-        self.session.mount('http://', HTTPAdapter(max_retries=5))
-
-    def captcha_handler(self, **kwargs):
-        # считываем все переданные параметры KeyCaptcha
+        self.url_request, self.url_response = service_urls(service_type)
+
+        # HTTP транспорт
+        self.transport = make_transport(transport)
+
+    @traced
+    def captcha_handler(self, timeout: float=None, cancel_token: CancelToken=None, **kwargs):
+        # результат и пайлоады этого вызова
+        task = SolveTask(get_payload = self.get_payload)
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        # локальная проверка параметров до отправки на сервер
         try:
-            self.s_s_c_user_id = kwargs['s_s_c_user_id']
-            self.s_s_c_session_id = kwargs['s_s_c_session_id']
-            self.s_s_c_web_server_sign = kwargs['s_s_c_web_server_sign']
-            self.s_s_c_web_server_sign2 = kwargs['s_s_c_web_server_sign2']
-            self.page_url = kwargs['page_url']
-        except KeyError as error:
-            self.result.update({'error': True,
-                                'errorBody': {
-                                    'text': error
-                                    }
+            validate_keycaptcha(kwargs)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
                                 }
                                )
-            return self.result
+            return task.result
+
+        # считываем все переданные параметры KeyCaptcha
+        s_s_c_user_id = kwargs['s_s_c_user_id']
+        s_s_c_session_id = kwargs['s_s_c_session_id']
+        s_s_c_web_server_sign = kwargs['s_s_c_web_server_sign']
+        s_s_c_web_server_sign2 = kwargs['s_s_c_web_server_sign2']
+        page_url = kwargs['page_url']
 
         # передаём параметры кей капчи для решения
-        captcha_id = self.session.post(url=self.url_request, json={'key': self.RUCAPTCHA_KEY,
-                                                                   's_s_c_user_id': self.s_s_c_user_id,
-                                                                   's_s_c_session_id': self.s_s_c_session_id,
-                                                                   's_s_c_web_server_sign': self.s_s_c_web_server_sign,
-                                                                   's_s_c_web_server_sign2': self.s_s_c_web_server_sign2,
-                                                                   'method': 'keycaptcha',
-                                                                   'pageurl': self.page_url,
-                                                                   'json': 1,
-                                                                   'soft_id': app_key}).json()
+        captcha_id = self.transport.submit(self.url_request, {'key': self.RUCAPTCHA_KEY,
+                                                              's_s_c_user_id': s_s_c_user_id,
+                                                              's_s_c_session_id': s_s_c_session_id,
+                                                              's_s_c_web_server_sign': s_s_c_web_server_sign,
+                                                              's_s_c_web_server_sign2': s_s_c_web_server_sign2,
+                                                              'method': 'keycaptcha',
+                                                              'pageurl': page_url,
+                                                              'json': 1,
+                                                              'soft_id': app_key},
+                                           timeout=request_timeout(deadline))
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
 
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
@@ -94,54 +89,13 @@ class KeyCaptcha:
             # отправляем запрос на результат решения капчи, если ещё капча не решена - ожидаем 5 сек
             # если всё ок - идём дальше
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
             # Ожидаем решения капчи
-            time.sleep(self.sleep_time)
-            while True:
-                try:
-                    # отправляем запрос на результат решения капчи, если не решена ожидаем
-                    captcha_response = self.session.post(self.url_response, data=self.get_payload)
-
-                    # если капча ещё не решена - ожидаем
-                    if captcha_response.json()['request'] == 'CAPCHA_NOT_READY':
-                        time.sleep(self.sleep_time)
-
-                    # при ошибке во время решения
-                    elif captcha_response.json()["status"] == 0:
-                        self.result.update({'error': True,
-                                            'errorBody': RuCaptchaError().errors(captcha_response.json()["request"])
-                                            }
-                                           )
-                        return self.result
-
-                    # при решении капчи
-                    elif captcha_response.json()["status"] == 1:
-                        self.result.update({
-                                            'captchaSolve': captcha_response.json()['request']
-                                            }
-                                           )
-                        return self.result
-
-                except (TimeoutError, ConnectionError, MaxRetryError) as error:
-                        self.result.update({'error': True,
-                                            'errorBody': {
-                                                'text': error
-                                                }
-                                            }
-                                           )
-                        return self.result
-
-                except Exception as error:
-                        self.result.update({'error': True,
-                                            'errorBody': {
-                                                'text': error
-                                                }
-                                            }
-                                           )
-                        return self.result
+            return result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time, task.result,
+                                 deadline = deadline, cancel_token = cancel_token)
 
 
 # асинхронный метод для решения FunCaptcha
@@ -150,33 +104,30 @@ class aioKeyCaptcha:
     Класс служит для решения KeyCaptcha
     '''
 
-    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, **kwargs):
+    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', sleep_time: int=15, timeout: float=None,
+                 transport=None, **kwargs):
         '''
 
         :param rucaptcha_key: АПИ ключ капчи из кабинета пользователя
         :param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
         :param sleep_time: Время ожидания решения капчи
+        :param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
+        :param transport: HTTP транспорт: объект `transport.AioTransport` или название бэкенда(`aiohttp`, `httpx`, `fake`)
         '''
         self.RUCAPTCHA_KEY = rucaptcha_key
         if sleep_time < 15:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 5. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': self.RUCAPTCHA_KEY,
                             'action': 'get',
                             'json': 1,
                             }
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад POST запроса на отправку капчи на сервер
         self.post_payload = {"key": rucaptcha_key,
@@ -193,100 +144,76 @@ class aioKeyCaptcha:
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
+
+        # HTTP транспорт
+        self.transport = make_aio_transport(transport)
+
+    async def close(self):
+        """
+        Закрывает соединения транспорта
+        """
+        await self.transport.close()
 
     # Работа с капчей
-    async def captcha_handler(self, **kwargs):
-        # считываем все переданные параметры KeyCaptcha
+    @aio_traced
+    async def captcha_handler(self, timeout: float=None, **kwargs):
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        # локальная проверка параметров до отправки на сервер
         try:
-            self.s_s_c_user_id = kwargs['s_s_c_user_id']
-            self.s_s_c_session_id = kwargs['s_s_c_session_id']
-            self.s_s_c_web_server_sign = kwargs['s_s_c_web_server_sign']
-            self.s_s_c_web_server_sign2 = kwargs['s_s_c_web_server_sign2']
-            self.page_url = kwargs['page_url']
-        except KeyError as error:
-            self.result.update({'error': True,
-                                'errorBody': {
-                                    'text': error
-                                    }
+            validate_keycaptcha(kwargs)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
                                 }
                                )
-            return self.result
+            return task.result
+
+        # считываем все переданные параметры KeyCaptcha
+        s_s_c_user_id = kwargs['s_s_c_user_id']
+        s_s_c_session_id = kwargs['s_s_c_session_id']
+        s_s_c_web_server_sign = kwargs['s_s_c_web_server_sign']
+        s_s_c_web_server_sign2 = kwargs['s_s_c_web_server_sign2']
+        page_url = kwargs['page_url']
         try:
             # получаем ID капчи
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url=self.url_request, data={'key': self.RUCAPTCHA_KEY,
-                                                                    's_s_c_user_id': self.s_s_c_user_id,
-                                                                    's_s_c_session_id': self.s_s_c_session_id,
-                                                                    's_s_c_web_server_sign': self.s_s_c_web_server_sign,
-                                                                    's_s_c_web_server_sign2': self.s_s_c_web_server_sign2,
-                                                                    'method': 'keycaptcha',
-                                                                    'pageurl': self.page_url,
-                                                                    'json': 1,
-                                                                    'soft_id': app_key}) as resp:
-
-                    captcha_id = await resp.json()
+            captcha_id = await self.transport.submit(self.url_request, {'key': self.RUCAPTCHA_KEY,
+                                                                        's_s_c_user_id': s_s_c_user_id,
+                                                                        's_s_c_session_id': s_s_c_session_id,
+                                                                        's_s_c_web_server_sign': s_s_c_web_server_sign,
+                                                                        's_s_c_web_server_sign2': s_s_c_web_server_sign2,
+                                                                        'method': 'keycaptcha',
+                                                                        'pageurl': page_url,
+                                                                        'json': 1,
+                                                                        'soft_id': app_key})
 
         except Exception as error:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': {
                                     'text': error
                                     }
                                 }
                                )
-            return self.result
+            return task.result
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         captcha_id = captcha_id['request']
 
         # отправляем запрос на результат решения капчи, если ещё капча не решена - ожидаем 5 сек
         # если всё ок - идём дальше
         # вписываем в taskId ключ отправленной на решение капчи
-        self.result.update({"taskId": captcha_id})
+        task.result.update({"taskId": captcha_id})
         # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-        self.get_payload.update({'id': captcha_id})
+        task.get_payload.update({'id': captcha_id})
 
         # Ожидаем решения капчи
-        await asyncio.sleep(self.sleep_time)
-        # отправляем запрос на результат решения капчи, если не решена ожидаем
-        async with aiohttp.ClientSession() as session:
-            while True:
-                try:
-                    async with session.post(self.url_response, data=self.get_payload) as resp:
-                        captcha_response = await resp.json()
-
-                        # если капча ещё не решена - ожидаем
-                        if captcha_response['request'] == 'CAPCHA_NOT_READY':
-                            await asyncio.sleep(self.sleep_time)
-
-                        # при ошибке во время решения
-                        elif captcha_response["status"] == 0:
-                            self.result.update({'error': True,
-                                                'errorBody': RuCaptchaError().errors(captcha_response["request"])
-                                                }
-                                               )
-                            return self.result
-
-                        # при успешном решении капчи
-                        elif captcha_response["status"] == 1:
-                            self.result.update({
-                                                'captchaSolve': captcha_response['request']
-                                                }
-                                               )
-                            return self.result
-
-                except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        return await aio_result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time,
+                                       task.result, deadline = deadline)
@@ -1,13 +1,13 @@
-import requests
 import os, shutil
-import time
 import hashlib
-from urllib3.exceptions import MaxRetryError
-from requests.adapters import HTTPAdapter
 
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, app_key,\
-    JSON_RESPONSE
-from .errors import RuCaptchaError
+from .config import app_key
+from .errors import RuCaptchaError, LocalValidationError
+from .transport import service_urls, make_transport
+from .download import stream_download
+from .polling import CancelToken, SolveTask, make_deadline, request_timeout, result_poller
+from .tracing import traced
+from .validators import validate_audio
 
 
 class MediaCaptcha:
@@ -15,7 +15,8 @@ class MediaCaptcha:
     Класс MediaCaptcha используется для решения аудиокапчи из ReCaptcha v2 и SolveMediaCaptcha
     """
     def __init__(self, rucaptcha_key: str, service_type: str='2captcha', recaptchavoice: bool=False,
-                 solveaudio: bool=False, sleep_time: int=5, **kwargs):
+                 solveaudio: bool=False, sleep_time: int=5, timeout: float=None, validation: bool=True,
+                 transport=None, **kwargs):
         """
         Метод создаёт папки, принимает параметры для работы c различными типами капчи.
         :param rucaptcha_key: Ключ от сайта RuCaptcha
@@ -24,21 +25,20 @@ class MediaCaptcha:
         :param recaptchavoice: Передать True, если передаваемая капча является ReCaptcha
         :param solveaudio: Передать True, если передаваемая капча является SolveMedia
         :param sleep_time: Время ожидания решения капчи
+        :param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
+        :param validation: True - проверять размер и формат аудио файла до отправки на сервер
+        :param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
         """
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         if sleep_time < 5:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 10. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
+        # локальная проверка аудио файла
+        self.validation = validation
 
         self.audio_path = os.path.normpath('mediacaptcha_audio')
 
@@ -69,16 +69,14 @@ class MediaCaptcha:
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
 
-        # создаём сессию
-        self.session = requests.Session()
-        # выставляем кол-во попыток подключения к серверу при ошибке
-        self.session.mount('http://', HTTPAdapter(max_retries=5))
+        # HTTP транспорт
+        self.transport = make_transport(transport)
 
     # Работа с капчёй
-    def captcha_handler(self, audio_name: str=None, audio_download_link: str=None):
+    @traced
+    def captcha_handler(self, audio_name: str=None, audio_download_link: str=None, timeout: float=None,
+                        cancel_token: CancelToken=None):
         """
         Метод полчает параметры и аозвращает решение капчи.
         Передаётся лишь один из параметров, либо audio_name либо audio_download_link.
@@ -86,23 +84,49 @@ class MediaCaptcha:
                             скриптом.
         :param audio_download_link: Передаётся ссылка для скачивания аудио файла. Не ссылка на капчу или ещё что-либо.
                                     А именно ссылка по которой можно скачать аудио файл. Для последующей отправке RuCaptcha.
+        :param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
+        :param cancel_token: `CancelToken` для отмены ожидания решения из другого потока
         :return: Возвращает решение капчи.
         """
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
         if audio_name or audio_download_link:
             # Если передано имя файла - ищем его в папке, перименовываем
             if audio_name:
                 audio_hash = hashlib.sha224(audio_name.encode('utf-8')).hexdigest()
                 with open(os.path.join(self.audio_path, audio_name), 'rb') as audio_src:
-                    with open(os.path.join(self.audio_path, f'aud-{audio_hash}.mp3'), 'wb') as audio_hash_src:
-                        audio_hash_src.write(audio_src.read())
+                    content = audio_src.read()
 
             # Если передана ссылка - скачиваем файл в папку, переименовываем и сохраняем
             elif audio_download_link:
                 audio_hash = hashlib.sha224(audio_download_link.encode('utf-8')).hexdigest()
-                content = requests.get(audio_download_link).content
+                try:
+                    # файл скачивается потоково, с ограничением размера
+                    content = stream_download(self.transport, audio_download_link, deadline=deadline,
+                                              keep_content=True).content
+                except LocalValidationError as error:
+                    task.result.update({'error': True,
+                                        'errorBody': error.answer()
+                                        }
+                                       )
+                    return task.result
 
-                with open(os.path.join(self.audio_path,f'aud-{audio_hash}.mp3'), 'wb') as out:
-                    out.write(content)
+            # локальная проверка параметров до отправки на сервер
+            try:
+                if self.validation:
+                    validate_audio(content)
+            except LocalValidationError as error:
+                task.result.update({'error': True,
+                                    'errorBody': error.answer()
+                                    }
+                                   )
+                return task.result
+
+
+            with open(os.path.join(self.audio_path, f'aud-{audio_hash}.mp3'), 'wb') as out:
+                out.write(content)
         else:
             raise ValueError('Не передан ни один из параметров для открытия аудио(audio_name) или скачивания(audio_download_link)'
                              'One parameter is required: audio_name or audio_download_link')
@@ -113,68 +137,27 @@ class MediaCaptcha:
 
             # Отправляем на рукапча аудио капчи и другие парметры,
             # в результате получаем JSON ответ с номером решаемой капчи и получая ответ - извлекаем номер
-            captcha_id = requests.request('POST',
-                                           self.url_request,
-                                           data=self.post_payload,
-                                           files=files).json()
+            captcha_id = self.transport.submit(self.url_request,
+                                               task.post_payload,
+                                               files=files,
+                                               timeout=request_timeout(deadline))
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
         # удаляем файл капчи
         os.remove(os.path.join(self.audio_path, f'aud-{audio_hash}.mp3'))
         # Ожидаем решения капчи
-        time.sleep(self.sleep_time)
-        while True:
-            try:
-                # отправляем запрос на результат решения капчи, если не решена ожидаем
-                captcha_response = self.session.post(self.url_response, data=self.get_payload)
-
-                # если капча ещё не решена - ожидаем
-                if captcha_response.json()['request'] == 'CAPCHA_NOT_READY':
-                    time.sleep(self.sleep_time)
-
-                # при ошибке во время решения
-                elif captcha_response.json()["status"] == 0:
-                    self.result.update({'error': True,
-                                        'errorBody': RuCaptchaError().errors(captcha_response.json()["request"])
-                                        }
-                                       )
-                    return self.result
-
-                # при решении капчи
-                elif captcha_response.json()["status"] == 1:
-                    self.result.update({
-                                        'captchaSolve': captcha_response.json()['request']
-                                        }
-                                       )
-                    return self.result
-
-            except (TimeoutError, ConnectionError, MaxRetryError) as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
-
-            except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        return result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time, task.result,
+                             deadline = deadline, cancel_token = cancel_token)
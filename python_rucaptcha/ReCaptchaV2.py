@@ -1,13 +1,11 @@
-import requests
-import time
-import asyncio
-import aiohttp
-from requests.adapters import HTTPAdapter
-from urllib3.exceptions import MaxRetryError
-
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, app_key, \
-    JSON_RESPONSE
-from .errors import RuCaptchaError
+from .config import app_key
+from .errors import RuCaptchaError, LocalValidationError
+from .validators import validate_recaptcha
+from .transport import service_urls, make_transport, make_aio_transport
+from .polling import CancelToken, SolveTask, make_deadline, request_timeout, result_poller, aio_result_poller
+from .tracing import traced, aio_traced
+from .proxies import ProxyPool, proxied, aio_proxied
+from .hedging import HedgePolicy, hedged_result_poller, aio_hedged_result_poller
 
 
 class ReCaptchaV2:
@@ -18,23 +16,33 @@ class ReCaptchaV2:
 	"""
 
     def __init__(self, rucaptcha_key, service_type: str = '2captcha', sleep_time: int = 10, invisible: int = 0,
-                 proxy: str = '', proxytype: str = ''):
+                 proxy: str = '', proxytype: str = '', timeout: float = None, farm = None, transport = None,
+                 hedging: HedgePolicy = None, proxy_pool: ProxyPool = None):
         """
 		Инициализация нужных переменных.
 		:param rucaptcha_key:  АПИ ключ капчи из кабинета пользователя
 		:param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
 		:param sleep_time: Вермя ожидания решения капчи
+		:param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
 		:param proxy: Для решения рекапчи через прокси - передаётся прокси и данные для аутентификации.
 		                ` логин:пароль@IP_адрес:ПОРТ` / `login:password@IP:port`.
 		:param proxytype: Тип используемого прокси. Доступные: `HTTP`, `HTTPS`, `SOCKS4`, `SOCKS5`.
 		:param invisible: Для решения невидимой ReCaptcha нужно выставить параметр 1
+		:param farm: `SolverFarm` - отправка и ожидание решения выполняются процессами фермы
+		:param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
+		:param hedging: `hedging.HedgePolicy` - дублирующая отправка капчи, не решённой за перцентиль времени решения
+		:param proxy_pool: `proxies.ProxyPool` - каждая капча решается через прокси из пула вместо `proxy`
 		"""
         # проверка введённого времени и изменение если минимальный порог нарушен
         if sleep_time < 10:
             raise ValueError(f'\nПараметр `sleep_time` должен быть не менее 10(рекомендуемое - 20 секунд). '
                              f'\n\tВы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
+        # многопроцессная ферма для решения капчи
+        self.farm = farm
         # проверка допустимости переданного параметра для невидимой/обыкновенной капчи
         if invisible not in (0, 1):
             raise ValueError(f'\nПараметр `invisible` может быть равен 1 или 0. \n\tВы передали - {invisible}')
@@ -51,103 +59,88 @@ class ReCaptchaV2:
                                       'proxytype': proxytype})
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': rucaptcha_key,
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
 
-        # создаём сессию
-        self.session = requests.Session()
-        # выставляем кол-во попыток подключения к серверу при ошибке
-        self.session.mount('http://', HTTPAdapter(max_retries = 5))
+        # HTTP транспорт
+        self.transport = make_transport(transport)
+        # политика дублирующей отправки
+        self.hedging = hedging
+        # пул прокси
+        self.proxy_pool = proxy_pool
 
     # Работа с капчей
     # тестовый ключ сайта
-    def captcha_handler(self, site_key: str, page_url: str):
+    @traced
+    @proxied('service')
+    def captcha_handler(self, site_key: str, page_url: str, timeout: float = None, cancel_token: CancelToken = None,
+                        proxy: str = None, proxytype: str = None):
         '''
 		Метод отвечает за передачу данных на сервер для решения капчи
 		:param site_key: Гугл-ключ сайта
 		:param page_url: Ссылка на страницу на которой находится капча
+		:param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
+		:param proxy: Прокси для решения этой капчи вместо `proxy` из `__init__` и пула прокси
+		:param proxytype: Тип прокси для решения этой капчи
+		:param cancel_token: `CancelToken` для отмены ожидания решения из другого потока
 		:return: В качестве ответа переждаётся строка которую нужно вставить для отправки гуглу на проверку
 		'''
-        self.post_payload.update({'googlekey': site_key,
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # локальная проверка параметров до отправки на сервер
+        try:
+            validate_recaptcha(site_key, page_url)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
+            return task.result
+
+        task.post_payload.update({'googlekey': site_key,
                                   'pageurl': page_url})
+        # прокси этого вызова
+        if proxy and proxytype:
+            task.post_payload.update({'proxy': proxy,
+                                      'proxytype': proxytype})
+        # работа через многопроцессную ферму
+        if self.farm is not None:
+            return self.farm.solve(self.url_request, self.url_response, task.post_payload,
+                                   timeout = timeout if timeout is not None else self.timeout,
+                                   cancel_token = cancel_token)
+
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
         # получаем ID капчи
-        captcha_id = self.session.post(self.url_request, data = self.post_payload).json()
+        captcha_id = self.transport.submit(self.url_request, task.post_payload, timeout = request_timeout(deadline))
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
-        # Ожидаем решения капчи 20 секунд
         # Ожидаем решения капчи
-        time.sleep(self.sleep_time)
-        while True:
-            try:
-                # отправляем запрос на результат решения капчи, если не решена ожидаем
-                captcha_response = self.session.post(self.url_response, data = self.get_payload)
-
-                # если капча ещё не решена - ожидаем
-                if captcha_response.json()['request'] == 'CAPCHA_NOT_READY':
-                    time.sleep(self.sleep_time)
-
-                # при ошибке во время решения
-                elif captcha_response.json()["status"] == 0:
-                    self.result.update({'error': True,
-                                        'errorBody': RuCaptchaError().errors(captcha_response.json()["request"])
-                                        }
-                                       )
-                    return self.result
-
-                # при решении капчи
-                elif captcha_response.json()["status"] == 1:
-                    self.result.update({
-                                        'captchaSolve': captcha_response.json()['request']
-                                        }
-                                       )
-                    return self.result
-
-            except (TimeoutError, ConnectionError, MaxRetryError) as error:
-                self.result.update({'error': True,
-                                    'errorBody': {
-                                        'text': error
-                                        }
-                                    }
-                                   )
-                return self.result
-
-            except Exception as error:
-                self.result.update({'error': True,
-                                    'errorBody': {
-                                        'text': error
-                                        }
-                                    }
-                                   )
-                return self.result
+        if self.hedging is not None:
+            return hedged_result_poller(self.transport, self.url_request, self.url_response, task.post_payload,
+                                        task.get_payload, self.sleep_time, task.result, self.hedging,
+                                        deadline = deadline, cancel_token = cancel_token)
+        return result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time, task.result,
+                             deadline = deadline, cancel_token = cancel_token)
 
 
 # асинхронный метод для решения РеКапчи 2
@@ -159,21 +152,31 @@ class aioReCaptchaV2:
 	"""
 
     def __init__(self, rucaptcha_key: str, service_type: str = '2captcha', sleep_time: int = 10, invisible: int = 0, proxy: str = '',
-                 proxytype: str = ''):
+                 proxytype: str = '', timeout: float = None, farm = None, transport = None,
+                 hedging: HedgePolicy = None, proxy_pool: ProxyPool = None):
         """
 		Инициализация нужных переменных.
 		:param rucaptcha_key:  АПИ ключ капчи из кабинета пользователя
 		:param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
 		:param sleep_time: Время ожидания решения капчи
+		:param timeout: Общее время ожидания решения капчи в секундах, None - без ограничения
 		:param proxy: Для решения рекапчи через прокси - передаётся прокси и данные для аутентификации.
 		                ` логин:пароль@IP_адрес:ПОРТ` / `login:password@IP:port`.
 		:param proxytype: Тип используемого прокси. Доступные: `HTTP`, `HTTPS`, `SOCKS4`, `SOCKS5`.
 		:param invisible: Для решения невидимой ReCaptcha нужно выставить параметр 1
+		:param farm: `SolverFarm` - отправка и ожидание решения выполняются процессами фермы
+		:param transport: HTTP транспорт: объект `transport.AioTransport` или название бэкенда(`aiohttp`, `httpx`, `fake`)
+		:param hedging: `hedging.HedgePolicy` - дублирующая отправка капчи, не решённой за перцентиль времени решения
+		:param proxy_pool: `proxies.ProxyPool` - каждая капча решается через прокси из пула вместо `proxy`
 		"""
         if sleep_time < 10:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 10. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
+        # многопроцессная ферма для решения капчи
+        self.farm = farm
         # проверка допустимости переданного параметра для невидимой/обыкновенной капчи
         if invisible not in (0, 1):
             raise ValueError(f'\nПараметр `invisible` может быть равен 1 или 0. \n\tВы передали - {invisible}')
@@ -191,87 +194,91 @@ class aioReCaptchaV2:
                                       'proxytype': proxytype})
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': rucaptcha_key,
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
+
+        # HTTP транспорт
+        self.transport = make_aio_transport(transport)
+        # политика дублирующей отправки
+        self.hedging = hedging
+        # пул прокси
+        self.proxy_pool = proxy_pool
+
+    async def close(self):
+        """
+        Закрывает соединения транспорта
+        """
+        await self.transport.close()
 
     # Работа с капчей
-    async def captcha_handler(self, site_key: str, page_url: str):
+    @aio_traced
+    @aio_proxied('service')
+    async def captcha_handler(self, site_key: str, page_url: str, timeout: float = None, proxy: str = None,
+                              proxytype: str = None):
         '''
 		Метод отвечает за передачу данных на сервер для решения капчи
 		:param site_key: Гугл-ключ сайта
 		:param page_url: Ссылка на страницу на которой находится капча
+		:param timeout: Общее время ожидания решения капчи в секундах, по умолчанию берётся из `__init__`
+		:param proxy: Прокси для решения этой капчи вместо `proxy` из `__init__` и пула прокси
+		:param proxytype: Тип прокси для решения этой капчи
 		:return: В качестве ответа переждаётся строка которую нужно вставить для отправки гуглу на проверку
 		'''
-        self.post_payload.update({'googlekey': site_key, 'pageurl': page_url})
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # локальная проверка параметров до отправки на сервер
+        try:
+            validate_recaptcha(site_key, page_url)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
+            return task.result
+
+        task.post_payload.update({'googlekey': site_key, 'pageurl': page_url})
+        # прокси этого вызова
+        if proxy and proxytype:
+            task.post_payload.update({'proxy': proxy,
+                                      'proxytype': proxytype})
+        # работа через многопроцессную ферму
+        if self.farm is not None:
+            import asyncio
+
+            return await asyncio.wrap_future(
+                self.farm.submit(self.url_request, self.url_response, task.post_payload,
+                                 timeout = timeout if timeout is not None else self.timeout))
+
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
         # получаем ID капчи
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url_request, data = self.post_payload) as resp:
-                captcha_id = await resp.json()
+        captcha_id = await self.transport.submit(self.url_request, task.post_payload,
+                                                 timeout = request_timeout(deadline))
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
         # Ожидаем решения капчи
-        await asyncio.sleep(self.sleep_time)
-        # отправляем запрос на результат решения капчи, если не решена ожидаем
-        async with aiohttp.ClientSession() as session:
-            while True:
-                try:
-                    async with session.post(self.url_response, data = self.get_payload) as resp:
-                        captcha_response = await resp.json()
-
-                        # если капча ещё не решена - ожидаем
-                        if captcha_response['request'] == 'CAPCHA_NOT_READY':
-                            await asyncio.sleep(self.sleep_time)
-
-                        # при ошибке во время решения
-                        elif captcha_response["status"] == 0:
-                            self.result.update({'error': True,
-                                                'errorBody': RuCaptchaError().errors(captcha_response["request"])
-                                                }
-                                               )
-                            return self.result
-
-                        # при решении капчи
-                        elif captcha_response["status"] == 1:
-                            self.result.update({
-                                                'captchaSolve': captcha_response['request']
-                                                }
-                                               )
-                            return self.result
-
-                except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        if self.hedging is not None:
+            return await aio_hedged_result_poller(self.transport, self.url_request, self.url_response, task.post_payload,
+                                                  task.get_payload, self.sleep_time, task.result, self.hedging,
+                                                  deadline = deadline)
+        return await aio_result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time,
+                                       task.result, deadline = deadline)
@@ -1,34 +1,28 @@
-import requests
-
 from .errors import RuCaptchaError
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, \
-    JSON_RESPONSE
+from .transport import service_urls, make_transport
+from .polling import new_result
 
 
 class RuCaptchaControl:
-    def __init__(self, rucaptcha_key: str, service_type: str='2captcha'):
+    def __init__(self, rucaptcha_key: str, service_type: str='2captcha', transport=None, memo=None):
         """
         Модуль отвечает за дополнительные действия с аккаунтом и капчей.
         :param rucaptcha_key: Ключ от RuCaptcha
 		:param service_type: URL с которым будет работать программа, возможен вариант "2captcha"(стандартный)
                              и "rucaptcha"
+        :param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
+        :param memo: `memo.AnswerMemo` - при жалобе `reportbad` ответ задачи удаляется из памяти ответов
         """
         self.payload = {'key': rucaptcha_key,
                         'json': 1,
                         }
-        # результат возвращаемый методом *additional_methods*
-        self.result = JSON_RESPONSE
-
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
+
+        # HTTP транспорт
+        self.transport = make_transport(transport)
+        # память ответов текстовых капч
+        self.memo = memo
 
     def additional_methods(self, action: str, **kwargs):
         """
@@ -48,33 +42,40 @@ class RuCaptchaControl:
         Больше подробностей и примеров можно прочитать в 'CaptchaTester/rucaptcha_control_example.py'
         """
 
+        # результат и пайлоад этого вызова
+        result = new_result()
+        payload = dict(self.payload)
         # Если переданы ещё параметры - вносим их в payload
         if kwargs:
             for key in kwargs:
-                self.payload.update({key: kwargs[key]})
+                payload.update({key: kwargs[key]})
+
+        payload.update({'action': action})
 
-        self.payload.update({'action': action})
+        # неверный ответ больше не используется из памяти, даже если сервис не примет жалобу
+        if action == 'reportbad' and self.memo is not None and 'id' in payload:
+            self.memo.invalidate(payload['id'])
 
         try:
             # отправляем на сервер данные с вашим запросом
-            answer = requests.post(self.url_response, data = self.payload)
+            answer = self.transport.control(self.url_response, payload)
         except Exception as error:
-            self.result.update({'error': True,
-                                'errorBody': error,
-                                }
-                               )
-            return self.result
+            result.update({'error': True,
+                           'errorBody': error,
+                           }
+                          )
+            return result
 
-        if answer.json()["status"] == 0:
-            self.result.update({'error': True,
-                                'errorBody': RuCaptchaError().errors(answer.json()["request"])
-                                }
-                               )
-            return self.result
+        if answer["status"] == 0:
+            result.update({'error': True,
+                           'errorBody': RuCaptchaError().errors(answer["request"])
+                           }
+                          )
+            return result
 
-        elif answer.json()["status"] == 1:
-            self.result.update({
-                                'serverAnswer': answer.json()['request']
-                                }
-                               )
-            return self.result
+        elif answer["status"] == 1:
+            result.update({
+                           'serverAnswer': answer['request']
+                           }
+                          )
+            return result
@@ -1,18 +1,27 @@
-import requests
-import time
-from urllib3.exceptions import MaxRetryError
-from requests.adapters import HTTPAdapter
-
-from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha, app_key, \
-    JSON_RESPONSE
-from .errors import RuCaptchaError
+from .config import app_key
+from .errors import RuCaptchaError, LocalValidationError
+from .validators import validate_text
+from .transport import service_urls, make_transport
+from .polling import CancelToken, SolveTask, make_deadline, request_timeout, result_poller, when_done
+from .tracing import traced
+from .singleflight import SingleFlight
+from .memo import AnswerMemo
 
 
 class TextCaptcha:
-    def __init__(self, rucaptcha_key: str, sleep_time: int=5, service_type: str='2captcha', **kwargs):
+    def __init__(self, rucaptcha_key: str, sleep_time: int=5, service_type: str='2captcha', timeout: float=None,
+                 transport=None, single_flight: SingleFlight=None, memo: AnswerMemo=None, **kwargs):
+        """
+        :param transport: HTTP транспорт: объект `transport.Transport` или название бэкенда(`requests`, `httpx`, `fake`)
+        :param single_flight: `singleflight.SingleFlight` - одинаковые(после нормализации) одновременно решаемые
+                              тексты отправляются на сервер один раз
+        :param memo: `memo.AnswerMemo` - повторяющиеся вопросы решаются по запомненным ответам сервиса
+        """
         if sleep_time < 5:
             raise ValueError(f'Параметр `sleep_time` должен быть не менее 10. Вы передали - {sleep_time}')
         self.sleep_time = sleep_time
+        # общее время ожидания решения капчи, None - без ограничения
+        self.timeout = timeout
         # пайлоад POST запроса на отправку капчи на сервер
         self.post_payload = {"key": rucaptcha_key,
                              "method": "post",
@@ -25,93 +34,78 @@ class TextCaptcha:
                 self.post_payload.update({key: kwargs[key]})
 
         # выбираем URL на который будут отпраляться запросы и с которого будут приходить ответы
-        if service_type == '2captcha':
-            self.url_request = url_request_2captcha
-            self.url_response = url_response_2captcha
-        elif service_type == 'rucaptcha':
-            self.url_request = url_request_rucaptcha
-            self.url_response = url_response_rucaptcha
-        else:
-            raise ValueError('Передан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
-                             'Wrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.')
+        self.url_request, self.url_response = service_urls(service_type)
 
         # пайлоад GET запроса на получение результата решения капчи
         self.get_payload = {'key': rucaptcha_key,
                             'action': 'get',
                             'json': 1,
                             }
-        # результат возвращаемый методом *captcha_handler*
-        self.result = JSON_RESPONSE
 
-        # создаём сессию
-        self.session = requests.Session()
-        # выставляем кол-во попыток подключения к серверу при ошибке
-        self.session.mount('http://', HTTPAdapter(max_retries=5))
+        # HTTP транспорт
+        self.transport = make_transport(transport)
+        # объединение одинаковых капч
+        if single_flight is not None:
+            self.transport = single_flight.transport(self.transport)
+        # память ответов
+        self.memo = memo
+
+    @traced
+    def captcha_handler(self, captcha_text: str, timeout: float=None, cancel_token: CancelToken=None):
+        # результат и пайлоады этого вызова
+        task = SolveTask(self.post_payload, self.get_payload)
+        # общий дедлайн решения капчи
+        deadline = make_deadline(timeout if timeout is not None else self.timeout)
+        # локальная проверка параметров до отправки на сервер
+        try:
+            validate_text(captcha_text)
+        except LocalValidationError as error:
+            task.result.update({'error': True,
+                                'errorBody': error.answer()
+                                }
+                               )
+            return task.result
+
+        # ответ из памяти, без отправки на сервер
+        if self.memo is not None:
+            remembered = self.memo.lookup(captcha_text, self.post_payload.get('lang'))
+            if remembered is not None:
+                task.result.update({'captchaSolve': remembered[0],
+                                    'taskId': remembered[1],
+                                    'memo': remembered[2],
+                                    }
+                                   )
+                return task.result
 
-    def captcha_handler(self, captcha_text: str):
         # Создаём пайлоад, вводим ключ от сайта, выбираем метод ПОСТ и ждём ответа. в JSON-формате
-        self.post_payload.update({"textcaptcha": captcha_text})
+        task.post_payload.update({"textcaptcha": captcha_text})
         # Отправляем на рукапча текст капчи и ждём ответа
         #  в результате получаем JSON ответ с номером решаемой капчи
-        captcha_id = self.session.post(self.url_request,
-                                   data=self.post_payload).json()
+        captcha_id = self.transport.submit(self.url_request, task.post_payload, timeout=request_timeout(deadline))
 
         # если вернулся ответ с ошибкой то записываем её и возвращаем результат
         if captcha_id['status'] is 0:
-            self.result.update({'error': True,
+            task.result.update({'error': True,
                                 'errorBody': RuCaptchaError().errors(captcha_id['request'])
                                 }
                                )
-            return self.result
+            return task.result
         # иначе берём ключ отправленной на решение капчи и ждём решения
         else:
             captcha_id = captcha_id['request']
             # вписываем в taskId ключ отправленной на решение капчи
-            self.result.update({"taskId": captcha_id})
+            task.result.update({"taskId": captcha_id})
             # обновляем пайлоад, вносим в него ключ отправленной на решение капчи
-            self.get_payload.update({'id': captcha_id})
+            task.get_payload.update({'id': captcha_id})
 
         # Ожидаем решения капчи
-        time.sleep(self.sleep_time)
-        while True:
-            try:
-                # отправляем запрос на результат решения капчи, если не решена ожидаем
-                captcha_response = self.session.post(self.url_response, data=self.get_payload)
-
-                # если капча ещё не решена - ожидаем
-                if captcha_response.json()['request'] == 'CAPCHA_NOT_READY':
-                    time.sleep(self.sleep_time)
-
-                # при ошибке во время решения
-                elif captcha_response.json()["status"] == 0:
-                    self.result.update({'error': True,
-                                        'errorBody': RuCaptchaError().errors(captcha_response.json()["request"])
-                                        }
-                                       )
-                    return self.result
-
-                # при решении капчи
-                elif captcha_response.json()["status"] == 1:
-                    self.result.update({
-                                        'captchaSolve': captcha_response.json()['request']
-                                        }
-                                       )
-                    return self.result
-
-            except (TimeoutError, ConnectionError, MaxRetryError) as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+        answer = result_poller(self.transport, self.url_response, task.get_payload, self.sleep_time, task.result,
+                               deadline = deadline, cancel_token = cancel_token)
+        if self.memo is not None:
+            def learn(answer):
+                if not answer['error']:
+                    self.memo.learn(captcha_text, answer['captchaSolve'], answer['taskId'],
+                                    self.post_payload.get('lang'))
 
-            except Exception as error:
-                    self.result.update({'error': True,
-                                        'errorBody': {
-                                            'text': error
-                                            }
-                                        }
-                                       )
-                    return self.result
+            answer = when_done(answer, learn)
+        return answer
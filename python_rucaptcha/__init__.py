@@ -0,0 +1,59 @@
+"""
+Модули и классы библиотеки загружаются лениво - при первом обращении к атрибуту пакета,
+поэтому `import python_rucaptcha` не импортирует ни `requests`, ни `aiohttp`.
+
+Модули, названные так же как классы(`ImageCaptcha`, `ReCaptchaV2` и т.д.), остаются модулями:
+    from python_rucaptcha import ImageCaptcha
+    ImageCaptcha.ImageCaptcha(...)
+Остальные классы доступны напрямую:
+    from python_rucaptcha import aioImageCaptcha, SolverFarm, CancelToken
+"""
+import importlib
+
+# модули пакета
+_MODULES = ('ImageCaptcha', 'ReCaptchaV2', 'TextCaptcha', 'FunCaptcha', 'KeyCaptcha', 'MediaCaptcha',
+            'RotateCaptcha', 'RuCaptchaControl', 'config', 'errors', 'polling', 'validators', 'preprocessing',
+            'download', 'farm', 'backends', 'transport', 'decoding', 'scheduler', 'hedging', 'retry',
+            'breaker', 'tracing', 'proxies', 'singleflight', 'recording', 'cli', 'spool', 'tiers', 'memo',
+            'timerwheel', 'background')
+
+# класс -> модуль в котором он находится
+_CLASSES = {'aioImageCaptcha': 'ImageCaptcha',
+            'aioReCaptchaV2': 'ReCaptchaV2',
+            'aioFunCaptcha': 'FunCaptcha',
+            'aioKeyCaptcha': 'KeyCaptcha',
+            'SolverFarm': 'farm',
+            'CancelToken': 'polling',
+            'ImagePipeline': 'preprocessing',
+            'SubmitScheduler': 'scheduler',
+            'HedgePolicy': 'hedging',
+            'RetryPolicy': 'retry',
+            'CircuitBreaker': 'breaker',
+            'ProxyPool': 'proxies',
+            'SingleFlight': 'singleflight',
+            'TrafficRecorder': 'recording',
+            'SpoolWatcher': 'spool',
+            'LocalTier': 'tiers',
+            'AnswerMemo': 'memo',
+            'BackgroundPoller': 'background',
+            'AioBackgroundPoller': 'background',
+            'RuCaptchaError': 'errors',
+            'LocalValidationError': 'errors',
+            }
+
+__all__ = list(_MODULES) + list(_CLASSES)
+
+
+def __getattr__(name: str):
+    if name in _MODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in _CLASSES:
+        value = getattr(importlib.import_module(f'.{_CLASSES[name]}', __name__), name)
+        # кэшируем, чтобы следующие обращения не проходили через __getattr__
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,43 @@
+"""
+Ленивая загрузка HTTP библиотек.
+`requests` импортируется только при создании синхронного класса, `aiohttp` - только при первом запросе
+асинхронного класса, поэтому процесс использующий один вариант не платит за импорт другого.
+`httpx` - необязательная зависимость, нужна только транспорту `httpx`.
+"""
+
+
+def requests_session(max_retries: int = 5):
+    """
+    Создаёт сессию `requests`
+    :param max_retries: Кол-во попыток подключения к серверу при ошибке
+    :return: `requests.Session`
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    # выставляем кол-во попыток подключения к серверу при ошибке
+    session.mount('http://', HTTPAdapter(max_retries = max_retries))
+    return session
+
+
+def aiohttp_session(**kwargs):
+    """
+    Создаёт сессию `aiohttp`, должна вызываться внутри работающего event loop
+    :param kwargs: Параметры `aiohttp.ClientSession`
+    :return: `aiohttp.ClientSession`
+    """
+    import aiohttp
+
+    return aiohttp.ClientSession(**kwargs)
+
+
+def import_httpx():
+    """
+    Импорт необязательной библиотеки `httpx`
+    """
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError('Для транспорта `httpx` требуется библиотека httpx: `pip install httpx[http2]`')
+    return httpx
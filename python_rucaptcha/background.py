@@ -0,0 +1,789 @@
+"""
+Фоновый опрос решений для синхронных классов.
+Синхронный `captcha_handler` ждёт решения в вызывающем потоке, поэтому 2000 одновременно решаемых капч - это
+2000 потоков. `BackgroundPoller` опрашивает res.php за все капчи сам: один поток ведёт колесо таймеров
+(`timerwheel.TimerWheel`) со сроками следующих опросов, а запросы выполняет небольшой пул потоков, объединяя
+капчи одного ключа в один запрос `res.php?action=get&ids=...`.
+
+Классы решения капчи подключаются через транспорт, `captcha_handler` по-прежнему возвращает ответ, но ожидающий
+поток только спит на событии и не делает запросов:
+    poller = BackgroundPoller(workers = 4)
+    captcha = ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, transport = poller.transport())
+    captcha.captcha_handler(captcha_file = 'captcha.png')
+
+Без потока на каждую капчу - через `submit`: отправка капчи выполняется в пуле, ожидание - в колесе, а вызывающий
+сразу получает `concurrent.futures.Future` с ответом `captcha_handler`:
+    futures = [poller.submit(captcha.captcha_handler, captcha_file = path) for path in paths]
+
+Для асинхронных классов - `AioBackgroundPoller`: вместо цикла с `asyncio.sleep` на каждую капчу ожидающие капчи
+хранятся в массивах, один таймер цикла событий поворачивает колесо, и капчи одного тика опрашиваются одной волной:
+    poller = AioBackgroundPoller()
+    captcha = ImageCaptcha.aioImageCaptcha(rucaptcha_key = KEY, transport = poller.aio_transport())
+
+Капчи с дублирующей отправкой(`hedging`) опрашиваются своим циклом и занимают поток на всё время решения.
+Объединённый запрос используется, если обёртки транспорта(повторы, выключатель и т.д.) не перехватывают
+опрос решения одной капчи, иначе каждая капча опрашивается через `get` транспорта.
+"""
+import time
+import array
+import random
+import threading
+
+from .errors import RuCaptchaError
+from .timerwheel import TimerWheel
+from .transport import CHUNK_SIZE, Transport, AioTransport, make_transport, make_aio_transport
+from .polling import _handle_response, request_timeout, timeout_error, cancelled_error
+
+# максимальное кол-во ID капч в одном запросе res.php?action=get&ids=...
+MAX_IDS_PER_REQUEST = 100
+
+# поток, выполняющий `BackgroundPoller.submit`: его `result_poller` не ждёт решения, а возвращает Future
+_deferred = threading.local()
+
+
+def deferred_poller():
+    """
+    :return: `BackgroundPoller`, в `submit` которого выполняется текущий поток, или None
+    """
+    return getattr(_deferred, 'poller', None)
+
+
+def find_poller(transport):
+    """
+    :return: `BackgroundPoller` транспорта или одной из его обёрток, None - капча опрашивается своим циклом
+    """
+    while transport is not None:
+        poller = getattr(transport, 'background_poller', None)
+        if poller is not None:
+            return poller
+        transport = getattr(transport, 'transport', None)
+    return None
+
+
+def can_batch(transport) -> bool:
+    """
+    :return: True - ни одна обёртка транспорта не перехватывает `get`, капчи можно опрашивать через `get_many`
+    """
+    while transport is not None:
+        base = AioTransport if isinstance(transport, AioTransport) else Transport
+        if not isinstance(transport, (PolledTransport, AioPolledTransport)) and type(transport).get is not base.get:
+            return False
+        transport = getattr(transport, 'transport', None)
+    return True
+
+
+def batch_answers(captcha_response: dict, count: int) -> list:
+    """
+    Разбирает ответ res.php?action=get&ids=...
+    :param count: Кол-во ID в запросе
+    :return: Для каждой капчи - словарь с решением или ошибкой для result, None - капча ещё не решена
+    """
+    # ошибка на весь запрос, например неверный ключ
+    if captcha_response['status'] == 0 and captcha_response['request'] != 'CAPCHA_NOT_READY':
+        return [{'error': True, 'errorBody': RuCaptchaError().errors(captcha_response['request'])}] * count
+
+    answers = captcha_response['request'].split('|')
+    # один общий ответ на все ID, например CAPCHA_NOT_READY
+    if len(answers) == 1:
+        answers = answers * count
+    updates = []
+    for answer in answers:
+        if answer == 'CAPCHA_NOT_READY':
+            updates.append(None)
+            continue
+        error_body = RuCaptchaError().errors(answer)
+        # ошибка отсутствующая в таблице ошибок библиотеки
+        if error_body is None and answer.startswith('ERROR'):
+            error_body = {'text': answer, 'id': 0}
+        updates.append({'error': True, 'errorBody': error_body} if error_body else {'captchaSolve': answer})
+    return updates
+
+
+class _PollTask:
+    """
+    Капча, ожидающая решения
+    """
+    __slots__ = ('transport', 'url_response', 'get_payload', 'sleep_time', 'result', 'deadline', 'future', 'polls',
+                 'batch')
+
+    def __init__(self, transport, url_response: str, get_payload: dict, sleep_time: float, result: dict,
+                 deadline: float = None):
+        self.transport = transport
+        self.url_response = url_response
+        self.get_payload = get_payload
+        self.sleep_time = sleep_time
+        self.result = result
+        self.deadline = deadline
+        # `concurrent.futures` загружается только с фоновым опросом, а не при каждом `result_poller`
+        from concurrent.futures import Future
+
+        self.future = Future()
+        self.polls = 0
+        # ключ объединённого запроса или None - опрос через `get`
+        self.batch = (id(transport), url_response, get_payload.get('key')) if can_batch(transport) else None
+
+    def next_poll(self, now: float) -> float:
+        when = now + self.sleep_time
+        return when if self.deadline is None else min(when, self.deadline)
+
+
+class BackgroundPoller:
+    """
+    Общий опрос решений капч синхронных классов в фоновых потоках
+    """
+
+    def __init__(self, workers: int = 4, tick: float = 0.05, max_ids: int = MAX_IDS_PER_REQUEST):
+        """
+        :param workers: Кол-во потоков, выполняющих запросы к res.php и отправку капч из `submit`
+        :param tick: Точность срабатывания таймеров опроса в секундах
+        :param max_ids: Максимальное кол-во капч в одном объединённом запросе
+        """
+        if workers < 1:
+            raise ValueError(f'Параметр `workers` должен быть больше 0. Вы передали - {workers}')
+        self.max_ids = max_ids
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._wheel = TimerWheel(tick = tick)
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'rucaptcha-poller')
+        # новые и возвращённые после опроса капчи: (время опроса, задача), колесо меняет только его поток
+        self._incoming = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._stats = {'registered': 0, 'solved': 0, 'errors': 0, 'timeouts': 0, 'cancelled': 0,
+                       'requests': 0, 'batched_requests': 0, 'polls': 0}
+        self._thread = threading.Thread(target = self._run, name = 'rucaptcha-wheel', daemon = True)
+        self._thread.start()
+
+    def _count(self, name: str, value: int = 1):
+        with self._condition:
+            self._stats[name] += value
+
+    def _schedule(self, when: float, task: _PollTask):
+        with self._condition:
+            self._incoming.append((when, task))
+            self._condition.notify()
+
+    def register(self, transport, url_response: str, get_payload: dict, sleep_time: float, result: dict,
+                 deadline: float = None) -> 'Future':
+        """
+        Добавляет капчу в ожидание решения, параметры как у `polling.result_poller`
+        :return: Future с result после решения, ошибки или истечения дедлайна.
+                 Отмена Future записывает в result ошибку отмены и убирает капчу из ожидания
+        """
+        if self._closed:
+            raise RuntimeError('BackgroundPoller закрыт')
+        task = _PollTask(transport, url_response, get_payload, sleep_time, result, deadline)
+
+        def on_done(future):
+            if future.cancelled():
+                cancelled_error(result)
+                self._count('cancelled')
+            transport.finish(get_payload.get('id'))
+
+        task.future.add_done_callback(on_done)
+        self._count('registered')
+        if deadline is not None and deadline <= time.monotonic():
+            self._complete(task, 'timeouts')
+        else:
+            self._schedule(task.next_poll(time.monotonic()), task)
+        return task.future
+
+    def wait(self, transport, url_response: str, get_payload: dict, sleep_time: float, result: dict,
+             deadline: float = None, cancel_token = None) -> dict:
+        """
+        Ожидает решения капчи в вызывающем потоке без собственных запросов, аналог `polling.result_poller`
+        :return: result
+        """
+        from concurrent.futures import CancelledError
+
+        future = self.register(transport, url_response, get_payload, sleep_time, result, deadline)
+        if cancel_token is not None:
+            cancel_token.on_cancel(future.cancel)
+        try:
+            return future.result()
+        except CancelledError:
+            # отмена через `cancel_token`
+            return cancelled_error(result)
+
+    def submit(self, handler, *args, **kwargs) -> 'Future':
+        """
+        Выполняет синхронный `captcha_handler` в пуле, ожидание решения выполняется без занятого потока
+        :param handler: `captcha_handler` синхронного класса решения капчи
+        :return: Future с ответом `captcha_handler`, отмена Future отменяет ожидание решения
+        """
+        if self._closed:
+            raise RuntimeError('BackgroundPoller закрыт')
+        from concurrent.futures import Future
+
+        outer = Future()
+        self._pool.submit(self._run_deferred, outer, handler, args, kwargs)
+        return outer
+
+    def _run_deferred(self, outer: 'Future', handler, args: tuple, kwargs: dict):
+        from concurrent.futures import Future
+
+        if outer.cancelled():
+            return
+        _deferred.poller = self
+        try:
+            answer = handler(*args, **kwargs)
+        except Exception as error:
+            if outer.set_running_or_notify_cancel():
+                outer.set_exception(error)
+            return
+        finally:
+            _deferred.poller = None
+
+        if not isinstance(answer, Future):
+            # ответ без ожидания решения: ошибка отправки, локальное распознавание и т.д.
+            if outer.set_running_or_notify_cancel():
+                outer.set_result(answer)
+            return
+
+        def on_answer(future):
+            if future.cancelled():
+                outer.cancel()
+            elif outer.set_running_or_notify_cancel():
+                outer.set_result(future.result())
+
+        outer.add_done_callback(lambda future: future.cancelled() and answer.cancel())
+        answer.add_done_callback(on_answer)
+
+    def _complete(self, task: _PollTask, outcome: str):
+        if outcome == 'timeouts':
+            timeout_error(task.result)
+        self._count(outcome)
+        if task.future.set_running_or_notify_cancel():
+            task.future.set_result(task.result)
+
+    def _fail(self, task: _PollTask, error: Exception):
+        task.result.update({'error': True,
+                            'errorBody': {
+                                'text': error
+                                }
+                            }
+                           )
+        self._complete(task, 'errors')
+
+    def _after_poll(self, task: _PollTask, now: float):
+        """
+        Капча не решена: следующий опрос через `sleep_time` или таймаут
+        """
+        if task.deadline is not None and now >= task.deadline:
+            self._complete(task, 'timeouts')
+        else:
+            self._schedule(task.next_poll(now), task)
+
+    def _poll_one(self, task: _PollTask):
+        if task.future.done():
+            return
+        task.polls += 1
+        self._count('requests')
+        try:
+            captcha_response = task.transport.get(task.url_response, task.get_payload,
+                                                  timeout = request_timeout(task.deadline))
+        except Exception as error:
+            self._fail(task, error)
+            return
+        self._count('polls')
+        if _handle_response(captcha_response, task.result):
+            self._complete(task, 'errors' if task.result['error'] else 'solved')
+        else:
+            self._after_poll(task, time.monotonic())
+
+    def _poll_many(self, tasks: list):
+        tasks = [task for task in tasks if not task.future.done()]
+        if not tasks:
+            return
+        first = tasks[0]
+        deadlines = [task.deadline for task in tasks if task.deadline is not None]
+        self._count('requests')
+        self._count('batched_requests')
+        try:
+            captcha_response = first.transport.get_many(first.url_response, first.get_payload['key'],
+                                                        [task.get_payload['id'] for task in tasks],
+                                                        timeout = request_timeout(min(deadlines))
+                                                        if deadlines else None)
+        except Exception as error:
+            for task in tasks:
+                self._fail(task, error)
+            return
+        self._count('polls', len(tasks))
+
+        now = time.monotonic()
+        for task, update in zip(tasks, batch_answers(captcha_response, len(tasks))):
+            task.polls += 1
+            if update is None:
+                self._after_poll(task, now)
+                continue
+            task.result.update(update)
+            self._complete(task, 'errors' if update.get('error') else 'solved')
+
+    def _dispatch(self, tasks: list):
+        """
+        Отправляет в пул опросы капч, срок которых наступил
+        """
+        batches = {}
+        for task in tasks:
+            if task.future.done():
+                continue
+            if task.batch is None:
+                self._pool.submit(self._poll_one, task)
+            else:
+                batches.setdefault(task.batch, []).append(task)
+        for batch in batches.values():
+            for i in range(0, len(batch), self.max_ids):
+                self._pool.submit(self._poll_many, batch[i:i + self.max_ids])
+
+    def _run(self):
+        """
+        Поток колеса таймеров
+        """
+        while True:
+            with self._condition:
+                while not self._incoming and not self._closed:
+                    next_expiry = self._wheel.next_expiry()
+                    if next_expiry is None:
+                        self._condition.wait()
+                        continue
+                    wait = next_expiry - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                if self._closed:
+                    return
+                incoming, self._incoming = self._incoming, []
+            for when, task in incoming:
+                self._wheel.schedule(when, task)
+            self._dispatch(self._wheel.expired())
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во капч добавленных в ожидание, решённых, с ошибкой, с таймаутом и отменённых, кол-во запросов
+                 к res.php(из них объединённых) и опрошенных капч, кол-во капч ожидающих сейчас
+        """
+        with self._condition:
+            return dict(self._stats, pending = len(self._wheel) + len(self._incoming))
+
+    def close(self):
+        """
+        Останавливает поток колеса и пул, ожидающие капчи завершаются ошибкой отмены
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._pool.shutdown()
+        # поток колеса остановлен - колесо и новые капчи больше никто не трогает
+        with self._condition:
+            tasks = [task for _, task in self._incoming] + self._wheel.clear()
+            self._incoming = []
+        for task in tasks:
+            if not task.future.done():
+                cancelled_error(task.result)
+                self._complete(task, 'cancelled')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def transport(self, transport = None) -> 'PolledTransport':
+        """
+        Синхронный транспорт, капчи которого опрашиваются в фоне
+        :param transport: Транспорт или название бэкенда(см. `transport.make_transport`)
+        """
+        return PolledTransport(self, make_transport(transport))
+
+
+class PolledTransport(Transport):
+    """
+    Синхронный транспорт с `BackgroundPoller`: запросы передаются транспорту без изменений,
+    а `polling.result_poller` передаёт ожидание решения в фоновый опрос
+    """
+
+    def __init__(self, background_poller: BackgroundPoller, transport: Transport):
+        self.background_poller = background_poller
+        self.transport = transport
+        self.name = transport.name
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        return self.transport.submit(url_request, payload, files = files, timeout = timeout)
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self.transport.get(url_response, payload, timeout = timeout)
+
+    def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return self.transport.get_many(url_response, rucaptcha_key, ids, timeout = timeout)
+
+    def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self.transport.control(url_response, payload, timeout = timeout)
+
+    def finish(self, captcha_id: str):
+        self.transport.finish(captcha_id)
+
+    def close(self):
+        self.transport.close()
+
+
+class AioBackgroundPoller:
+    """
+    Общий опрос решений капч асинхронных классов, аналог `BackgroundPoller` для одного цикла событий.
+    Вместо цикла с `asyncio.sleep` на каждую капчу ожидающие капчи хранятся в массивах по номеру ячейки, а колесо
+    таймеров хранит только номера: на всё ожидание приходится один таймер цикла событий. Капчи, срок опроса которых
+    пришёлся на один тик колеса, опрашиваются одной волной объединёнными запросами, а первый опрос сдвигается
+    на случайную долю `jitter` от `sleep_time`, чтобы капчи, отправленные одновременно, не опрашивались все разом.
+    """
+
+    def __init__(self, tick: float = 0.05, jitter: float = 0.2, max_ids: int = MAX_IDS_PER_REQUEST,
+                 max_requests: int = 100):
+        """
+        :param tick: Точность срабатывания таймеров опроса в секундах, капчи одного тика опрашиваются одной волной
+        :param jitter: Доля `sleep_time`, на случайную часть которой откладывается первый опрос капчи
+        :param max_ids: Максимальное кол-во капч в одном объединённом запросе
+        :param max_requests: Максимальное кол-во одновременных запросов к res.php
+        """
+        if not 0 <= jitter <= 1:
+            raise ValueError(f'Параметр `jitter` должен быть от 0 до 1. Вы передали - {jitter}')
+        if max_requests < 1:
+            raise ValueError(f'Параметр `max_requests` должен быть больше 0. Вы передали - {max_requests}')
+        self.tick = tick
+        self.jitter = jitter
+        self.max_ids = max_ids
+        self.max_requests = max_requests
+        self._wheel = TimerWheel(tick = tick)
+        self._random = random.Random()
+
+        # ячейка -> данные ожидающей капчи; свободные ячейки переиспользуются
+        self._waiters = []
+        self._results = []
+        self._payloads = []
+        self._groups = array.array('l')
+        self._sleep_times = array.array('d')
+        self._deadlines = array.array('d')
+        # поколение ячейки: элемент колеса от освобождённой ячейки пропускается
+        self._generations = array.array('L')
+        self._free = []
+        self._pending = 0
+        # группа объединённого запроса: (транспорт, URL, ключ) -> номер, номер -> (транспорт, URL, ключ, объединять)
+        self._group_index = {}
+        self._group_info = []
+
+        self._driver = None
+        self._wakeup = None
+        self._wake_at = None
+        self._semaphore = None
+        self._requests = set()
+        self._stats = {'registered': 0, 'solved': 0, 'errors': 0, 'timeouts': 0, 'cancelled': 0,
+                       'requests': 0, 'batched_requests': 0, 'polls': 0, 'waves': 0, 'max_wave': 0}
+
+    def _start(self):
+        # asyncio загружается только с асинхронным опросом: `result_poller` импортирует этот модуль при каждом решении
+        import asyncio
+
+        if self._driver is None or self._driver.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_requests)
+            self._driver = asyncio.get_event_loop().create_task(self._run())
+
+    def _group(self, transport, url_response: str, rucaptcha_key: str) -> int:
+        key = (id(transport), url_response, rucaptcha_key)
+        group = self._group_index.get(key)
+        if group is None:
+            group = self._group_index[key] = len(self._group_info)
+            self._group_info.append((transport, url_response, rucaptcha_key, can_batch(transport)))
+        return group
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        self._waiters.append(None)
+        self._results.append(None)
+        self._payloads.append(None)
+        self._groups.append(0)
+        self._sleep_times.append(0)
+        self._deadlines.append(0)
+        self._generations.append(0)
+        return len(self._waiters) - 1
+
+    def _release(self, slot: int):
+        self._generations[slot] = (self._generations[slot] + 1) & 0xFFFFFFFF
+        self._waiters[slot] = None
+        self._results[slot] = None
+        self._free.append(slot)
+        self._pending -= 1
+        self._group_info[self._groups[slot]][0].finish(self._payloads[slot].get('id'))
+        self._payloads[slot] = None
+
+    def _item(self, slot: int) -> int:
+        return (self._generations[slot] << 32) | slot
+
+    def _live(self, item: int) -> bool:
+        slot = item & 0xFFFFFFFF
+        return self._generations[slot] == item >> 32
+
+    def _schedule(self, slot: int, when: float):
+        deadline = self._deadlines[slot]
+        if deadline and when > deadline:
+            when = deadline
+        self._wheel.schedule(when, self._item(slot))
+        # таймер цикла событий стоит позже - переставляем
+        if self._wake_at is None or when < self._wake_at:
+            self._wakeup.set()
+
+    def _complete(self, slot: int, outcome: str):
+        waiter = self._waiters[slot]
+        result = self._results[slot]
+        self._stats[outcome] += 1
+        self._release(slot)
+        if not waiter.done():
+            waiter.set_result(result)
+
+    async def wait(self, transport, url_response: str, get_payload: dict, sleep_time: float, result: dict,
+                   deadline: float = None) -> dict:
+        """
+        Ожидает решения капчи в общем опросе, аналог `polling.aio_result_poller`
+        :return: result
+        """
+        import asyncio
+
+        self._start()
+        self._stats['registered'] += 1
+        if deadline is not None and deadline <= time.monotonic():
+            self._stats['timeouts'] += 1
+            transport.finish(get_payload.get('id'))
+            return timeout_error(result)
+
+        slot = self._allocate()
+        self._pending += 1
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters[slot] = waiter
+        self._results[slot] = result
+        self._payloads[slot] = get_payload
+        self._groups[slot] = self._group(transport, url_response, get_payload.get('key'))
+        self._sleep_times[slot] = sleep_time
+        self._deadlines[slot] = deadline or 0
+        self._schedule(slot, time.monotonic() + sleep_time * (1 + self._random.random() * self.jitter))
+
+        item = self._item(slot)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if self._live(item):
+                self._stats['cancelled'] += 1
+                self._release(slot)
+            raise
+
+    def _after_poll(self, slot: int, now: float):
+        """
+        Капча не решена: следующий опрос через `sleep_time` или таймаут
+        """
+        deadline = self._deadlines[slot]
+        if deadline and now >= deadline:
+            timeout_error(self._results[slot])
+            self._complete(slot, 'timeouts')
+        else:
+            self._schedule(slot, now + self._sleep_times[slot])
+
+    def _fail(self, items: list, error: Exception):
+        for item in items:
+            if self._live(item):
+                slot = item & 0xFFFFFFFF
+                self._results[slot].update({'error': True,
+                                            'errorBody': {
+                                                'text': error
+                                                }
+                                            }
+                                           )
+                self._complete(slot, 'errors')
+
+    def _timeout(self, items: list):
+        deadlines = [self._deadlines[item & 0xFFFFFFFF] for item in items if self._deadlines[item & 0xFFFFFFFF]]
+        return request_timeout(min(deadlines)) if deadlines else None
+
+    async def _poll_one(self, item: int):
+        import asyncio
+
+        slot = item & 0xFFFFFFFF
+        transport, url_response, _, _ = self._group_info[self._groups[slot]]
+        self._stats['requests'] += 1
+        try:
+            async with self._semaphore:
+                captcha_response = await asyncio.wait_for(transport.get(url_response, self._payloads[slot]),
+                                                          timeout = self._timeout([item]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self._fail([item], error)
+            return
+        if not self._live(item):
+            return
+        self._stats['polls'] += 1
+        if _handle_response(captcha_response, self._results[slot]):
+            self._complete(slot, 'errors' if self._results[slot]['error'] else 'solved')
+        else:
+            self._after_poll(slot, time.monotonic())
+
+    async def _poll_many(self, group: int, items: list):
+        import asyncio
+
+        transport, url_response, rucaptcha_key, _ = self._group_info[group]
+        ids = [self._payloads[item & 0xFFFFFFFF]['id'] for item in items]
+        self._stats['requests'] += 1
+        self._stats['batched_requests'] += 1
+        try:
+            async with self._semaphore:
+                captcha_response = await asyncio.wait_for(transport.get_many(url_response, rucaptcha_key, ids),
+                                                          timeout = self._timeout(items))
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self._fail(items, error)
+            return
+
+        now = time.monotonic()
+        for item, update in zip(items, batch_answers(captcha_response, len(items))):
+            # капча отменена во время запроса
+            if not self._live(item):
+                continue
+            self._stats['polls'] += 1
+            slot = item & 0xFFFFFFFF
+            if update is None:
+                self._after_poll(slot, now)
+                continue
+            self._results[slot].update(update)
+            self._complete(slot, 'errors' if update.get('error') else 'solved')
+
+    def _spawn(self, coroutine):
+        import asyncio
+
+        request = asyncio.get_event_loop().create_task(coroutine)
+        self._requests.add(request)
+        request.add_done_callback(self._requests.discard)
+
+    def _dispatch(self, items: list):
+        """
+        Волна опросов капч, срок которых наступил: по запросу на каждые `max_ids` капч группы
+        """
+        batches = {}
+        wave = 0
+        for item in items:
+            if not self._live(item):
+                continue
+            wave += 1
+            group = self._groups[item & 0xFFFFFFFF]
+            if self._group_info[group][3]:
+                batches.setdefault(group, []).append(item)
+            else:
+                self._spawn(self._poll_one(item))
+        for group, batch in batches.items():
+            for i in range(0, len(batch), self.max_ids):
+                self._spawn(self._poll_many(group, batch[i:i + self.max_ids]))
+        if wave:
+            self._stats['waves'] += 1
+            self._stats['max_wave'] = max(self._stats['max_wave'], wave)
+
+    async def _run(self):
+        """
+        Задача, поворачивающая колесо: единственный таймер цикла событий на все ожидающие капчи
+        """
+        import asyncio
+
+        while True:
+            self._wake_at = self._wheel.next_expiry()
+            self._wakeup.clear()
+            if self._wake_at is None:
+                await self._wakeup.wait()
+            else:
+                delay = self._wake_at - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            self._wake_at = None
+            self._dispatch(self._wheel.expired())
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во капч добавленных в ожидание, решённых, с ошибкой, с таймаутом и отменённых, кол-во запросов
+                 к res.php(из них объединённых) и опрошенных капч, кол-во волн опроса и наибольшая волна,
+                 кол-во капч ожидающих сейчас и размер массивов ожидания
+        """
+        return dict(self._stats, pending = self._pending, slots = len(self._waiters))
+
+    async def close(self):
+        """
+        Останавливает опрос, ожидающие капчи завершаются ошибкой отмены
+        """
+        import asyncio
+
+        for slot, waiter in enumerate(self._waiters):
+            if waiter is not None and not waiter.done():
+                cancelled_error(self._results[slot])
+                self._complete(slot, 'cancelled')
+        self._wheel.clear()
+        tasks = list(self._requests)
+        if self._driver is not None:
+            tasks.append(self._driver)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        self._driver = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def aio_transport(self, transport = None) -> 'AioPolledTransport':
+        """
+        Асинхронный транспорт, капчи которого опрашиваются в общем опросе
+        :param transport: Транспорт или название бэкенда(см. `transport.make_aio_transport`)
+        """
+        return AioPolledTransport(self, make_aio_transport(transport))
+
+
+class AioPolledTransport(AioTransport):
+    """
+    Асинхронный транспорт с `AioBackgroundPoller`, аналог `PolledTransport`
+    """
+
+    def __init__(self, background_poller: AioBackgroundPoller, transport: AioTransport):
+        self.background_poller = background_poller
+        self.transport = transport
+        self.name = transport.name
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self.transport.submit(url_request, payload, files = files, timeout = timeout)
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self.transport.get(url_response, payload, timeout = timeout)
+
+    async def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return await self.transport.get_many(url_response, rucaptcha_key, ids, timeout = timeout)
+
+    async def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self.transport.control(url_response, payload, timeout = timeout)
+
+    def finish(self, captcha_id: str):
+        self.transport.finish(captcha_id)
+
+    async def close(self):
+        await self.transport.close()
@@ -0,0 +1,339 @@
+"""
+Защитный выключатель(circuit breaker) для адресов сервиса.
+При деградации сервиса запросы к in.php/res.php не отправляются, а сразу завершаются ошибкой
+`LIBRARY_CIRCUIT_OPEN`, поэтому потоки и задачи не висят на ожидании ответов и повторах подключения.
+
+Для каждого адреса выключатель находится в одном из состояний:
+    `closed` - запросы проходят, по последним `window` запросам считаются доли ошибок и медленных ответов;
+    `open` - доля ошибок или медленных ответов превысила порог, запросы отклоняются `reset_timeout` секунд;
+    `half_open` - пропускается не больше `half_open_calls` пробных запросов: если все успешны - выключатель
+        закрывается, при первой ошибке - снова открывается.
+
+Один объект выключателя подключается через транспорт к любым классам решения капчи:
+    breaker = CircuitBreaker(failure_rate = 0.5, slow_call = 5)
+    ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, transport = breaker.transport())
+"""
+import time
+import threading
+import collections
+
+from .transport import CHUNK_SIZE, Transport, AioTransport, make_transport, make_aio_transport
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# коды ошибок сервиса, которые считаются отказом адреса
+FAILURE_CODES = ('ERROR_NO_SLOT_AVAILABLE',)
+
+
+def circuit_open_answer() -> dict:
+    """
+    Ответ транспорта на запрос, отклонённый открытым выключателем
+    """
+    return {'status': 0, 'request': 'LIBRARY_CIRCUIT_OPEN'}
+
+
+class _Circuit:
+    """
+    Состояние выключателя одного адреса
+    """
+    __slots__ = ('state', 'calls', 'failures', 'slow', 'opened_at', 'probes', 'probe_successes', 'stats')
+
+    def __init__(self, window: int):
+        self.state = CLOSED
+        # последние запросы: (ошибка, медленный ответ)
+        self.calls = collections.deque(maxlen = window)
+        # кол-во ошибок и медленных ответов в `calls`
+        self.failures = 0
+        self.slow = 0
+        self.opened_at = None
+        # кол-во пробных запросов в работе и успешных пробных запросов
+        self.probes = 0
+        self.probe_successes = 0
+        self.stats = {'calls': 0, 'failures': 0, 'slow': 0, 'rejected': 0, 'opened': 0}
+
+    def append(self, failed: bool, slow: bool):
+        if len(self.calls) == self.calls.maxlen:
+            old_failed, old_slow = self.calls[0]
+            self.failures -= old_failed
+            self.slow -= old_slow
+        self.calls.append((failed, slow))
+        self.failures += failed
+        self.slow += slow
+
+    def open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.stats['opened'] += 1
+
+    def close(self):
+        self.state = CLOSED
+        self.calls.clear()
+        self.failures = 0
+        self.slow = 0
+
+
+class CircuitBreaker:
+    """
+    Защитный выключатель: пороги ошибок и задержек, состояние и статистика для каждого адреса сервиса
+    """
+
+    def __init__(self, failure_rate: float = 0.5, slow_rate: float = 0.5, slow_call: float = 5, window: int = 20,
+                 min_calls: int = 10, reset_timeout: float = 30, half_open_calls: int = 3,
+                 failure_codes: tuple = FAILURE_CODES):
+        """
+        :param failure_rate: Доля ошибок среди последних запросов, при которой выключатель открывается
+        :param slow_rate: Доля медленных ответов среди последних запросов, при которой выключатель открывается
+        :param slow_call: Время ответа в секундах, после которого ответ считается медленным
+        :param window: Кол-во последних запросов, по которым считаются доли
+        :param min_calls: Минимальное кол-во запросов в окне для открытия выключателя
+        :param reset_timeout: Время в секундах, на которое выключатель открывается
+        :param half_open_calls: Кол-во пробных запросов после `reset_timeout`, нужное для закрытия выключателя
+        :param failure_codes: Коды ошибок сервиса, которые считаются отказом адреса(кроме сетевых ошибок)
+        """
+        for name, rate in (('failure_rate', failure_rate), ('slow_rate', slow_rate)):
+            if not 0 < rate <= 1:
+                raise ValueError(f'Параметр `{name}` должен быть от 0 до 1. Вы передали - {rate}')
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_call = slow_call
+        self.window = window
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.failure_codes = failure_codes
+        # адрес -> _Circuit
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, url: str) -> _Circuit:
+        circuit = self._circuits.get(url)
+        if circuit is None:
+            circuit = self._circuits[url] = _Circuit(self.window)
+        return circuit
+
+    def acquire(self, url: str):
+        """
+        Проверяет, можно ли отправить запрос на адрес
+        :return: None - запрос отклонён, True - пробный запрос(`half_open`), False - обычный запрос
+        """
+        with self._lock:
+            circuit = self._circuit(url)
+            if circuit.state == OPEN:
+                if time.monotonic() - circuit.opened_at < self.reset_timeout:
+                    circuit.stats['rejected'] += 1
+                    return None
+                circuit.state = HALF_OPEN
+                circuit.probes = 0
+                circuit.probe_successes = 0
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_calls:
+                    circuit.stats['rejected'] += 1
+                    return None
+                circuit.probes += 1
+                return True
+            return False
+
+    def record(self, url: str, latency: float, failed: bool, probe: bool):
+        """
+        Учитывает результат запроса
+        :param url: Адрес запроса
+        :param latency: Время ответа в секундах
+        :param failed: True - сетевая ошибка или код ошибки из `failure_codes`
+        :param probe: Значение, полученное от `acquire`
+        """
+        slow = latency >= self.slow_call
+        with self._lock:
+            circuit = self._circuit(url)
+            stats = circuit.stats
+            stats['calls'] += 1
+            stats['failures'] += failed
+            stats['slow'] += slow
+
+            if probe:
+                # пробный запрос, выключатель мог уже открыться по другому пробному запросу
+                if circuit.state != HALF_OPEN:
+                    return
+                if failed or slow:
+                    circuit.open()
+                    return
+                circuit.probe_successes += 1
+                if circuit.probe_successes >= self.half_open_calls:
+                    circuit.close()
+                return
+
+            # запрос отправленный до открытия выключателя не влияет на его состояние
+            if circuit.state != CLOSED:
+                return
+            circuit.append(failed, slow)
+            calls = len(circuit.calls)
+            if calls >= self.min_calls and (circuit.failures / calls >= self.failure_rate or
+                                            circuit.slow / calls >= self.slow_rate):
+                circuit.open()
+
+    def release(self, url: str, probe: bool):
+        """
+        Освобождает место пробного запроса, который был отменён и не дал результата
+        """
+        if not probe:
+            return
+        with self._lock:
+            circuit = self._circuit(url)
+            if circuit.state == HALF_OPEN:
+                circuit.probes -= 1
+
+    def state(self, url: str) -> str:
+        """
+        :return: Состояние выключателя адреса: `closed`, `open` или `half_open`
+        """
+        with self._lock:
+            circuit = self._circuits.get(url)
+            if circuit is None:
+                return CLOSED
+            # по истечении `reset_timeout` следующий запрос станет пробным
+            if circuit.state == OPEN and time.monotonic() - circuit.opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return circuit.state
+
+    def stats(self) -> dict:
+        """
+        :return: Адрес -> состояние, кол-во запросов, ошибок, медленных ответов, отклонённых запросов,
+                 открытий выключателя, доли ошибок и медленных ответов в окне, секунд до пробных запросов
+        """
+        report = {}
+        for url in list(self._circuits):
+            state = self.state(url)
+            with self._lock:
+                circuit = self._circuits[url]
+                calls = len(circuit.calls)
+                report[url] = dict(circuit.stats,
+                                   state = state,
+                                   failure_rate = circuit.failures / calls if calls else 0.0,
+                                   slow_rate = circuit.slow / calls if calls else 0.0,
+                                   retry_in = max(self.reset_timeout - (time.monotonic() - circuit.opened_at), 0)
+                                   if circuit.state == OPEN else 0,
+                                   )
+        return report
+
+    def transport(self, transport = None) -> 'BreakerTransport':
+        """
+        Синхронный транспорт с выключателем.
+        Чтобы ошибка подключения быстрее доходила до выключателя, для `requests` стоит уменьшить кол-во
+        повторов подключения: `breaker.transport(RequestsTransport(max_retries = 1))`
+        :param transport: Транспорт или название бэкенда(см. `transport.make_transport`)
+        """
+        return BreakerTransport(self, make_transport(transport))
+
+    def aio_transport(self, transport = None) -> 'AioBreakerTransport':
+        """
+        Асинхронный транспорт с выключателем
+        :param transport: Транспорт или название бэкенда(см. `transport.make_aio_transport`)
+        """
+        return AioBreakerTransport(self, make_aio_transport(transport))
+
+
+class BreakerTransport(Transport):
+    """
+    Синхронный транспорт с `CircuitBreaker`: запрос к адресу с открытым выключателем не отправляется,
+    вместо ответа сервиса возвращается ошибка `LIBRARY_CIRCUIT_OPEN`.
+    Скачивание изображений(`stream`) выключателем не ограничивается.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, transport: Transport):
+        self.breaker = breaker
+        self.transport = transport
+        self.name = transport.name
+
+    def _call(self, method, url: str, *args, **kwargs) -> dict:
+        probe = self.breaker.acquire(url)
+        if probe is None:
+            return circuit_open_answer()
+        start = time.monotonic()
+        try:
+            answer = method(url, *args, **kwargs)
+        except Exception:
+            self.breaker.record(url, time.monotonic() - start, True, probe)
+            raise
+        except BaseException:
+            self.breaker.release(url, probe)
+            raise
+        self.breaker.record(url, time.monotonic() - start, answer.get('request') in self.breaker.failure_codes, probe)
+        return answer
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return self._call(self.transport.request, url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        return self._call(self.transport.submit, url_request, payload, files = files, timeout = timeout)
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self._call(self.transport.get, url_response, payload, timeout = timeout)
+
+    def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return self._call(self.transport.get_many, url_response, rucaptcha_key, ids, timeout = timeout)
+
+    def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self._call(self.transport.control, url_response, payload, timeout = timeout)
+
+    def finish(self, captcha_id: str):
+        self.transport.finish(captcha_id)
+
+    def close(self):
+        self.transport.close()
+
+
+class AioBreakerTransport(AioTransport):
+    """
+    Асинхронный транспорт с `CircuitBreaker`, аналог `BreakerTransport`
+    """
+
+    def __init__(self, breaker: CircuitBreaker, transport: AioTransport):
+        self.breaker = breaker
+        self.transport = transport
+        self.name = transport.name
+
+    async def _call(self, method, url: str, *args, **kwargs) -> dict:
+        import asyncio
+
+        probe = self.breaker.acquire(url)
+        if probe is None:
+            return circuit_open_answer()
+        start = time.monotonic()
+        try:
+            answer = await method(url, *args, **kwargs)
+        except asyncio.CancelledError:
+            self.breaker.release(url, probe)
+            raise
+        except Exception:
+            self.breaker.record(url, time.monotonic() - start, True, probe)
+            raise
+        self.breaker.record(url, time.monotonic() - start, answer.get('request') in self.breaker.failure_codes, probe)
+        return answer
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self._call(self.transport.request, url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self._call(self.transport.submit, url_request, payload, files = files, timeout = timeout)
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self._call(self.transport.get, url_response, payload, timeout = timeout)
+
+    async def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return await self._call(self.transport.get_many, url_response, rucaptcha_key, ids, timeout = timeout)
+
+    async def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self._call(self.transport.control, url_response, payload, timeout = timeout)
+
+    def finish(self, captcha_id: str):
+        self.transport.finish(captcha_id)
+
+    async def close(self):
+        await self.transport.close()
@@ -0,0 +1,264 @@
+"""
+Пакетное решение капч из командной строки.
+Задания берутся из папки с изображениями или из JSONL на stdin, решаются одновременно через aio* классы библиотеки,
+результаты выводятся в stdout строками JSONL по мере решения, итоговая статистика - в stderr.
+
+    rucaptcha-solve --key KEY ./captchas/ > answers.jsonl
+    cat jobs.jsonl | rucaptcha-solve --key KEY --concurrency 50 --retry > answers.jsonl
+
+Строка задания JSONL(`id` - необязательный, по умолчанию номер строки):
+    {"id": "a1", "file": "captcha.png"} / {"url": "https://site/captcha.png"} / {"base64": "iVBORw0..."}
+    {"id": "r1", "type": "recaptcha", "site_key": "6Lf...", "page_url": "https://site/", "proxy": "...", "proxytype": "HTTP"}
+    {"id": "f1", "type": "funcaptcha", "public_key": "69A2...", "page_url": "https://site/"}
+Тип определяется по полям, если не указан. Строка результата: `id`, `type`, поля ответа `captcha_handler`
+и `latency` - время решения в секундах.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from .ImageCaptcha import aioImageCaptcha
+from .ReCaptchaV2 import aioReCaptchaV2
+from .FunCaptcha import aioFunCaptcha
+from .config import JSON_RESPONSE
+from .transport import make_aio_transport
+
+# расширения файлов изображений при чтении папки
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(prog = 'rucaptcha-solve', description = 'Пакетное решение капч через RuCaptcha/2captcha')
+    parser.add_argument('source', nargs = '?', default = '-',
+                        help = 'Папка с изображениями, JSONL файл заданий или `-` - JSONL из stdin(по умолчанию)')
+    parser.add_argument('--key', default = os.environ.get('RUCAPTCHA_KEY'),
+                        help = 'Ключ API, по умолчанию - переменная окружения RUCAPTCHA_KEY')
+    parser.add_argument('--service', default = '2captcha', choices = ('2captcha', 'rucaptcha'))
+    parser.add_argument('--concurrency', type = int, default = 20, help = 'Кол-во одновременно решаемых капч')
+    parser.add_argument('--sleep-time', type = float, help = 'Интервал опроса решения в секундах')
+    parser.add_argument('--timeout', type = float, help = 'Общее время решения одной капчи в секундах')
+    parser.add_argument('--hedge', type = float, metavar = 'PERCENTILE',
+                        help = 'Дублирующая отправка капч, не решённых за этот перцентиль времени решения(0.9)')
+    parser.add_argument('--retry', action = 'store_true', help = 'Повторная отправка по `RetryPolicy` по умолчанию')
+    parser.add_argument('--transport', default = None, help = 'Бэкенд транспорта: aiohttp(по умолчанию), httpx, fake')
+    parser.add_argument('--record', metavar = 'PATH', help = 'Записать трафик в файл `TrafficRecorder`')
+    args = parser.parse_args(argv)
+    if not args.key:
+        parser.error('не передан ключ API: --key или переменная окружения RUCAPTCHA_KEY')
+    if args.concurrency < 1:
+        parser.error('--concurrency должен быть больше 0')
+    return args
+
+
+def job_type(job: dict) -> str:
+    if job.get('type'):
+        return job['type']
+    if 'site_key' in job:
+        return 'recaptcha'
+    if 'public_key' in job:
+        return 'funcaptcha'
+    return 'image'
+
+
+def job_error(text) -> dict:
+    """
+    :return: Ответ с ошибкой задания в формате ответа `captcha_handler`
+    """
+    return dict(JSON_RESPONSE, error = True, errorBody = {'text': text, 'id': 0})
+
+
+def read_directory(path: str):
+    """
+    Задания из папки: каждое изображение - задание с `id` равным имени файла
+    """
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield {'id': name, 'type': 'image', 'file': os.path.join(path, name)}
+
+
+def read_jsonl(lines):
+    """
+    Задания из JSONL, строка с ошибкой разбора превращается в задание с ошибкой
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('строка задания должна быть JSON объектом')
+        except ValueError as error:
+            job = {'error': f'строка {number}: {error}'}
+        job.setdefault('id', number)
+        yield job
+
+
+class BulkSolver:
+    """
+    Решение потока заданий с ограничением кол-ва одновременных капч
+    """
+
+    def __init__(self, args):
+        self.args = args
+        transport = make_aio_transport(args.transport)
+        if args.record:
+            from .recording import TrafficRecorder
+
+            self.recorder = TrafficRecorder(args.record)
+            transport = self.recorder.aio_transport(transport)
+        else:
+            self.recorder = None
+        if args.retry:
+            from .retry import RetryPolicy
+
+            transport = RetryPolicy().aio_transport(transport)
+        self.transport = transport
+        hedging = None
+        if args.hedge is not None:
+            from .hedging import HedgePolicy
+
+            hedging = HedgePolicy(percentile = args.hedge)
+        options = {'rucaptcha_key': args.key, 'service_type': args.service, 'timeout': args.timeout,
+                   'transport': transport}
+        if args.sleep_time is not None:
+            options['sleep_time'] = args.sleep_time
+        options['hedging'] = hedging
+        self.options = options
+        # один объект каждого класса на все задания, классы не хранят данных вызовов;
+        # объект создаётся при первом задании своего типа - у типов разные ограничения sleep_time
+        self.classes = {'image': aioImageCaptcha,
+                        'recaptcha': aioReCaptchaV2,
+                        'funcaptcha': aioFunCaptcha,
+                        }
+        self.solvers = {}
+        self.latencies = []
+        self.solved = 0
+        self.errors = 0
+
+    def solver(self, kind: str):
+        """
+        Создаёт решатель для типа заданий при первом обращении
+        :param kind: Тип задания
+        :return: Объект решателя или ошибка его создания, которая возвращается для каждого задания этого типа
+        """
+        if kind not in self.solvers:
+            try:
+                self.solvers[kind] = self.classes[kind](**self.options)
+            except ValueError as error:
+                self.solvers[kind] = error
+        return self.solvers[kind]
+
+    async def solve(self, job: dict) -> dict:
+        kind = job_type(job)
+        if 'error' in job:
+            return job_error(job['error'])
+        if kind not in self.classes:
+            return job_error(f'неизвестный тип задания: {kind}')
+        solver = self.solver(kind)
+        if isinstance(solver, Exception):
+            return job_error(solver)
+        try:
+            if kind == 'recaptcha':
+                call = solver.captcha_handler(site_key = job['site_key'], page_url = job['page_url'],
+                                              proxy = job.get('proxy'), proxytype = job.get('proxytype'))
+            elif kind == 'funcaptcha':
+                call = solver.captcha_handler(public_key = job['public_key'], page_url = job['page_url'])
+            else:
+                call = solver.captcha_handler(captcha_link = job.get('url'), captcha_file = job.get('file'),
+                                              captcha_base64 = job.get('base64'))
+        except KeyError as error:
+            return job_error(f'в задании нет поля {error}')
+        return await call
+
+    def write(self, job: dict, answer: dict, latency: float):
+        line = dict(answer, id = job.get('id'), type = job_type(job), latency = round(latency, 3))
+        # ошибки библиотеки хранят исключения, они выводятся текстом
+        sys.stdout.write(json.dumps(line, ensure_ascii = False, default = str) + '\n')
+        sys.stdout.flush()
+        if answer['error']:
+            self.errors += 1
+        else:
+            self.solved += 1
+            self.latencies.append(latency)
+
+    async def run(self, jobs):
+        loop = asyncio.get_event_loop()
+        jobs = iter(jobs)
+        # задания читаются по одному в потоке, чтобы медленный stdin не останавливал решение
+        reading = asyncio.Lock()
+
+        async def worker():
+            while True:
+                async with reading:
+                    job = await loop.run_in_executor(None, next, jobs, None)
+                if job is None:
+                    return
+                start = time.monotonic()
+                answer = await self.solve(job)
+                self.write(job, answer, time.monotonic() - start)
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(self.args.concurrency)])
+        finally:
+            await self.transport.close()
+            if self.recorder is not None:
+                self.recorder.close()
+
+    def summary(self, elapsed: float) -> dict:
+        """
+        :return: Кол-во решённых капч и ошибок, общее время, производительность и время решения p50/p90/p99/max
+        """
+        latencies = sorted(self.latencies)
+
+        def percentile(value):
+            return round(latencies[min(int(len(latencies) * value), len(latencies) - 1)], 3) if latencies else None
+
+        total = self.solved + self.errors
+        return {'total': total,
+                'solved': self.solved,
+                'errors': self.errors,
+                'elapsed': round(elapsed, 3),
+                'per_minute': round(self.solved / elapsed * 60, 1) if elapsed else None,
+                'latency_p50': percentile(0.5),
+                'latency_p90': percentile(0.9),
+                'latency_p99': percentile(0.99),
+                'latency_max': round(latencies[-1], 3) if latencies else None,
+                }
+
+
+def main(argv = None) -> int:
+    """
+    Точка входа `rucaptcha-solve`
+    :return: Код выхода: 0 - все капчи решены, 1 - были ошибки
+    """
+    args = parse_args(argv)
+    if args.source == '-':
+        jobs = read_jsonl(sys.stdin)
+    elif os.path.isdir(args.source):
+        jobs = read_directory(args.source)
+    else:
+        jobs = read_jsonl(open(args.source, encoding = 'utf-8'))
+
+    try:
+        solver = BulkSolver(args)
+    except ValueError as error:
+        sys.stderr.write(f'rucaptcha-solve: {error}\n')
+        return 2
+    start = time.monotonic()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(solver.run(jobs))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+    sys.stderr.write(json.dumps(solver.summary(time.monotonic() - start), ensure_ascii = False) + '\n')
+    return 1 if solver.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,11 +11,15 @@ app_key = "1899"
 
 
 """
-JSON возвращаемы пользователю после решения капчи
+JSON возвращаемы пользователю после решения капчи.
+Каждый вызов `captcha_handler` возвращает новую копию этого шаблона(см. `polling.SolveTask`).
 
 serverAnswer - ответ сервера при использовании RuCaptchaControl(баланс/жалобы и т.д.)
 captchaSolve - решение капчи,
 taskId - находится Id задачи на решение капчи, можно использовать при жалобах и прочем,
+attempts - кол-во отправок капчи, добавляется только при повторной отправке(`retry.RetryPolicy`),
+tier - `local` или `service`, кем решена капча, добавляется только при локальном распознавании(`tiers.LocalTier`),
+memo - уверенность ответа, взятого из памяти ответов(`memo.AnswerMemo`), добавляется только к таким ответам,
 error - False - если всё хорошо, True - если есть ошибка,
 errorBody - полная информация об ошибке: 
     {
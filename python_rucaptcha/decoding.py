@@ -0,0 +1,32 @@
+"""
+Разбор JSON ответов сервиса.
+Каждый ответ разбирается один раз в транспорте, дальше библиотека работает с готовым словарём.
+Для разбора используется самая быстрая из установленных библиотек: `orjson`, `ujson` или стандартный `json`.
+Самый частый ответ при опросе res.php - `CAPCHA_NOT_READY` - распознаётся сравнением байт, без разбора JSON.
+"""
+try:
+    from orjson import loads
+    JSON_LIBRARY = 'orjson'
+except ImportError:
+    try:
+        from ujson import loads
+        JSON_LIBRARY = 'ujson'
+    except ImportError:
+        from json import loads
+        JSON_LIBRARY = 'json'
+
+# варианты тела ответа `CAPCHA_NOT_READY`: компактный, как отвечает сервис, и с пробелами после разделителей
+NOT_READY_BODIES = (b'{"status":0,"request":"CAPCHA_NOT_READY"}',
+                    b'{"status": 0, "request": "CAPCHA_NOT_READY"}',
+                    )
+
+
+def decode_json(content: bytes) -> dict:
+    """
+    Разбор JSON ответа сервера
+    :param content: Тело ответа
+    :return: Словарь ответа, для `CAPCHA_NOT_READY` - без разбора JSON
+    """
+    if content in NOT_READY_BODIES:
+        return {'status': 0, 'request': 'CAPCHA_NOT_READY'}
+    return loads(content)
@@ -0,0 +1,125 @@
+import time
+import base64
+import hashlib
+
+from .errors import LocalValidationError
+from .polling import request_timeout
+from .transport import CHUNK_SIZE
+from . import tracing
+
+# максимальный размер скачиваемого изображения по умолчанию
+MAX_DOWNLOAD_SIZE = 2 * 1024 * 1024
+
+
+class StreamedImage:
+    """
+    Результат потокового скачивания изображения
+    """
+    __slots__ = ('size', 'head', 'sha224', 'body', 'content')
+
+    def __init__(self, size: int, head: bytes, sha224: str, body: str = None, content: bytes = None):
+        # размер изображения в байтах
+        self.size = size
+        # первые байты изображения для проверки формата
+        self.head = head
+        # sha224 изображения, используется для имени файла
+        self.sha224 = sha224
+        # изображение в кодировке base64
+        self.body = body
+        # исходное изображение, только если было запрошено `keep_content`
+        self.content = content
+
+
+class _ImageCollector:
+    """
+    Принимает блоки изображения по мере скачивания: считает размер, хэш и base64 не храня лишних копий
+    """
+
+    def __init__(self, max_bytes: int, keep_content: bool, out_file, deadline: float):
+        self.max_bytes = max_bytes
+        self.out_file = out_file
+        self.deadline = deadline
+        self.size = 0
+        self.head = b''
+        self.hash = hashlib.sha224()
+        # если нужно исходное изображение, base64 будет посчитан после обработки
+        self.content = bytearray() if keep_content else None
+        self.b64_parts = [] if not keep_content else None
+        # остаток блока не кратный 3 байтам, кодируется вместе со следующим блоком
+        self.rest = b''
+
+    def check_length(self, headers):
+        # отказываемся от скачивания сразу, если сервер заранее сообщил размер
+        content_length = headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise LocalValidationError('ERROR_TOO_BIG_CAPTCHA_FILESIZE')
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise LocalValidationError('ERROR_TOO_BIG_CAPTCHA_FILESIZE')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError('Превышено время скачивания изображения')
+
+        if len(self.head) < 16:
+            self.head += chunk[:16 - len(self.head)]
+        self.hash.update(chunk)
+        if self.out_file is not None:
+            self.out_file.write(chunk)
+
+        if self.content is not None:
+            self.content += chunk
+        else:
+            data = self.rest + chunk
+            cut = len(data) - len(data) % 3
+            self.b64_parts.append(base64.b64encode(data[:cut]))
+            self.rest = data[cut:]
+
+    def result(self) -> StreamedImage:
+        image = StreamedImage(size = self.size, head = self.head, sha224 = self.hash.hexdigest())
+        if self.content is not None:
+            image.content = bytes(self.content)
+        else:
+            self.b64_parts.append(base64.b64encode(self.rest))
+            image.body = b''.join(self.b64_parts).decode('ascii')
+        return image
+
+
+def stream_download(transport, url: str, max_bytes: int = MAX_DOWNLOAD_SIZE, deadline: float = None,
+                    keep_content: bool = False, out_file = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+    """
+    Потоковое скачивание изображения через транспорт(соединение с сайтом переиспользуется).
+    :param transport: Синхронный транспорт(`transport.Transport`)
+    :param url: Ссылка на изображение
+    :param max_bytes: Максимальный размер изображения, при превышении - `ERROR_TOO_BIG_CAPTCHA_FILESIZE`
+    :param deadline: Дедлайн по `time.monotonic()`, при превышении - `TimeoutError`
+    :param keep_content: True - вернуть исходное изображение вместо base64(для последующей обработки)
+    :param out_file: Файл, в который изображение записывается по мере скачивания
+    :param chunk_size: Размер блока
+    :param kwargs: Параметры HTTP библиотеки транспорта
+    :return: StreamedImage
+    """
+    collector = _ImageCollector(max_bytes, keep_content, out_file, deadline)
+    kwargs.setdefault('timeout', request_timeout(deadline))
+    with tracing.span('rucaptcha.download') as span:
+        with transport.stream(url, chunk_size = chunk_size, **kwargs) as (headers, chunks):
+            collector.check_length(headers)
+            for chunk in chunks:
+                collector.feed(chunk)
+        tracing.set_attributes(span, image_bytes = collector.size)
+        return collector.result()
+
+
+async def aio_stream_download(transport, url: str, max_bytes: int = MAX_DOWNLOAD_SIZE, deadline: float = None,
+                              keep_content: bool = False, out_file = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+    """
+    Асинхронный вариант `stream_download` для асинхронного транспорта(`transport.AioTransport`)
+    """
+    collector = _ImageCollector(max_bytes, keep_content, out_file, deadline)
+    with tracing.span('rucaptcha.download') as span:
+        async with transport.stream(url, chunk_size = chunk_size, **kwargs) as (headers, chunks):
+            collector.check_length(headers)
+            async for chunk in chunks:
+                collector.feed(chunk)
+        tracing.set_attributes(span, image_bytes = collector.size)
+        return collector.result()
@@ -36,6 +36,8 @@ class RuCaptchaError(Exception):
             return BlockedimageCaptchaError.answer()
         elif description == 'MAX_USER_TURN':
             return MaxUserTurnCaptchaError.answer()
+        elif description == 'ERROR_BAD_PARAMETERS':
+            return BadParametersError.answer()
 
         # Ошибки res.php
         elif description == 'CAPCHA_NOT_READY':
@@ -63,12 +65,33 @@ class RuCaptchaError(Exception):
         elif description == 'ERROR: 1005':
             return Number1005Error.answer()
 
+        # Ошибки библиотеки
+        elif description == 'LIBRARY_TIMEOUT':
+            return TimeoutCaptchaError.answer()
+        elif description == 'LIBRARY_CANCELLED':
+            return CancelledCaptchaError.answer()
+        elif description == 'LIBRARY_CIRCUIT_OPEN':
+            return CircuitOpenCaptchaError.answer()
+
 
 class ReadError(Exception):
     def __init__(self, error):
         Exception.__init__(self, f"\n\tОшибка порождается при невозможности открыть переднный файл!\n\t\t{error}")
 
 
+class LocalValidationError(RuCaptchaError):
+    """
+    Исключение порождается при локальной проверке капчи, до отправки на сервер.
+    Хранит код ошибки сервиса, которую вернул бы сервер, `answer()` возвращает её описание из таблицы ошибок.
+    """
+    def __init__(self, description):
+        Exception.__init__(self, description)
+        self.description = description
+
+    def answer(self):
+        return self.errors(self.description)
+
+
 class WrongUserKeyError(RuCaptchaError):
     @staticmethod
     def answer():
@@ -277,6 +300,18 @@ class MaxUserTurnCaptchaError(RuCaptchaError):
                 }
 
 
+class BadParametersError(RuCaptchaError):
+    @staticmethod
+    def answer():
+        return {'text': """Исключение порождается при отсутствии обязательных параметров капчи.
+                            В запросе отсутствуют обязательные параметры или их значения имеют неверный формат.
+                            Проверьте параметры передаваемые в `captcha_handler`.
+
+                            ERROR_BAD_PARAMETERS - исключение из таблицы.""",
+                'id': 26
+                }
+
+
 # res.php
 class CaptchaNotReadyError(RuCaptchaError):
     @staticmethod
@@ -420,3 +455,39 @@ class Number1005Error(RuCaptchaError):
                             ERROR: 1005 - искючение из таблицы.""",
                 'id': 44
                 }
+
+
+# Ошибки библиотеки
+class TimeoutCaptchaError(RuCaptchaError):
+    @staticmethod
+    def answer():
+        return {'text': """Исключение порождается при превышении общего времени ожидания решения капчи.
+                            Капча не была решена за время переданное в параметре `timeout`.
+                            Увеличьте `timeout` или проверьте состояние сервиса.
+
+                            LIBRARY_TIMEOUT - исключение библиотеки.""",
+                'id': 50
+                }
+
+
+class CancelledCaptchaError(RuCaptchaError):
+    @staticmethod
+    def answer():
+        return {'text': """Исключение порождается при отмене решения капчи.
+                            Ожидание решения было прервано через `CancelToken` или отменой asyncio задачи.
+
+                            LIBRARY_CANCELLED - исключение библиотеки.""",
+                'id': 51
+                }
+
+
+class CircuitOpenCaptchaError(RuCaptchaError):
+    @staticmethod
+    def answer():
+        return {'text': """Исключение порождается при отказе в запросе к сервису без его отправки.
+                            Из-за ошибок или медленных ответов сервиса защитный выключатель(`CircuitBreaker`)
+                            временно перекрыл запросы к этому адресу. Повторите попытку позже.
+
+                            LIBRARY_CIRCUIT_OPEN - исключение библиотеки.""",
+                'id': 52
+                }
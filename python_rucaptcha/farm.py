@@ -0,0 +1,374 @@
+import os
+import copy
+import time
+import queue
+import base64
+import pickle
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, CancelledError
+
+from .config import JSON_RESPONSE
+from .errors import RuCaptchaError, LocalValidationError
+from .download import MAX_DOWNLOAD_SIZE, stream_download
+from .validators import validate_image, validate_image_base64, validate_image_head
+from .transport import RequestsTransport
+from .polling import CancelToken, make_deadline, request_timeout, cancelled_error
+
+# максимальное кол-во ID капч в одном запросе res.php?action=get&ids=...
+MAX_IDS_PER_REQUEST = 100
+
+# транспорт процесса-воркера, создаётся при первой задаче
+_worker_transport = None
+
+
+def _get_worker_transport():
+    global _worker_transport
+    if _worker_transport is None:
+        _worker_transport = RequestsTransport()
+    return _worker_transport
+
+
+def _farm_submit(url_request: str, payload: dict, source: tuple, timeout: float = None, validation: bool = True,
+                 download_max_bytes: int = MAX_DOWNLOAD_SIZE, upload_method: str = 'base64'):
+    """
+    Выполняется в процессе-воркере: скачивает/считывает изображение, проверяет его, кодирует в base64
+    и отправляет капчу на in.php
+    :param url_request: URL для отправки капчи
+    :param payload: Пайлоад POST запроса
+    :param source: Источник изображения - (`link`, url, kwargs), (`file`, путь, None), (`base64`, строка, None)
+                   или None, если капча отправляется без изображения
+    :param timeout: Оставшееся время до дедлайна
+    :param validation: True - проверять размер и формат изображения до отправки на сервер
+    :param download_max_bytes: Максимальный размер скачиваемого по ссылке изображения в байтах
+    :param upload_method: Способ отправки изображения: `base64` или `post`(байтами в multipart запросе)
+    :return: JSON ответ in.php
+    """
+    transport = _get_worker_transport()
+    deadline = make_deadline(timeout)
+    files = None
+
+    if source is not None:
+        source_type, value, kwargs = source
+        content = None
+        try:
+            if source_type == 'link':
+                image = stream_download(transport, value, max_bytes = download_max_bytes, deadline = deadline,
+                                        keep_content = upload_method == 'post', **(kwargs or {}))
+                if image.content is not None:
+                    content = image.content
+                else:
+                    if validation:
+                        validate_image_head(image.head, image.size)
+                    payload['body'] = image.body
+            elif source_type == 'file':
+                with open(value, 'rb') as captcha_image:
+                    content = captcha_image.read()
+            elif source_type == 'base64':
+                if upload_method == 'post':
+                    content = base64.b64decode(value)
+                else:
+                    if validation:
+                        validate_image_base64(value)
+                    payload['body'] = value
+            else:
+                raise ValueError(f'Передан неверный тип контента! Допустимые: `link`, `file` и `base64`. '
+                                 f'Вы передали: `{source_type}`')
+
+            if content is not None:
+                if validation:
+                    validate_image(content)
+                if upload_method == 'post':
+                    payload['method'] = 'post'
+                    files = {'file': content}
+                else:
+                    payload['body'] = base64.b64encode(content).decode('utf-8')
+        except LocalValidationError as error:
+            # ответ в формате in.php, код ошибки разбирается так же как ответ сервера
+            return {'status': 0, 'request': error.description}
+
+    return transport.submit(url_request, payload, files = files, timeout = request_timeout(deadline))
+
+
+def _portable_error(error: Exception) -> Exception:
+    """
+    Исключение передаётся в основной процесс через очередь, непереносимое заменяется текстом
+    """
+    try:
+        pickle.dumps(error)
+    except Exception:
+        return RuntimeError(f'{type(error).__name__}: {error}')
+    return error
+
+
+def _coordinator(in_queue, out_queue, sleep_time: int):
+    """
+    Процесс-координатор: единственный, кто опрашивает res.php.
+    Все ожидающие решения капчи одного ключа опрашиваются одним запросом с параметром `ids`,
+    готовые ответы отправляются обратно в основной процесс через `out_queue`.
+    Команды из `in_queue`:
+        ('add', key, url_response, rucaptcha_key, captcha_id, timeout) - новая капча для ожидания
+        ('cancel', key) - удалить капчу из ожидания
+        ('stop',) - завершить работу
+    """
+    transport = RequestsTransport()
+
+    # key -> [url_response, rucaptcha_key, captcha_id, deadline, next_poll]
+    pending = {}
+
+    def finish(key, result_update: dict):
+        pending.pop(key, None)
+        out_queue.put((key, result_update))
+
+    while True:
+        # ожидаем команды не дольше чем до ближайшего опроса или дедлайна
+        wake_times = [task[4] for task in pending.values()] + \
+                     [task[3] for task in pending.values() if task[3] is not None]
+        wait = max(min(wake_times) - time.monotonic(), 0) if wake_times else None
+        commands = []
+        try:
+            commands.append(in_queue.get(timeout = wait))
+            while True:
+                commands.append(in_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        for command in commands:
+            if command[0] == 'add':
+                _, key, url_response, rucaptcha_key, captcha_id, timeout = command
+                pending[key] = [url_response, rucaptcha_key, captcha_id, make_deadline(timeout),
+                                time.monotonic() + sleep_time]
+            elif command[0] == 'cancel':
+                pending.pop(command[1], None)
+            elif command[0] == 'stop':
+                out_queue.put(None)
+                return
+
+        now = time.monotonic()
+        # группируем готовые к опросу капчи по URL и ключу
+        groups = {}
+        for key, task in pending.items():
+            if task[4] <= now:
+                groups.setdefault((task[0], task[1]), []).append(key)
+
+        for (url_response, rucaptcha_key), keys in groups.items():
+            for i in range(0, len(keys), MAX_IDS_PER_REQUEST):
+                chunk = keys[i:i + MAX_IDS_PER_REQUEST]
+                try:
+                    captcha_response = transport.get_many(url_response, rucaptcha_key,
+                                                          [pending[key][2] for key in chunk],
+                                                          timeout = sleep_time * 2)
+                except Exception as error:
+                    # сетевая ошибка не завершает капчи - они опрашиваются снова через `sleep_time`,
+                    # ошибкой завершаются только капчи с истёкшим дедлайном
+                    for key in chunk:
+                        if pending[key][3] is not None and pending[key][3] <= now:
+                            finish(key, {'error': True, 'errorBody': {'text': _portable_error(error)}})
+                        else:
+                            pending[key][4] = now + sleep_time
+                    continue
+
+                # ошибка на весь запрос, например неверный ключ
+                if captcha_response['status'] == 0 and captcha_response['request'] != 'CAPCHA_NOT_READY':
+                    for key in chunk:
+                        finish(key, {'error': True,
+                                     'errorBody': RuCaptchaError().errors(captcha_response['request'])})
+                    continue
+
+                answers = captcha_response['request'].split('|')
+                # один общий ответ на все ID, например CAPCHA_NOT_READY
+                if len(answers) == 1:
+                    answers = answers * len(chunk)
+                for key, answer in zip(chunk, answers):
+                    if answer == 'CAPCHA_NOT_READY':
+                        pending[key][4] = now + sleep_time
+                        continue
+                    error_body = RuCaptchaError().errors(answer)
+                    # ошибка отсутствующая в таблице ошибок библиотеки
+                    if error_body is None and answer.startswith('ERROR'):
+                        error_body = {'text': answer, 'id': 0}
+                    if error_body:
+                        finish(key, {'error': True, 'errorBody': error_body})
+                    else:
+                        finish(key, {'captchaSolve': answer})
+
+        # капчи не решённые до дедлайна
+        now = time.monotonic()
+        for key, task in list(pending.items()):
+            if task[3] is not None and task[3] <= now:
+                finish(key, {'error': True, 'errorBody': RuCaptchaError().errors('LIBRARY_TIMEOUT')})
+
+
+class SolverFarm:
+    """
+    Многопроцессная ферма для решения капчи.
+    Процессы-воркеры скачивают изображения, кодируют их в base64 и отправляют капчу на in.php,
+    а единственный процесс-координатор опрашивает res.php сразу для всех капч и возвращает ответы.
+    Классы `ImageCaptcha` и `ReCaptchaV2`(и их асинхронные варианты) работают через ферму,
+    если передать её в параметре `farm`.
+    """
+
+    def __init__(self, workers: int = None, sleep_time: int = 5, mp_context=None):
+        """
+        :param workers: Кол-во процессов-воркеров, по умолчанию - кол-во ядер
+        :param sleep_time: Время ожидания между опросами res.php в координаторе
+        :param mp_context: Контекст `multiprocessing`, по умолчанию - стандартный для платформы
+        """
+        if sleep_time < 5:
+            raise ValueError(f'Параметр `sleep_time` должен быть не менее 5. Вы передали - {sleep_time}')
+        self.sleep_time = sleep_time
+        self.workers = workers or os.cpu_count() or 1
+
+        mp_context = mp_context or multiprocessing.get_context()
+        self._pool = ProcessPoolExecutor(max_workers = self.workers, mp_context = mp_context)
+        self._in_queue = mp_context.Queue()
+        self._out_queue = mp_context.Queue()
+        self._coordinator = mp_context.Process(target = _coordinator,
+                                               args = (self._in_queue, self._out_queue, sleep_time),
+                                               daemon = True)
+        self._coordinator.start()
+
+        self._keys = itertools.count()
+        # key -> [Future, result]
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._listener = threading.Thread(target = self._listen, daemon = True)
+        self._listener.start()
+        self._closed = False
+
+    def _listen(self):
+        """
+        Поток основного процесса, принимающий ответы координатора
+        """
+        while True:
+            message = self._out_queue.get()
+            if message is None:
+                return
+            key, result_update = message
+            self._resolve(key, result_update)
+
+    def _resolve(self, key, result_update: dict):
+        with self._lock:
+            future, result = self._futures.pop(key, (None, None))
+        if future is None:
+            return
+        result.update(result_update)
+        if future.set_running_or_notify_cancel():
+            future.set_result(result)
+
+    def submit(self, url_request: str, url_response: str, payload: dict, captcha_link: str = None,
+               captcha_file: str = None, captcha_base64: str = None, timeout: float = None, validation: bool = True,
+               download_max_bytes: int = MAX_DOWNLOAD_SIZE, upload_method: str = 'base64', **kwargs):
+        """
+        Отправляет капчу на решение через ферму
+        :param url_request: URL для отправки капчи
+        :param url_response: URL для получения ответа
+        :param payload: Пайлоад POST запроса(ключ, метод и параметры капчи)
+        :param captcha_link: Ссылка на изображение, скачивается воркером
+        :param captcha_file: Адрес(локальный) по которому находится изображение
+        :param captcha_base64: Изображение переданное в кодировке base64
+        :param timeout: Общее время ожидания решения капчи в секундах
+        :param validation: True - проверять размер и формат изображения до отправки на сервер
+        :param download_max_bytes: Максимальный размер скачиваемого по ссылке изображения в байтах
+        :param upload_method: Способ отправки изображения: `base64` или `post`(байтами в multipart запросе)
+        :param kwargs: Параметры для библиотеки `requests` при скачивании изображения
+        :return: `concurrent.futures.Future`, результатом которого будет JSON ответ как у `captcha_handler`.
+                 Отмена Future убирает капчу из ожидания координатора.
+        """
+        if self._closed:
+            raise RuntimeError('SolverFarm закрыта')
+
+        if captcha_link:
+            source = ('link', captcha_link, kwargs)
+        elif captcha_file:
+            source = ('file', captcha_file, None)
+        elif captcha_base64:
+            source = ('base64', captcha_base64, None)
+        else:
+            source = None
+
+        key = next(self._keys)
+        future = Future()
+        result = copy.deepcopy(JSON_RESPONSE)
+        with self._lock:
+            self._futures[key] = [future, result]
+
+        deadline = make_deadline(timeout)
+        submit_future = self._pool.submit(_farm_submit, url_request, dict(payload), source, timeout,
+                                          validation, download_max_bytes, upload_method)
+
+        def on_submitted(submit_future):
+            try:
+                captcha_id = submit_future.result()
+            except Exception as error:
+                self._resolve(key, {'error': True, 'errorBody': {'text': error}})
+                return
+
+            if captcha_id['status'] == 0:
+                self._resolve(key, {'error': True, 'errorBody': RuCaptchaError().errors(captcha_id['request'])})
+                return
+
+            result['taskId'] = captcha_id['request']
+            # Future отменили, пока капча отправлялась - в ожидание координатора она не добавляется
+            with self._lock:
+                if key not in self._futures:
+                    return
+            # ферма закрыта, координатор уже остановлен
+            if self._closed:
+                self._resolve(key, cancelled_error({}))
+                return
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._resolve(key, {'error': True, 'errorBody': RuCaptchaError().errors('LIBRARY_TIMEOUT')})
+                    return
+            self._in_queue.put(('add', key, url_response, payload['key'], captcha_id['request'], remaining))
+
+        def on_done(future):
+            # при отмене удаляем капчу из ожидания координатора
+            if future.cancelled():
+                with self._lock:
+                    self._futures.pop(key, None)
+                if not self._closed:
+                    self._in_queue.put(('cancel', key))
+
+        submit_future.add_done_callback(on_submitted)
+        future.add_done_callback(on_done)
+        return future
+
+    def solve(self, *args, cancel_token: CancelToken = None, **kwargs):
+        """
+        Синхронный вариант `submit` - ожидает и возвращает JSON ответ
+        :param cancel_token: `CancelToken` для отмены ожидания решения из другого потока
+        """
+        future = self.submit(*args, **kwargs)
+        if cancel_token is not None:
+            cancel_token.on_cancel(future.cancel)
+        try:
+            return future.result()
+        except CancelledError:
+            return cancelled_error(copy.deepcopy(JSON_RESPONSE))
+
+    def close(self):
+        """
+        Останавливает координатора и воркеров, нерешённые капчи завершаются ошибкой отмены
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._in_queue.put(('stop',))
+        self._coordinator.join()
+        self._listener.join()
+        self._pool.shutdown()
+        with self._lock:
+            keys = list(self._futures)
+        for key in keys:
+            self._resolve(key, cancelled_error({}))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
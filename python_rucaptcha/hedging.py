@@ -0,0 +1,352 @@
+"""
+Дублирующая отправка капчи для сокращения долгого хвоста времени решения.
+Если капча не решена за заданный перцентиль наблюдаемого времени решения, на сервис отправляется её дубликат,
+дальше опрашиваются обе задачи и используется первое полученное решение. У сервиса нет отмены задачи,
+поэтому проигравшая задача просто перестаёт опрашиваться(её решение оплачивается).
+
+Дублирование включается параметром `hedging` классов `ReCaptchaV2`, `FunCaptcha`, `ImageCaptcha` и их `aio*` вариантов:
+    policy = HedgePolicy(percentile = 0.9, max_ratio = 0.1)
+    ReCaptchaV2.ReCaptchaV2(rucaptcha_key = KEY, hedging = policy)
+Один объект политики можно передать нескольким классам одного вида капчи - время решения накапливается общее.
+"""
+import time
+import threading
+import collections
+
+from .errors import RuCaptchaError
+from . import tracing
+from .polling import CancelToken, request_timeout, timeout_error, cancelled_error, _copy_attempts
+
+
+def _percentile(values, percentile: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+class HedgePolicy:
+    """
+    Политика дублирующей отправки: задержка дубликата по наблюдаемому времени решения и ограничения расходов
+    """
+
+    def __init__(self, percentile: float = 0.9, min_samples: int = 20, window: int = 500, initial_delay: float = None,
+                 max_ratio: float = 0.1, budget: int = None):
+        """
+        :param percentile: Перцентиль времени решения, после которого отправляется дубликат
+        :param min_samples: Кол-во наблюдений времени решения, до набора которых используется `initial_delay`
+        :param window: Кол-во последних наблюдений, по которым считается перцентиль
+        :param initial_delay: Задержка дубликата в секундах до набора `min_samples`, None - не дублировать
+        :param max_ratio: Максимальная доля дубликатов от всех отправленных капч
+        :param budget: Максимальное общее кол-во дубликатов, None - без ограничения
+        """
+        if not 0 < percentile < 1:
+            raise ValueError(f'Параметр `percentile` должен быть от 0 до 1. Вы передали - {percentile}')
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.max_ratio = max_ratio
+        self.budget = budget
+        # время решения последних капч
+        self.latencies = collections.deque(maxlen = window)
+        # время от первой отправки до решения, с учётом дублирования
+        self.solve_times = collections.deque(maxlen = window)
+        self._lock = threading.Lock()
+        self._stats = {'tasks': 0,
+                       'hedged': 0,
+                       'hedge_wins': 0,
+                       'capped': 0,
+                       'hedge_errors': 0,
+                       }
+
+    def delay(self):
+        """
+        :return: Через сколько секунд после отправки отправлять дубликат, None - не дублировать
+        """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            return _percentile(self.latencies, self.percentile)
+
+    def start(self):
+        """
+        Учитывает новую отправленную капчу
+        """
+        with self._lock:
+            self._stats['tasks'] += 1
+
+    def allow(self) -> bool:
+        """
+        Проверяет ограничения расходов и учитывает дубликат
+        :return: True - дубликат можно отправить
+        """
+        with self._lock:
+            stats = self._stats
+            if (self.budget is not None and stats['hedged'] >= self.budget) or \
+                    stats['hedged'] + 1 > stats['tasks'] * self.max_ratio:
+                stats['capped'] += 1
+                return False
+            stats['hedged'] += 1
+            return True
+
+    def submit_failed(self):
+        """
+        Учитывает дубликат, который не удалось отправить из-за сетевой ошибки
+        """
+        with self._lock:
+            self._stats['hedge_errors'] += 1
+
+    def record(self, latency: float, solve_time: float, hedge_won: bool):
+        """
+        Учитывает решение капчи
+        :param latency: Время решения задачи, давшей ответ, от её отправки
+        :param solve_time: Время от первой отправки до решения
+        :param hedge_won: True - первым пришло решение дубликата
+        """
+        with self._lock:
+            self.latencies.append(latency)
+            self.solve_times.append(solve_time)
+            self._stats['hedge_wins'] += hedge_won
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во капч, дубликатов, побед дубликатов, отказов по ограничениям расходов, неотправленных
+                 из-за сетевых ошибок дубликатов, доля дополнительных
+                 расходов, текущая задержка дубликата, p50/p99 времени решения задач и времени решения с дублированием
+        """
+        delay = self.delay()
+        with self._lock:
+            report = dict(self._stats,
+                          extra_cost_ratio = self._stats['hedged'] / self._stats['tasks'] if self._stats['tasks'] else 0.0,
+                          hedge_delay = delay)
+            for name, values in (('latency', self.latencies), ('solve_time', self.solve_times)):
+                report[f'{name}_p50'] = _percentile(values, 0.5) if values else None
+                report[f'{name}_p99'] = _percentile(values, 0.99) if values else None
+            return report
+
+
+class _HedgedTasks:
+    """
+    Состояние опроса основной задачи и её дубликата
+    """
+    __slots__ = ('policy', 'started', 'hedge_at', 'hedged', 'primary', 'tasks', 'errors')
+
+    def __init__(self, policy: HedgePolicy, primary: str):
+        policy.start()
+        self.policy = policy
+        self.started = time.monotonic()
+        delay = policy.delay()
+        self.hedge_at = self.started + delay if delay is not None else None
+        self.hedged = False
+        self.primary = primary
+        # ID задачи -> время отправки
+        self.tasks = {primary: self.started}
+        # коды ошибок сервиса и исключения опроса завершившихся задач
+        self.errors = []
+
+    def wait(self, sleep_time: float) -> float:
+        # просыпаемся к моменту отправки дубликата, если он раньше следующего опроса
+        if self.hedge_at is not None and not self.hedged:
+            return max(min(sleep_time, self.hedge_at - time.monotonic()), 0)
+        return sleep_time
+
+    def hedge_due(self) -> bool:
+        if self.hedge_at is None or self.hedged or time.monotonic() < self.hedge_at:
+            return False
+        self.hedged = True
+        return self.policy.allow()
+
+    def submitted(self, answer: dict):
+        if answer['status'] == 1:
+            self.tasks[answer['request']] = time.monotonic()
+
+    def answer(self, captcha_id: str, captcha_response: dict, result: dict) -> bool:
+        """
+        Разбирает ответ res.php для одной из задач
+        :return: True - если ожидание решения закончено(решение или ошибка записаны в result)
+        """
+        if captcha_response['request'] == 'CAPCHA_NOT_READY':
+            return False
+        now = time.monotonic()
+        submitted = self.tasks.pop(captcha_id)
+        if captcha_response['status'] == 1:
+            self.policy.record(now - submitted, now - self.started, captcha_id != self.primary)
+            result.update({'captchaSolve': captcha_response['request'],
+                           'taskId': captcha_id,
+                           }
+                          )
+            _copy_attempts(captcha_response, result)
+            return True
+        self.errors.append(captcha_response['request'])
+        return self._all_failed(result)
+
+    def failed(self, captcha_id: str, error: Exception, result: dict) -> bool:
+        """
+        Опрос одной из задач завершился исключением: задача больше не опрашивается, остальные продолжают решаться
+        :return: True - если не осталось ни одной задачи(ошибка записана в result)
+        """
+        self.tasks.pop(captcha_id, None)
+        self.errors.append(error)
+        return self._all_failed(result)
+
+    def _all_failed(self, result: dict) -> bool:
+        # ошибкой завершились все задачи
+        if self.tasks:
+            return False
+        error = self.errors[0]
+        result.update({'error': True,
+                       'errorBody': RuCaptchaError().errors(error) if isinstance(error, str) else {'text': error}
+                       }
+                      )
+        return True
+
+
+def hedged_result_poller(transport, url_request: str, url_response: str, post_payload: dict, get_payload: dict,
+                         sleep_time: int, result: dict, policy: HedgePolicy, deadline: float = None,
+                         cancel_token: CancelToken = None, files: dict = None):
+    """
+    Синхронное ожидание решения капчи с дублирующей отправкой, аналог `polling.result_poller`
+    :param transport: Синхронный транспорт(`transport.Transport`)
+    :param url_request: URL для отправки дубликата
+    :param url_response: URL для получения ответа
+    :param post_payload: Пайлоад отправки капчи, используется для дубликата без изменений
+    :param get_payload: Пайлоад запроса с ID основной капчи
+    :param sleep_time: Время ожидания между запросами
+    :param result: Словарь результата, в который вносится решение или ошибка
+    :param policy: Политика дублирования
+    :param deadline: Дедлайн по `time.monotonic()`, None - без ограничения
+    :param cancel_token: Токен отмены ожидания
+    :param files: Файлы multipart запроса отправки капчи, отправляются с дубликатом
+    :return: result
+    """
+    hedge = _HedgedTasks(policy, get_payload['id'])
+    attempt = 0
+    with tracing.span('rucaptcha.wait', task_id = get_payload['id'], hedging = True) as wait_span:
+        try:
+            while True:
+                wait = hedge.wait(sleep_time)
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return timeout_error(result)
+                    wait = min(wait, remaining)
+
+                if cancel_token is not None:
+                    if cancel_token.wait(wait):
+                        return cancelled_error(result)
+                else:
+                    time.sleep(wait)
+
+                if hedge.hedge_due():
+                    try:
+                        hedge.submitted(transport.submit(url_request, post_payload, files = files,
+                                                         timeout = request_timeout(deadline)))
+                    except Exception:
+                        # дубликат необязателен: основная задача продолжает решаться
+                        policy.submit_failed()
+
+                attempt += 1
+                tracing.set_attributes(wait_span, polls = attempt, hedged = hedge.hedged)
+                for captcha_id in list(hedge.tasks):
+                    try:
+                        with tracing.span('rucaptcha.poll', task_id = captcha_id, attempt = attempt) as span:
+                            captcha_response = transport.get(url_response, dict(get_payload, id = captcha_id),
+                                                             timeout = request_timeout(deadline))
+                            tracing.record_answer(span, captcha_response)
+                    except Exception as error:
+                        if deadline is not None and time.monotonic() >= deadline:
+                            return timeout_error(result)
+                        # задача с ошибкой опроса отбрасывается, ожидание продолжается по остальным
+                        transport.finish(captcha_id)
+                        if hedge.failed(captcha_id, error, result):
+                            return result
+                        continue
+                    if captcha_response['request'] != 'CAPCHA_NOT_READY':
+                        transport.finish(captcha_id)
+                    if hedge.answer(captcha_id, captcha_response, result):
+                        return result
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    return timeout_error(result)
+
+        finally:
+            # проигравшая задача больше не опрашивается
+            for captcha_id in hedge.tasks:
+                transport.finish(captcha_id)
+
+
+async def aio_hedged_result_poller(transport, url_request: str, url_response: str, post_payload: dict,
+                                   get_payload: dict, sleep_time: int, result: dict, policy: HedgePolicy,
+                                   deadline: float = None, files: dict = None):
+    """
+    Асинхронное ожидание решения капчи с дублирующей отправкой, аналог `hedged_result_poller`.
+    Опросы основной задачи и дубликата выполняются одновременно.
+    """
+    import asyncio
+
+    hedge = _HedgedTasks(policy, get_payload['id'])
+    attempt = 0
+    with tracing.span('rucaptcha.wait', task_id = get_payload['id'], hedging = True) as wait_span:
+        try:
+            while True:
+                wait = hedge.wait(sleep_time)
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return timeout_error(result)
+                    wait = min(wait, remaining)
+                await asyncio.sleep(wait)
+
+                if hedge.hedge_due():
+                    try:
+                        hedge.submitted(await asyncio.wait_for(transport.submit(url_request, post_payload, files = files),
+                                                               timeout = request_timeout(deadline)))
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        if deadline is not None and time.monotonic() >= deadline:
+                            return timeout_error(result)
+                        # дубликат необязателен: основная задача продолжает решаться
+                        policy.submit_failed()
+
+                captcha_ids = list(hedge.tasks)
+                attempt += 1
+                tracing.set_attributes(wait_span, polls = attempt, hedged = hedge.hedged)
+                try:
+                    # запросы по задачам выполняются одновременно, поэтому спан один на все задачи
+                    with tracing.span('rucaptcha.poll', attempt = attempt, tasks = len(captcha_ids)):
+                        answers = await asyncio.wait_for(
+                            asyncio.gather(*[transport.get(url_response, dict(get_payload, id = captcha_id))
+                                             for captcha_id in captcha_ids], return_exceptions = True),
+                            timeout = request_timeout(deadline))
+                except asyncio.TimeoutError as error:
+                    if deadline is not None:
+                        return timeout_error(result)
+                    result.update({'error': True,
+                                   'errorBody': {
+                                       'text': error
+                                       }
+                                   }
+                                  )
+                    return result
+
+                for captcha_id, captcha_response in zip(captcha_ids, answers):
+                    if isinstance(captcha_response, Exception):
+                        # задача с ошибкой опроса отбрасывается, ожидание продолжается по остальным
+                        transport.finish(captcha_id)
+                        if hedge.failed(captcha_id, captcha_response, result):
+                            return result
+                        continue
+                    if captcha_response['request'] != 'CAPCHA_NOT_READY':
+                        transport.finish(captcha_id)
+                    if hedge.answer(captcha_id, captcha_response, result):
+                        return result
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    return timeout_error(result)
+
+        except asyncio.CancelledError:
+            cancelled_error(result)
+            raise
+
+        finally:
+            for captcha_id in hedge.tasks:
+                transport.finish(captcha_id)
@@ -0,0 +1,232 @@
+"""
+Память ответов на текстовые капчи.
+Наборы вопросов на сайтах обычно небольшие и повторяются, а каждый вопрос через сервис решается не быстрее
+`sleep_time` и оплачивается. `AnswerMemo` запоминает ответы сервиса по нормализованному вопросу(юникод NFKC,
+без учёта регистра, пробелов и знаков препинания, отдельно для каждого языка `lang`), и повторный вопрос
+решается без запроса к сервису:
+    memo = AnswerMemo('answers.jsonl')
+    TextCaptcha.TextCaptcha(rucaptcha_key = KEY, memo = memo)
+    RuCaptchaControl.RuCaptchaControl(rucaptcha_key = KEY, memo = memo)
+
+Уверенность ответа - доля совпавших ответов сервиса на этот вопрос. Ответ из памяти используется, если он получен
+от сервиса не менее `min_votes` раз и его уверенность не ниже `min_confidence`, иначе вопрос отправляется на сервис
+и его ответ добавляется к голосам. Жалоба `reportbad` через `RuCaptchaControl` с той же памятью(или `invalidate`)
+удаляет ответ задачи и запоминает его как неверный для этого вопроса.
+
+Память хранится в JSONL файле: каждое изменение дописывается строкой, при загрузке строки применяются по порядку,
+`compact` перезаписывает файл текущим состоянием.
+"""
+import os
+import json
+import threading
+import unicodedata
+import collections
+
+from .singleflight import normalize_text
+
+# кол-во ID задач, по которым можно отменить ответ
+MAX_TASKS = 100000
+
+
+def normalize_question(text: str) -> str:
+    """
+    Нормализация вопроса: `singleflight.normalize_text` и знаки препинания как пробелы
+    """
+    text = ''.join(' ' if unicodedata.category(char).startswith('P') else char for char in normalize_text(text))
+    return ' '.join(text.split())
+
+
+def memo_key(question: str, lang: str = None) -> str:
+    """
+    :return: Ключ вопроса в памяти: язык и нормализованный вопрос
+    """
+    return f'{lang or ""}:{normalize_question(question)}'
+
+
+class _Entry:
+    """
+    Ответы сервиса на один вопрос
+    """
+    __slots__ = ('answers', 'bad')
+
+    def __init__(self):
+        # нормализованный ответ -> [ответ, кол-во совпадений, ID последней задачи]
+        self.answers = {}
+        # нормализованные ответы, на которые была жалоба
+        self.bad = set()
+
+    def best(self):
+        """
+        :return: [ответ, кол-во совпадений, ID задачи] с наибольшим кол-вом совпадений и его уверенность
+        """
+        best = max(self.answers.values(), key = lambda answer: answer[1])
+        return best, best[1] / sum(answer[1] for answer in self.answers.values())
+
+
+class AnswerMemo:
+    """
+    Память ответов на вопросы текстовых капч, один объект используется из разных потоков
+    """
+
+    def __init__(self, path: str = None, min_votes: int = 1, min_confidence: float = 0.6, max_tasks: int = MAX_TASKS):
+        """
+        :param path: JSONL файл памяти, загружается при создании и дополняется при изменениях, None - только в памяти
+        :param min_votes: Сколько раз сервис должен дать один и тот же ответ, чтобы он использовался из памяти
+        :param min_confidence: Минимальная доля совпадающих ответов сервиса
+        :param max_tasks: Кол-во последних ID задач, по которым можно отменить ответ
+        """
+        if min_votes < 1:
+            raise ValueError(f'Параметр `min_votes` должен быть больше 0. Вы передали - {min_votes}')
+        self.path = path
+        self.min_votes = min_votes
+        self.min_confidence = min_confidence
+        self.max_tasks = max_tasks
+        # ключ вопроса -> `_Entry`
+        self._entries = {}
+        # ID задачи -> (ключ вопроса, нормализованный ответ)
+        self._tasks = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'learned': 0, 'invalidated': 0}
+        self._file = None
+        if path is not None:
+            self._load()
+            self._file = open(path, 'a', encoding = 'utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding = 'utf-8') as memo_file:
+            for line in memo_file:
+                try:
+                    record = json.loads(line)
+                    if record['op'] == 'answer':
+                        self._learn(record['key'], record['answer'], record.get('task'), record.get('votes', 1))
+                    elif record['op'] == 'bad':
+                        self._invalidate(record['key'], record['answer'])
+                except (ValueError, KeyError):
+                    # недописанная при аварийном завершении строка
+                    continue
+
+    def _write(self, record: dict):
+        if self._file is not None:
+            self._file.write(json.dumps(record, ensure_ascii = False) + '\n')
+            self._file.flush()
+
+    def _learn(self, key: str, answer: str, task_id: str = None, votes: int = 1):
+        normalized = normalize_text(answer)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        if normalized in entry.bad:
+            return False
+        record = entry.answers.get(normalized)
+        if record is None:
+            record = entry.answers[normalized] = [answer, 0, None]
+        record[1] += votes
+        if task_id is not None:
+            record[2] = task_id
+            self._tasks[task_id] = (key, normalized)
+            self._tasks.move_to_end(task_id)
+            if len(self._tasks) > self.max_tasks:
+                self._tasks.popitem(last = False)
+        return True
+
+    def _invalidate(self, key: str, normalized: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.answers.pop(normalized, None)
+        entry.bad.add(normalized)
+
+    def lookup(self, question: str, lang: str = None):
+        """
+        Ответ на вопрос из памяти
+        :param question: Текст вопроса
+        :param lang: Язык вопроса(параметр `lang` капчи)
+        :return: (ответ, ID задачи сервиса с этим ответом, уверенность) или None - вопрос нужно отправить на сервис
+        """
+        key = memo_key(question, lang)
+        with self._lock:
+            self._stats['lookups'] += 1
+            entry = self._entries.get(key)
+            if entry is None or not entry.answers:
+                return None
+            (answer, votes, task_id), confidence = entry.best()
+            if votes < self.min_votes or confidence < self.min_confidence:
+                return None
+            self._stats['hits'] += 1
+            return answer, task_id, round(confidence, 3)
+
+    def learn(self, question: str, answer: str, task_id: str = None, lang: str = None):
+        """
+        Добавляет ответ сервиса к голосам вопроса
+        :return: False - на этот ответ была жалоба, он не запоминается
+        """
+        key = memo_key(question, lang)
+        with self._lock:
+            if not self._learn(key, answer, task_id):
+                return False
+            self._stats['learned'] += 1
+            self._write({'op': 'answer', 'key': key, 'answer': answer, 'task': task_id})
+            return True
+
+    def invalidate(self, task_id: str) -> bool:
+        """
+        Удаляет ответ задачи(например, после `reportbad`), этот ответ больше не запоминается для её вопроса
+        :param task_id: ID задачи сервиса, в том числе из ответа, взятого из памяти
+        :return: True - ответ задачи был в памяти
+        """
+        with self._lock:
+            found = self._tasks.pop(str(task_id), None)
+            if found is None:
+                return False
+            key, normalized = found
+            self._invalidate(key, normalized)
+            self._stats['invalidated'] += 1
+            self._write({'op': 'bad', 'key': key, 'answer': normalized, 'task': str(task_id)})
+            return True
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во запросов к памяти, ответов из неё, запомненных и отменённых ответов, вопросов и доля попаданий
+        """
+        with self._lock:
+            return dict(self._stats, questions = len(self._entries),
+                        hit_rate = round(self._stats['hits'] / self._stats['lookups'], 3)
+                        if self._stats['lookups'] else None)
+
+    def compact(self):
+        """
+        Перезаписывает файл памяти текущим состоянием: по строке на ответ и неверный ответ каждого вопроса
+        """
+        if self.path is None:
+            return
+        part = f'{self.path}.part'
+        with self._lock:
+            with open(part, 'w', encoding = 'utf-8') as out_file:
+                for key, entry in self._entries.items():
+                    for answer, votes, task_id in entry.answers.values():
+                        out_file.write(json.dumps({'op': 'answer', 'key': key, 'answer': answer, 'task': task_id,
+                                                   'votes': votes}, ensure_ascii = False) + '\n')
+                    for normalized in entry.bad:
+                        out_file.write(json.dumps({'op': 'bad', 'key': key, 'answer': normalized},
+                                                  ensure_ascii = False) + '\n')
+            # после `close` файл не открывается снова
+            was_open = self._file is not None
+            if was_open:
+                self._file.close()
+            os.replace(part, self.path)
+            if was_open:
+                self._file = open(self.path, 'a', encoding = 'utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
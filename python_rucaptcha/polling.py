@@ -0,0 +1,347 @@
+import copy
+import time
+import threading
+
+from .config import JSON_RESPONSE
+from .errors import RuCaptchaError
+from . import tracing
+
+
+class CancelToken:
+    """
+    Токен кооперативной отмены для синхронных `captcha_handler`.
+    Передаётся в `captcha_handler(cancel_token=...)`, вызов `cancel()` из любого потока
+    прерывает ожидание решения капчи не дожидаясь окончания `sleep_time`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """
+        Отменяет ожидание решения капчи
+        """
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """
+        Вызывает `callback()` при отмене, сразу - если токен уже отменён
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Ожидает отмены не дольше `timeout` секунд
+        :return: True - если ожидание было отменено
+        """
+        return self._event.wait(timeout)
+
+
+def new_result() -> dict:
+    """
+    :return: Новый словарь результата `captcha_handler` по шаблону `config.JSON_RESPONSE`
+    """
+    return copy.deepcopy(JSON_RESPONSE)
+
+
+class SolveTask:
+    """
+    Данные одной капчи на время вызова `captcha_handler`: результат и пайлоады с телом капчи и её ID.
+    Объект класса капчи хранит только общие параметры, поэтому после вызова в нём не остаётся
+    изображений и ответов, а одновременные вызовы одного объекта не мешают друг другу.
+    """
+    __slots__ = ('result', 'post_payload', 'get_payload', 'files')
+
+    def __init__(self, post_payload: dict = None, get_payload: dict = None):
+        self.result = new_result()
+        self.post_payload = dict(post_payload or {})
+        self.get_payload = dict(get_payload or {})
+        # файлы multipart запроса отправки, если капча отправляется не в пайлоаде
+        self.files = None
+
+
+def make_deadline(timeout: float = None):
+    """
+    Переводит общее время ожидания решения капчи в момент времени по `time.monotonic()`
+    :param timeout: Общее время ожидания в секундах, None - без ограничения
+    :return: Дедлайн или None
+    """
+    if timeout is None:
+        return None
+    if timeout <= 0:
+        raise ValueError(f'Параметр `timeout` должен быть больше 0. Вы передали - {timeout}')
+    return time.monotonic() + timeout
+
+
+def request_timeout(deadline):
+    """
+    Таймаут для одного HTTP запроса, чтобы он не пережил общий дедлайн.
+    Для последней проверки после истечения дедлайна оставляется 1 секунда.
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 1)
+
+
+def timeout_error(result: dict):
+    result.update({'error': True,
+                   'errorBody': RuCaptchaError().errors('LIBRARY_TIMEOUT')
+                   }
+                  )
+    return result
+
+
+def cancelled_error(result: dict):
+    result.update({'error': True,
+                   'errorBody': RuCaptchaError().errors('LIBRARY_CANCELLED')
+                   }
+                  )
+    return result
+
+
+def _copy_attempts(captcha_response: dict, result: dict):
+    """
+    Переносит в result данные о повторных отправках(см. `retry.RetryTransport`): ID задачи, давшей ответ,
+    и кол-во отправок капчи
+    """
+    if 'attempts' in captcha_response:
+        result.update({'taskId': captcha_response['taskId'],
+                       'attempts': captcha_response['attempts'],
+                       }
+                      )
+
+
+def _handle_response(captcha_response: dict, result: dict):
+    """
+    Разбирает ответ res.php
+    :return: True - если ожидание решения закончено(решение или ошибка записаны в result)
+    """
+    # если капча ещё не решена - ожидаем
+    if captcha_response['request'] == 'CAPCHA_NOT_READY':
+        return False
+
+    # при ошибке во время решения
+    elif captcha_response["status"] == 0:
+        result.update({'error': True,
+                       'errorBody': RuCaptchaError().errors(captcha_response["request"])
+                       }
+                      )
+        _copy_attempts(captcha_response, result)
+        return True
+
+    # при решении капчи
+    elif captcha_response["status"] == 1:
+        result.update({
+                       'captchaSolve': captcha_response['request']
+                       }
+                      )
+        _copy_attempts(captcha_response, result)
+        return True
+
+    return False
+
+
+def when_done(answer, callback):
+    """
+    Вызывает `callback(answer)` после окончания ожидания решения капчи
+    :param answer: Ответ `result_poller`: словарь результата или Future(см. `background.BackgroundPoller.submit`)
+    :return: answer или Future, который завершается после `callback`
+    """
+    if isinstance(answer, dict):
+        callback(answer)
+        return answer
+
+    # Future нужен только с фоновым опросом, `concurrent.futures` не загружается при импорте библиотеки
+    from concurrent.futures import Future
+
+    done = Future()
+
+    def on_answer(future):
+        if future.cancelled():
+            done.cancel()
+            return
+        callback(future.result())
+        if done.set_running_or_notify_cancel():
+            done.set_result(future.result())
+
+    done.add_done_callback(lambda future: future.cancelled() and answer.cancel())
+    answer.add_done_callback(on_answer)
+    return done
+
+
+def result_poller(transport, url_response: str, get_payload: dict, sleep_time: int, result: dict,
+                  deadline: float = None, cancel_token: CancelToken = None):
+    """
+    Синхронное ожидание решения капчи: каждые `sleep_time` секунд отправляет запрос на res.php
+    до получения решения, ошибки, истечения дедлайна или отмены через `cancel_token`.
+    Если у транспорта есть `background.BackgroundPoller`, ожидание передаётся ему, а внутри
+    `BackgroundPoller.submit` вместо result сразу возвращается Future с ним.
+    :param transport: Синхронный транспорт(`transport.Transport`)
+    :param url_response: URL для получения ответа
+    :param get_payload: Пайлоад запроса с ID капчи
+    :param sleep_time: Время ожидания между запросами
+    :param result: Словарь результата, в который вносится решение или ошибка
+    :param deadline: Дедлайн по `time.monotonic()`(см. `make_deadline`), None - без ограничения
+    :param cancel_token: Токен отмены ожидания
+    :return: result
+    """
+    from .background import deferred_poller, find_poller
+
+    poller = deferred_poller()
+    if poller is not None:
+        return poller.register(transport, url_response, get_payload, sleep_time, result, deadline = deadline)
+    poller = find_poller(transport)
+    if poller is not None:
+        with tracing.span('rucaptcha.wait', task_id = get_payload.get('id')):
+            return poller.wait(transport, url_response, get_payload, sleep_time, result, deadline = deadline,
+                               cancel_token = cancel_token)
+
+    attempt = 0
+    with tracing.span('rucaptcha.wait', task_id = get_payload.get('id')) as wait_span:
+        try:
+            while True:
+                # ожидаем решения капчи, но не дольше дедлайна
+                wait = sleep_time
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return timeout_error(result)
+                    wait = min(wait, remaining)
+
+                if cancel_token is not None:
+                    if cancel_token.wait(wait):
+                        return cancelled_error(result)
+                else:
+                    time.sleep(wait)
+
+                try:
+                    # отправляем запрос на результат решения капчи, если не решена ожидаем
+                    attempt += 1
+                    tracing.set_attributes(wait_span, polls = attempt)
+                    with tracing.span('rucaptcha.poll', attempt = attempt) as span:
+                        captcha_response = transport.get(url_response, get_payload,
+                                                         timeout = request_timeout(deadline))
+                        tracing.record_answer(span, captcha_response)
+                    if _handle_response(captcha_response, result):
+                        return result
+
+                except Exception as error:
+                    # таймаут запроса по дедлайну, исключение таймаута у каждой HTTP библиотеки своё
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return timeout_error(result)
+                    result.update({'error': True,
+                                   'errorBody': {
+                                       'text': error
+                                       }
+                                   }
+                                  )
+                    return result
+
+                # капча не решена, а время вышло
+                if deadline is not None and time.monotonic() >= deadline:
+                    return timeout_error(result)
+
+        finally:
+            # решение, ошибка, таймаут или отмена - ожидание этой капчи окончено
+            transport.finish(get_payload.get('id'))
+
+
+async def aio_result_poller(transport, url_response: str, get_payload: dict, sleep_time: int, result: dict,
+                            deadline: float = None):
+    """
+    Асинхронное ожидание решения капчи, аналог `result_poller`.
+    Отмена asyncio задачи записывает ошибку отмены в result и пробрасывает `asyncio.CancelledError` дальше.
+    Если у транспорта есть `background.AioBackgroundPoller`, ожидание передаётся ему.
+    :param transport: Асинхронный транспорт(`transport.AioTransport`)
+    :param url_response: URL для получения ответа
+    :param get_payload: Пайлоад запроса с ID капчи
+    :param sleep_time: Время ожидания между запросами
+    :param result: Словарь результата, в который вносится решение или ошибка
+    :param deadline: Дедлайн по `time.monotonic()`(см. `make_deadline`), None - без ограничения
+    :return: result
+    """
+    import asyncio
+    from .background import find_poller
+
+    poller = find_poller(transport)
+    if poller is not None:
+        with tracing.span('rucaptcha.wait', task_id = get_payload.get('id')):
+            try:
+                return await poller.wait(transport, url_response, get_payload, sleep_time, result,
+                                         deadline = deadline)
+            except asyncio.CancelledError:
+                cancelled_error(result)
+                raise
+
+    attempt = 0
+    with tracing.span('rucaptcha.wait', task_id = get_payload.get('id')) as wait_span:
+        try:
+            while True:
+                # ожидаем решения капчи, но не дольше дедлайна
+                wait = sleep_time
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return timeout_error(result)
+                    wait = min(wait, remaining)
+                await asyncio.sleep(wait)
+
+                try:
+                    # отправляем запрос на результат решения капчи, если не решена ожидаем
+                    attempt += 1
+                    tracing.set_attributes(wait_span, polls = attempt)
+                    with tracing.span('rucaptcha.poll', attempt = attempt) as span:
+                        captcha_response = await asyncio.wait_for(transport.get(url_response, get_payload),
+                                                                  timeout = request_timeout(deadline))
+                        tracing.record_answer(span, captcha_response)
+                    if _handle_response(captcha_response, result):
+                        return result
+
+                except asyncio.CancelledError:
+                    raise
+
+                except asyncio.TimeoutError as error:
+                    # таймаут запроса по дедлайну
+                    if deadline is not None:
+                        return timeout_error(result)
+                    result.update({'error': True,
+                                   'errorBody': {
+                                       'text': error
+                                       }
+                                   }
+                                  )
+                    return result
+
+                except Exception as error:
+                    result.update({'error': True,
+                                   'errorBody': {
+                                       'text': error
+                                       }
+                                   }
+                                  )
+                    return result
+
+                # капча не решена, а время вышло
+                if deadline is not None and time.monotonic() >= deadline:
+                    return timeout_error(result)
+
+        except asyncio.CancelledError:
+            cancelled_error(result)
+            raise
+
+        finally:
+            transport.finish(get_payload.get('id'))
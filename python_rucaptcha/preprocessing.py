@@ -0,0 +1,208 @@
+import io
+import time
+import threading
+
+from .validators import MIN_IMAGE_SIZE, MAX_IMAGE_SIZE, validate_image
+
+
+def _import_pil():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError('Для обработки изображений требуется библиотека Pillow: `pip install Pillow`')
+    return Image
+
+
+class ImageState:
+    """
+    Изображение проходящее через `ImagePipeline`.
+    Байты декодируются в `PIL.Image` только если этого требует этап обработки
+    и кодируются обратно один раз - при обращении к `content`.
+    """
+
+    def __init__(self, content: bytes):
+        # исходное изображение, отправляется если обработка его не уменьшила
+        self.original = content
+        self._content = content
+        self._image = None
+        # True - этапы изменили само изображение, а не только его кодирование
+        self.modified = False
+        # формат и параметры сохранения при повторном кодировании
+        self.save_format = None
+        self.save_kwargs = {}
+
+    @property
+    def image(self):
+        if self._image is None:
+            Image = _import_pil()
+            self._image = Image.open(io.BytesIO(self._content))
+            self._image.load()
+            self.save_format = self.save_format or self._image.format or 'PNG'
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+        self._content = None
+        self.modified = True
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            out = io.BytesIO()
+            image = self._image
+            # JPEG не поддерживает прозрачность и палитру
+            if self.save_format.upper() in ('JPEG', 'JPG') and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(out, format = self.save_format, **self.save_kwargs)
+            self._content = out.getvalue()
+        return self._content
+
+    def mark_dirty(self):
+        """
+        Требует повторного кодирования изображения
+        """
+        self._image = self.image
+        self._content = None
+
+
+class Validate:
+    """
+    Проверка размера и формата изображения до отправки на сервер.
+    Порождает `LocalValidationError` с тем же кодом ошибки, который вернул бы сервер.
+    """
+    name = 'validate'
+
+    def __init__(self, min_size: int = MIN_IMAGE_SIZE, max_size: int = MAX_IMAGE_SIZE,
+                 formats: tuple = ('png', 'jpeg', 'gif')):
+        """
+        :param min_size: Минимальный размер изображения в байтах
+        :param max_size: Максимальный размер изображения в байтах
+        :param formats: Допустимые форматы изображения
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.formats = formats
+
+    def __call__(self, state: ImageState):
+        validate_image(state.content, self.min_size, self.max_size, self.formats)
+
+
+class Grayscale:
+    """
+    Перевод изображения в оттенки серого
+    """
+    name = 'grayscale'
+
+    def __call__(self, state: ImageState):
+        state.image = state.image.convert('L')
+
+
+class Crop:
+    """
+    Обрезка изображения
+    """
+    name = 'crop'
+
+    def __init__(self, box: tuple):
+        """
+        :param box: Область изображения (left, upper, right, lower)
+        """
+        self.box = box
+
+    def __call__(self, state: ImageState):
+        state.image = state.image.crop(self.box)
+
+
+class Downscale:
+    """
+    Уменьшение изображения с сохранением пропорций до заданных размеров
+    """
+    name = 'downscale'
+
+    def __init__(self, max_width: int, max_height: int):
+        self.max_width = max_width
+        self.max_height = max_height
+
+    def __call__(self, state: ImageState):
+        image = state.image
+        if image.width > self.max_width or image.height > self.max_height:
+            image = image.copy()
+            image.thumbnail((self.max_width, self.max_height))
+            state.image = image
+
+
+class Recompress:
+    """
+    Повторное сжатие изображения, например PNG -> JPEG или PNG с `optimize=True`
+    """
+    name = 'recompress'
+
+    def __init__(self, image_format: str = 'PNG', **save_kwargs):
+        """
+        :param image_format: Формат для сохранения: `PNG`, `JPEG` или `GIF`
+        :param save_kwargs: Параметры `PIL.Image.save`, например `quality=70` или `optimize=True`
+        """
+        self.image_format = image_format
+        self.save_kwargs = save_kwargs or ({'optimize': True} if image_format.upper() == 'PNG' else {})
+
+    def __call__(self, state: ImageState):
+        original = state.content
+        state.save_format = self.image_format
+        state.save_kwargs = self.save_kwargs
+        state.mark_dirty()
+        # если повторное сжатие не уменьшило изображение - отправляем исходное
+        if len(state.content) >= len(original):
+            state._content = original
+
+
+class ImagePipeline:
+    """
+    Цепочка обработки изображения перед отправкой на сервер.
+    Передаётся в `ImageCaptcha(preprocessing=ImagePipeline(...))`, этапы выполняются по порядку.
+    Этап - любой объект с методом `__call__(state: ImageState)` и атрибутом `name`.
+    Время выполнения каждого этапа и размер изображений до/после собираются в `stats`.
+
+    Пример:
+        ImagePipeline(Downscale(300, 100), Grayscale(), Recompress('PNG'), Validate())
+    """
+
+    def __init__(self, *stages):
+        self.stages = stages
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0,
+                      'bytes_in': 0,
+                      'bytes_out': 0,
+                      # название этапа -> суммарное время выполнения в секундах
+                      'timings': {},
+                      }
+
+    def __call__(self, content: bytes) -> bytes:
+        """
+        Обрабатывает изображение
+        :param content: Исходное изображение
+        :return: Обработанное изображение
+        """
+        timings = []
+        state = ImageState(content)
+        for stage in self.stages:
+            start = time.perf_counter()
+            try:
+                stage(state)
+            finally:
+                timings.append((getattr(stage, 'name', type(stage).__name__), time.perf_counter() - start))
+
+        start = time.perf_counter()
+        result = state.content
+        # изображение только перекодировалось и не стало меньше - отправляем исходное
+        if not state.modified and len(result) >= len(state.original):
+            result = state.original
+        timings.append(('encode', time.perf_counter() - start))
+
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['bytes_in'] += len(content)
+            self.stats['bytes_out'] += len(result)
+            for name, elapsed in timings:
+                self.stats['timings'][name] = self.stats['timings'].get(name, 0) + elapsed
+        return result
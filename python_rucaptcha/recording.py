@@ -0,0 +1,370 @@
+"""
+Запись и воспроизведение профиля трафика сервиса.
+`TrafficRecorder` подключается через транспорт и пишет в JSONL файл(`.gz` - со сжатием) по строке на каждый запрос
+к in.php/res.php: время от начала записи, вид запроса, метод капчи, размер пайлоада, время ответа, статус и код ответа.
+Ключ API, изображения, тексты, параметры капчи, прокси и решения в файл не попадают - записываются только перечисленные
+поля, решение заменяется на `OK`.
+    recorder = TrafficRecorder('traffic.jsonl.gz')
+    ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, transport = recorder.transport())
+
+`TrafficProfile` собирает из записи распределения времени ответов, ошибок отправки, времени решения и итогов решения,
+а `ReplayServer` - локальный сервер(`transport.FakeServer`) с этими распределениями. Капча на нём решается за время,
+а не за кол-во опросов, поэтому можно сравнивать настройки опроса и изменения библиотеки без сети:
+    server = ReplayServer(TrafficProfile.load('traffic.jsonl.gz'), time_scale = 0.01)
+    ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, transport = FakeTransport(server))
+Замер: `python CaptchaTester/replay_benchmark.py traffic.jsonl.gz`.
+"""
+import gzip
+import json
+import time
+import random
+import threading
+import collections
+
+from .tracing import payload_size
+from .transport import CHUNK_SIZE, Transport, AioTransport, FakeServer, make_transport, make_aio_transport
+
+# поля пайлоада, которые записываются в файл
+RECORDED_FIELDS = ('method', 'action')
+
+
+def _open(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding = 'utf-8')
+    return open(path, mode, encoding = 'utf-8')
+
+
+def redact_answer(answer: str) -> str:
+    """
+    Код ответа без решения: `CAPCHA_NOT_READY` и коды ошибок сохраняются, решение заменяется на `OK`
+    """
+    if answer == 'CAPCHA_NOT_READY' or answer.startswith(('ERROR', 'IP_BANNED', 'MAX_USER_TURN', 'LIBRARY')):
+        return answer
+    return 'OK'
+
+
+class TrafficRecorder:
+    """
+    Запись запросов к сервису в JSONL файл, один объект используется транспортами из разных потоков и asyncio задач
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Файл записи, `.gz` - со сжатием. Существующий файл перезаписывается.
+        """
+        self.path = path
+        self._file = _open(path, 'w')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.records = 0
+
+    def record(self, op: str, started: float, payload: dict = None, files: dict = None, answer: dict = None,
+               error: BaseException = None, captcha_id: str = None, ids = None):
+        """
+        Записывает один запрос
+        :param op: Вид запроса: `submit`, `get`, `get_many`, `control`
+        :param started: Время начала запроса по `time.monotonic()`
+        :param answer: Ответ сервиса, None - запрос завершился исключением `error`
+        """
+        now = time.monotonic()
+        line = {'t': round(started - self._started, 4), 'op': op, 'latency': round(now - started, 4)}
+        for field in RECORDED_FIELDS:
+            if payload and field in payload:
+                line[field] = payload[field]
+        if op == 'submit':
+            line['bytes'] = payload_size(payload, files)
+        if captcha_id is not None:
+            line['id'] = captcha_id
+        if answer is not None:
+            line['status'] = answer.get('status')
+            request = str(answer.get('request'))
+            if op == 'submit':
+                if answer.get('status') == 1:
+                    line['id'] = request
+                else:
+                    line['answer'] = request
+            elif op == 'get_many':
+                line['ids'] = list(ids)
+                line['answer'] = '|'.join(redact_answer(part) for part in request.split('|'))
+            elif op == 'get':
+                line['answer'] = redact_answer(request)
+            elif answer.get('status') != 1:
+                line['answer'] = request
+        if error is not None:
+            line['error'] = type(error).__name__
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(line, ensure_ascii = False, separators = (',', ':')) + '\n')
+                self.records += 1
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def transport(self, transport = None) -> 'RecordingTransport':
+        """
+        :param transport: Синхронный транспорт или название бэкенда(см. `transport.make_transport`)
+        """
+        return RecordingTransport(self, make_transport(transport))
+
+    def aio_transport(self, transport = None) -> 'AioRecordingTransport':
+        """
+        :param transport: Асинхронный транспорт или название бэкенда(см. `transport.make_aio_transport`)
+        """
+        return AioRecordingTransport(self, make_aio_transport(transport))
+
+
+class RecordingTransport(Transport):
+    """
+    Синхронный транспорт, записывающий запросы к сервису в `TrafficRecorder`
+    """
+
+    def __init__(self, recorder: TrafficRecorder, transport: Transport):
+        self.recorder = recorder
+        self.transport = transport
+        self.name = transport.name
+
+    def _call(self, op: str, method, *args, payload: dict = None, captcha_id: str = None, ids = None,
+              **kwargs) -> dict:
+        started = time.monotonic()
+        files = kwargs.get('files')
+        try:
+            answer = method(*args, **kwargs)
+        except Exception as error:
+            self.recorder.record(op, started, payload, files, error = error, captcha_id = captcha_id, ids = ids)
+            raise
+        self.recorder.record(op, started, payload, files, answer = answer, captcha_id = captcha_id, ids = ids)
+        return answer
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        return self._call('submit', self.transport.submit, url_request, payload, files = files, timeout = timeout,
+                          payload = payload)
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self._call('get', self.transport.get, url_response, payload, timeout = timeout,
+                          captcha_id = payload.get('id'))
+
+    def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        ids = list(ids)
+        return self._call('get_many', self.transport.get_many, url_response, rucaptcha_key, ids, timeout = timeout,
+                          ids = ids)
+
+    def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self._call('control', self.transport.control, url_response, payload, timeout = timeout,
+                          payload = payload)
+
+    def finish(self, captcha_id: str):
+        self.transport.finish(captcha_id)
+
+    def close(self):
+        self.transport.close()
+
+
+class AioRecordingTransport(AioTransport):
+    """
+    Асинхронный транспорт, записывающий запросы к сервису, аналог `RecordingTransport`
+    """
+
+    def __init__(self, recorder: TrafficRecorder, transport: AioTransport):
+        self.recorder = recorder
+        self.transport = transport
+        self.name = transport.name
+
+    async def _call(self, op: str, method, *args, payload: dict = None, captcha_id: str = None, ids = None,
+                    **kwargs) -> dict:
+        started = time.monotonic()
+        files = kwargs.get('files')
+        try:
+            answer = await method(*args, **kwargs)
+        except Exception as error:
+            self.recorder.record(op, started, payload, files, error = error, captcha_id = captcha_id, ids = ids)
+            raise
+        self.recorder.record(op, started, payload, files, answer = answer, captcha_id = captcha_id, ids = ids)
+        return answer
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self._call('submit', self.transport.submit, url_request, payload, files = files,
+                                timeout = timeout, payload = payload)
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self._call('get', self.transport.get, url_response, payload, timeout = timeout,
+                                captcha_id = payload.get('id'))
+
+    async def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        ids = list(ids)
+        return await self._call('get_many', self.transport.get_many, url_response, rucaptcha_key, ids,
+                                timeout = timeout, ids = ids)
+
+    async def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self._call('control', self.transport.control, url_response, payload, timeout = timeout,
+                                payload = payload)
+
+    def finish(self, captcha_id: str):
+        self.transport.finish(captcha_id)
+
+    async def close(self):
+        await self.transport.close()
+
+
+class TrafficProfile:
+    """
+    Распределения, собранные из записи трафика
+    """
+
+    def __init__(self):
+        # вид запроса -> времена ответов
+        self.latencies = collections.defaultdict(list)
+        # вид запроса -> [кол-во запросов, кол-во исключений(сетевых ошибок)]
+        self.requests = collections.defaultdict(lambda: [0, 0])
+        # ответы in.php: None - капча принята, иначе код ошибки
+        self.submit_answers = []
+        # решённые задачи: (время от отправки до окончательного ответа, итог - `OK` или код ошибки)
+        self.tasks = []
+        # задачи без окончательного ответа(таймаут или отмена ожидания)
+        self.unfinished = 0
+
+    @classmethod
+    def load(cls, path: str) -> 'TrafficProfile':
+        """
+        Загружает профиль из файла `TrafficRecorder`
+        """
+        with _open(path, 'r') as file:
+            return cls.from_records(json.loads(line) for line in file if line.strip())
+
+    @classmethod
+    def from_records(cls, records) -> 'TrafficProfile':
+        profile = cls()
+        # ID задачи -> время получения ответа in.php
+        submitted = {}
+        for record in records:
+            op = record['op']
+            counter = profile.requests[op]
+            counter[0] += 1
+            if 'error' in record:
+                counter[1] += 1
+                continue
+            profile.latencies[op].append(record['latency'])
+            answered = record['t'] + record['latency']
+            if op == 'submit':
+                if record.get('status') == 1:
+                    profile.submit_answers.append(None)
+                    submitted[record['id']] = answered
+                else:
+                    profile.submit_answers.append(record.get('answer'))
+            elif op in ('get', 'get_many'):
+                ids = record['ids'] if op == 'get_many' else [record.get('id')]
+                answers = record.get('answer', '').split('|') if op == 'get_many' else [record.get('answer')]
+                for captcha_id, answer in zip(ids, answers):
+                    if answer != 'CAPCHA_NOT_READY' and captcha_id in submitted:
+                        profile.tasks.append((answered - submitted.pop(captcha_id), answer))
+        profile.unfinished = len(submitted)
+        return profile
+
+    def error_rate(self, op: str) -> float:
+        requests, errors = self.requests.get(op, (0, 0))
+        return errors / requests if requests else 0.0
+
+    def summary(self) -> dict:
+        """
+        :return: Кол-во запросов и доля сетевых ошибок по видам, медианы времени ответа, доля ошибок in.php,
+                 кол-во и медиана времени решения задач, итоги решения
+        """
+        def median(values):
+            return sorted(values)[len(values) // 2] if values else None
+
+        outcomes = collections.Counter(answer for _, answer in self.tasks)
+        return {'requests': {op: counter[0] for op, counter in self.requests.items()},
+                'network_error_rate': {op: self.error_rate(op) for op in self.requests},
+                'latency_p50': {op: median(values) for op, values in self.latencies.items()},
+                'submit_error_rate': sum(answer is not None for answer in self.submit_answers) /
+                len(self.submit_answers) if self.submit_answers else 0.0,
+                'tasks': len(self.tasks),
+                'unfinished': self.unfinished,
+                'solve_time_p50': median([solve_time for solve_time, _ in self.tasks]),
+                'outcomes': dict(outcomes),
+                }
+
+
+class ReplayServer(FakeServer):
+    """
+    Локальный сервер с распределениями из записи трафика: время ответов, сетевые ошибки, ошибки in.php,
+    время решения и итоги решения выбираются случайно из записанных значений.
+    """
+
+    def __init__(self, profile: TrafficProfile, time_scale: float = 1.0, seed: int = None, **server_kwargs):
+        """
+        :param profile: Профиль трафика
+        :param time_scale: Множитель всех времён(0.01 - воспроизведение в 100 раз быстрее)
+        :param seed: Начальное значение генератора случайных чисел для повторяемых замеров
+        :param server_kwargs: Параметры `FakeServer`(`solution`, `balance` и т.д.)
+        """
+        super().__init__(**server_kwargs)
+        if not profile.tasks:
+            raise ValueError('В профиле нет задач с окончательным ответом')
+        self.profile = profile
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+
+    def _op(self, url: str, data: dict) -> str:
+        if url.endswith('in.php'):
+            return 'submit'
+        if data.get('action') == 'get':
+            return 'get_many' if data.get('ids') else 'get'
+        return 'control'
+
+    def delay(self, url: str, data: dict) -> float:
+        latencies = self.profile.latencies.get(self._op(url, data))
+        return self.random.choice(latencies) * self.time_scale if latencies else 0
+
+    def handle(self, url: str, data: dict) -> dict:
+        op = self._op(url, data)
+        if self.random.random() < self.profile.error_rate(op):
+            raise ConnectionError(f'ReplayServer: записанная сетевая ошибка запроса {op}')
+        return super().handle(url, data)
+
+    def _submit_error(self):
+        if self.submit_error:
+            return self.submit_error
+        if self.profile.submit_answers:
+            return self.random.choice(self.profile.submit_answers)
+        return None
+
+    def _new_task(self):
+        # капча получает готовое время решения и итог
+        solve_time, answer = self.random.choice(self.profile.tasks)
+        return time.monotonic() + solve_time * self.time_scale, answer
+
+    def _answer(self, captcha_id: str) -> str:
+        task = self._polls.get(captcha_id)
+        if task is None:
+            return 'ERROR_WRONG_CAPTCHA_ID'
+        ready_at, answer = task
+        if time.monotonic() < ready_at:
+            return 'CAPCHA_NOT_READY'
+        self._polls.pop(captcha_id)
+        return self.solution if answer == 'OK' else answer
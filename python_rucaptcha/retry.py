@@ -0,0 +1,371 @@
+"""
+Повторная отправка капчи по классам ошибок.
+`RetryPolicy` задаёт для каждого класса ошибки максимальное кол-во повторов, задержки между ними растут
+экспоненциально со случайным разбросом(jitter). Классы ошибок:
+    коды ошибок сервиса(`ERROR_CAPTCHA_UNSOLVABLE`, `ERROR_NO_SLOT_AVAILABLE` и т.д.) - капча отправляется заново;
+    `network` - сетевые ошибки и таймауты запросов, повторяется сам запрос. Отправка капчи на in.php повторяется
+                только при ошибках установки соединения: после таймаута чтения капча могла быть принята сервисом,
+                и повтор оплачивался бы дважды.
+
+Повторы выполняет транспорт, поэтому политика подключается к любому классу решения капчи:
+    policy = RetryPolicy({'ERROR_CAPTCHA_UNSOLVABLE': 2, 'network': 3})
+    ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, transport = policy.transport())
+Повторная отправка использует уже подготовленный пайлоад(изображение не скачивается и не кодируется заново),
+ожидание продолжается в том же `captcha_handler`. В результат добавляются `attempts` - кол-во отправок капчи
+и `taskId` задачи, давшей ответ.
+"""
+import io
+import os
+import time
+import random
+import socket
+import threading
+
+from .transport import CHUNK_SIZE, Transport, AioTransport, make_transport, make_aio_transport
+
+# класс ошибки -> максимальное кол-во повторов
+RETRY_RULES = {'ERROR_CAPTCHA_UNSOLVABLE': 2,
+               'ERROR_NO_SLOT_AVAILABLE': 5,
+               'network': 3,
+               }
+
+# ошибки установки соединения HTTP библиотек(`requests`/`urllib3`, `httpx`/`httpcore`, `aiohttp`):
+# запрос не был отправлен
+CONNECT_ERRORS = frozenset(('ConnectTimeout', 'ConnectError', 'ConnectTimeoutError', 'NewConnectionError',
+                            'ClientConnectorError', 'ConnectionTimeoutError'))
+
+
+def is_network_error(error: Exception) -> bool:
+    """
+    Сетевая ошибка или таймаут запроса.
+    Ошибки `requests` наследуются от `IOError`, ошибки `aiohttp` и `httpx` определяются по модулю,
+    чтобы не импортировать эти библиотеки.
+    """
+    if isinstance(error, (OSError, TimeoutError)):
+        return True
+    return type(error).__module__.split('.')[0] in ('aiohttp', 'httpx', 'httpcore') or \
+        type(error).__name__ == 'TimeoutError'
+
+
+def is_connect_error(error: BaseException) -> bool:
+    """
+    Ошибка установки соединения: сервер не получил запрос, его можно повторить без риска двойной отправки.
+    Ошибки HTTP библиотек определяются по имени класса, чтобы не импортировать эти библиотеки.
+    """
+    if isinstance(error, (ConnectionRefusedError, socket.gaierror)):
+        return True
+    if any(cls.__name__ in CONNECT_ERRORS for cls in type(error).__mro__):
+        return True
+    # `requests.ConnectionError` оборачивает ошибку `urllib3`: MaxRetryError(reason = NewConnectionError(...))
+    cause = error.args[0] if error.args else None
+    reason = getattr(cause, 'reason', None)
+    if isinstance(reason, BaseException) and reason is not error:
+        return is_connect_error(reason)
+    return False
+
+
+class RetryPolicy:
+    """
+    Политика повторов: лимиты по классам ошибок, экспоненциальная задержка с разбросом и статистика
+    """
+
+    def __init__(self, rules: dict = None, backoff: float = 1, max_backoff: float = 30, jitter: float = 0.5):
+        """
+        :param rules: Класс ошибки -> максимальное кол-во повторов, по умолчанию `RETRY_RULES`
+        :param backoff: Задержка перед первым повтором в секундах, каждый следующий повтор класса - в 2 раза дольше
+        :param max_backoff: Максимальная задержка в секундах
+        :param jitter: Случайный разброс задержки, доля от неё(0.5 - от 50% до 150%)
+        """
+        self.rules = dict(RETRY_RULES if rules is None else rules)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._stats = {'tasks': 0, 'recovered': 0, 'retries': {}, 'gave_up': {}}
+
+    def next_delay(self, task: '_RetryTask', error_class: str, deadline: float = None):
+        """
+        Проверяет лимит повторов класса ошибки и учитывает повтор
+        :return: Задержка перед повтором в секундах, None - повторять нельзя
+        """
+        retries = task.retries.get(error_class, 0)
+        delay = min(self.backoff * 2 ** retries, self.max_backoff) * random.uniform(1 - self.jitter, 1 + self.jitter)
+        with self._lock:
+            stats = self._stats
+            if retries >= self.rules.get(error_class, 0) or \
+                    (deadline is not None and time.monotonic() + delay >= deadline):
+                if error_class in self.rules:
+                    stats['gave_up'][error_class] = stats['gave_up'].get(error_class, 0) + 1
+                return None
+            stats['retries'][error_class] = stats['retries'].get(error_class, 0) + 1
+        task.retries[error_class] = retries + 1
+        return delay
+
+    def record(self, task: '_RetryTask'):
+        """
+        Учитывает капчу после окончания ожидания её решения
+        """
+        with self._lock:
+            self._stats['tasks'] += 1
+            self._stats['recovered'] += task.solved and bool(task.retries)
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во капч, капч решённых после повторов, повторов и отказов от повтора по классам ошибок
+        """
+        with self._lock:
+            return {'tasks': self._stats['tasks'],
+                    'recovered': self._stats['recovered'],
+                    'retries': dict(self._stats['retries']),
+                    'gave_up': dict(self._stats['gave_up']),
+                    }
+
+    def transport(self, transport = None) -> 'RetryTransport':
+        """
+        Синхронный транспорт с повторами
+        :param transport: Транспорт или название бэкенда(см. `transport.make_transport`)
+        """
+        return RetryTransport(self, make_transport(transport))
+
+    def aio_transport(self, transport = None) -> 'AioRetryTransport':
+        """
+        Асинхронный транспорт с повторами
+        :param transport: Транспорт или название бэкенда(см. `transport.make_aio_transport`)
+        """
+        return AioRetryTransport(self, make_aio_transport(transport))
+
+
+class _RetryTask:
+    """
+    Отправленная капча: всё необходимое для повторной отправки
+    """
+    __slots__ = ('url', 'payload', 'files', 'current', 'attempts', 'retries', 'solved')
+
+    def __init__(self, url: str, payload: dict, files: dict):
+        self.url = url
+        self.payload = payload
+        self.files = files
+        # ID последней отправленной задачи
+        self.current = None
+        # кол-во отправок на in.php
+        self.attempts = 0
+        # класс ошибки -> кол-во повторов
+        self.retries = {}
+        self.solved = False
+
+    def rewind(self):
+        for value in (self.files or {}).values():
+            value.seek(0)
+
+
+def _snapshot_files(files: dict):
+    """
+    Копирует содержимое файлов в память, чтобы капчу можно было отправить повторно после закрытия файла
+    """
+    if not files:
+        return files
+    snapshot = {}
+    for key, value in files.items():
+        if not hasattr(value, 'read'):
+            value = io.BytesIO(value)
+        else:
+            content = io.BytesIO(value.read())
+            content.name = os.path.basename(getattr(value, 'name', key))
+            value = content
+        snapshot[key] = value
+    return snapshot
+
+
+def _deadline(timeout: float = None):
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+def _remaining(deadline: float = None):
+    return max(deadline - time.monotonic(), 1) if deadline is not None else None
+
+
+class RetryTransport(Transport):
+    """
+    Синхронный транспорт с повторами по `RetryPolicy`.
+    Для вызывающего кода повторная отправка незаметна: запросы по исходному ID капчи перенаправляются
+    на последнюю отправленную задачу.
+    """
+
+    def __init__(self, policy: RetryPolicy, transport: Transport):
+        self.policy = policy
+        self.transport = transport
+        self.name = transport.name
+        # исходный ID капчи -> _RetryTask
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _call(self, task: _RetryTask, deadline: float, retryable, method, *args, **kwargs):
+        """
+        Выполняет запрос, повторяя его при сетевых ошибках
+        :param retryable: Проверка ошибки: `is_network_error` или `is_connect_error` для отправки капчи
+        """
+        while True:
+            try:
+                return method(*args, timeout = _remaining(deadline), **kwargs)
+            except Exception as error:
+                delay = self.policy.next_delay(task, 'network', deadline) if retryable(error) else None
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def _submit(self, task: _RetryTask, deadline: float) -> dict:
+        while True:
+            task.rewind()
+            task.attempts += 1
+            answer = self._call(task, deadline, is_connect_error, self.transport.submit, task.url, task.payload,
+                                files = task.files)
+            if answer['status'] == 1:
+                task.current = answer['request']
+                return answer
+            delay = self.policy.next_delay(task, answer['request'], deadline)
+            if delay is None:
+                return answer
+            time.sleep(delay)
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        task = _RetryTask(url_request, payload, _snapshot_files(files))
+        answer = self._submit(task, _deadline(timeout))
+        if answer['status'] == 1:
+            with self._lock:
+                self._tasks[answer['request']] = task
+        else:
+            self.policy.record(task)
+        return answer
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        deadline = _deadline(timeout)
+        with self._lock:
+            task = self._tasks.get(payload.get('id'))
+        if task is None:
+            return self._call(_RetryTask(None, None, None), deadline, is_network_error, self.transport.get,
+                              url_response, payload)
+
+        if task.current != payload['id']:
+            payload = dict(payload, id = task.current)
+        answer = self._call(task, deadline, is_network_error, self.transport.get, url_response, payload)
+        if answer['request'] == 'CAPCHA_NOT_READY':
+            return answer
+        if answer['status'] != 1:
+            delay = self.policy.next_delay(task, answer['request'], deadline)
+            if delay is not None:
+                time.sleep(delay)
+                resubmitted = self._submit(task, deadline)
+                if resubmitted['status'] == 1:
+                    return {'status': 0, 'request': 'CAPCHA_NOT_READY'}
+                answer = resubmitted
+        task.solved = answer['status'] == 1
+        return dict(answer, taskId = task.current, attempts = task.attempts)
+
+    def finish(self, captcha_id: str):
+        with self._lock:
+            task = self._tasks.pop(captcha_id, None)
+        if task is None:
+            return self.transport.finish(captcha_id)
+        self.policy.record(task)
+        self.transport.finish(task.current)
+
+    def close(self):
+        self.transport.close()
+
+
+class AioRetryTransport(AioTransport):
+    """
+    Асинхронный транспорт с повторами по `RetryPolicy`, аналог `RetryTransport`
+    """
+
+    def __init__(self, policy: RetryPolicy, transport: AioTransport):
+        self.policy = policy
+        self.transport = transport
+        self.name = transport.name
+        self._tasks = {}
+
+    async def _call(self, task: _RetryTask, deadline: float, retryable, method, *args, **kwargs):
+        import asyncio
+
+        while True:
+            try:
+                return await method(*args, timeout = _remaining(deadline), **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                delay = self.policy.next_delay(task, 'network', deadline) if retryable(error) else None
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _submit(self, task: _RetryTask, deadline: float) -> dict:
+        import asyncio
+
+        while True:
+            task.rewind()
+            task.attempts += 1
+            answer = await self._call(task, deadline, is_connect_error, self.transport.submit, task.url,
+                                      task.payload, files = task.files)
+            if answer['status'] == 1:
+                task.current = answer['request']
+                return answer
+            delay = self.policy.next_delay(task, answer['request'], deadline)
+            if delay is None:
+                return answer
+            await asyncio.sleep(delay)
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        task = _RetryTask(url_request, payload, _snapshot_files(files))
+        answer = await self._submit(task, _deadline(timeout))
+        if answer['status'] == 1:
+            self._tasks[answer['request']] = task
+        else:
+            self.policy.record(task)
+        return answer
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        import asyncio
+
+        deadline = _deadline(timeout)
+        task = self._tasks.get(payload.get('id'))
+        if task is None:
+            return await self._call(_RetryTask(None, None, None), deadline, is_network_error, self.transport.get,
+                                    url_response, payload)
+
+        if task.current != payload['id']:
+            payload = dict(payload, id = task.current)
+        answer = await self._call(task, deadline, is_network_error, self.transport.get, url_response, payload)
+        if answer['request'] == 'CAPCHA_NOT_READY':
+            return answer
+        if answer['status'] != 1:
+            delay = self.policy.next_delay(task, answer['request'], deadline)
+            if delay is not None:
+                await asyncio.sleep(delay)
+                resubmitted = await self._submit(task, deadline)
+                if resubmitted['status'] == 1:
+                    return {'status': 0, 'request': 'CAPCHA_NOT_READY'}
+                answer = resubmitted
+        task.solved = answer['status'] == 1
+        return dict(answer, taskId = task.current, attempts = task.attempts)
+
+    def finish(self, captcha_id: str):
+        task = self._tasks.pop(captcha_id, None)
+        if task is None:
+            return self.transport.finish(captcha_id)
+        self.policy.record(task)
+        self.transport.finish(task.current)
+
+    async def close(self):
+        await self.transport.close()
@@ -0,0 +1,358 @@
+"""
+Приоритетная очередь отправки капчи.
+`SubmitScheduler` ограничивает кол-во одновременно решаемых капч и, когда все места заняты, выпускает ожидающие
+отправки по приоритету: взвешенная справедливая очередь(WFQ) между классами приоритета и старение - задача,
+прождавшая дольше `aging` секунд, отправляется первой независимо от класса.
+
+Планировщик подключается к классам решения капчи через транспорт:
+    scheduler = SubmitScheduler(max_in_flight = 50)
+    ReCaptchaV2.ReCaptchaV2(rucaptcha_key = KEY, transport = scheduler.transport('high'))
+    TextCaptcha.TextCaptcha(rucaptcha_key = KEY, transport = scheduler.transport('low'))
+Место занимается при отправке на in.php и освобождается после получения решения, ошибки или окончания ожидания.
+Один планировщик работает одновременно с потоками и asyncio задачами.
+"""
+import time
+import threading
+import collections
+
+from .transport import CHUNK_SIZE, Transport, AioTransport, make_transport, make_aio_transport
+
+# класс приоритета -> вес в справедливой очереди
+PRIORITY_CLASSES = {'high': 8,
+                    'normal': 4,
+                    'low': 1,
+                    }
+
+
+class _Waiter:
+    """
+    Задача, ожидающая места для отправки
+    """
+    __slots__ = ('priority', 'tag', 'enqueued', 'granted', 'event', 'loop', 'future')
+
+    def __init__(self, priority: str, tag: float):
+        self.priority = priority
+        self.tag = tag
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.event = None
+        self.loop = None
+        self.future = None
+
+
+class SubmitScheduler:
+    """
+    Планировщик отправки капч с классами приоритета
+    """
+
+    def __init__(self, max_in_flight: int = 100, classes: dict = None, aging: float = 60, targets: dict = None):
+        """
+        :param max_in_flight: Максимальное кол-во одновременно решаемых капч
+        :param classes: Класс приоритета -> вес, по умолчанию `PRIORITY_CLASSES`
+        :param aging: Время ожидания в секундах, после которого задача отправляется вне очереди
+        :param targets: Класс приоритета -> целевое время ожидания в очереди в секундах, превышения считаются в статистике
+        """
+        if max_in_flight < 1:
+            raise ValueError(f'Параметр `max_in_flight` должен быть больше 0. Вы передали - {max_in_flight}')
+        self.max_in_flight = max_in_flight
+        self.classes = dict(classes or PRIORITY_CLASSES)
+        self.aging = aging
+        self.targets = dict(targets or {})
+        self.in_flight = 0
+        # виртуальное время справедливой очереди: метка последней выпущенной задачи и последняя метка каждого класса
+        self._vtime = 0.0
+        self._last_tag = dict.fromkeys(self.classes, 0.0)
+        self._queues = {priority: collections.deque() for priority in self.classes}
+        self._lock = threading.Lock()
+        self._stats = {priority: {'submitted': 0,
+                                  'waiting': 0,
+                                  'in_flight': 0,
+                                  'aged': 0,
+                                  'target_misses': 0,
+                                  'queue_time_total': 0.0,
+                                  'queue_time_max': 0.0,
+                                  # последние времена ожидания для перцентилей
+                                  'queue_times': collections.deque(maxlen = 1000),
+                                  }
+                       for priority in self.classes}
+
+    def _check_priority(self, priority: str):
+        if priority not in self.classes:
+            raise ValueError(f'Неизвестный класс приоритета `{priority}`. Возможные варианты: {", ".join(self.classes)}')
+
+    def _enqueue(self, priority: str) -> _Waiter:
+        """
+        Занимает место сразу, если оно есть и очередь пуста, иначе ставит задачу в очередь.
+        Вызывается под блокировкой.
+        """
+        self._check_priority(priority)
+        tag = max(self._vtime, self._last_tag[priority]) + 1 / self.classes[priority]
+        self._last_tag[priority] = tag
+        waiter = _Waiter(priority, tag)
+        if self.in_flight < self.max_in_flight and not any(self._queues.values()):
+            self._vtime = tag
+            self._grant(waiter, aged = False)
+        else:
+            self._queues[priority].append(waiter)
+            self._stats[priority]['waiting'] += 1
+        return waiter
+
+    def _grant(self, waiter: _Waiter, aged: bool):
+        waited = time.monotonic() - waiter.enqueued
+        stats = self._stats[waiter.priority]
+        self.in_flight += 1
+        waiter.granted = True
+        stats['submitted'] += 1
+        stats['in_flight'] += 1
+        stats['aged'] += aged
+        stats['queue_time_total'] += waited
+        stats['queue_time_max'] = max(stats['queue_time_max'], waited)
+        stats['queue_times'].append(waited)
+        target = self.targets.get(waiter.priority)
+        if target is not None and waited > target:
+            stats['target_misses'] += 1
+
+    def _next(self):
+        """
+        Выбирает следующую задачу: самую старую из прождавших дольше `aging`, иначе с наименьшей меткой WFQ
+        """
+        heads = [queue[0] for queue in self._queues.values() if queue]
+        if not heads:
+            return None, False
+        oldest = min(heads, key = lambda waiter: waiter.enqueued)
+        if time.monotonic() - oldest.enqueued > self.aging:
+            return oldest, True
+        return min(heads, key = lambda waiter: waiter.tag), False
+
+    def _dispatch(self):
+        """
+        Выпускает ожидающие задачи на освободившиеся места. Вызывается под блокировкой.
+        """
+        while self.in_flight < self.max_in_flight:
+            waiter, aged = self._next()
+            if waiter is None:
+                return
+            self._queues[waiter.priority].popleft()
+            self._stats[waiter.priority]['waiting'] -= 1
+            self._vtime = max(self._vtime, waiter.tag)
+            self._grant(waiter, aged)
+            if waiter.event is not None:
+                waiter.event.set()
+            else:
+                waiter.loop.call_soon_threadsafe(self._resolve, waiter)
+
+    def _resolve(self, waiter: _Waiter):
+        # asyncio задача могла быть отменена, пока место передавалось в её event loop
+        if waiter.future.done():
+            self.release(waiter.priority)
+        else:
+            waiter.future.set_result(None)
+
+    def _withdraw(self, waiter: _Waiter):
+        """
+        Убирает задачу из очереди после таймаута/отмены. Вызывается под блокировкой.
+        :return: True - если задача уже получила место
+        """
+        if waiter.granted:
+            return True
+        self._queues[waiter.priority].remove(waiter)
+        self._stats[waiter.priority]['waiting'] -= 1
+        return False
+
+    def acquire(self, priority: str = 'normal', timeout: float = None):
+        """
+        Синхронно ожидает места для отправки капчи
+        :param priority: Класс приоритета
+        :param timeout: Максимальное время ожидания в секундах
+        """
+        with self._lock:
+            waiter = self._enqueue(priority)
+            if waiter.granted:
+                return
+            waiter.event = threading.Event()
+        if waiter.event.wait(timeout):
+            return
+        with self._lock:
+            if self._withdraw(waiter):
+                return
+        raise TimeoutError(f'Нет места для отправки капчи в очереди `{priority}` за {timeout} сек.')
+
+    async def aio_acquire(self, priority: str = 'normal'):
+        """
+        Асинхронно ожидает места для отправки капчи
+        :param priority: Класс приоритета
+        """
+        import asyncio
+
+        with self._lock:
+            waiter = self._enqueue(priority)
+            if waiter.granted:
+                return
+            waiter.loop = asyncio.get_event_loop()
+            waiter.future = waiter.loop.create_future()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = self._withdraw(waiter)
+            # если место выдано до отмены - освобождаем его, если во время - его освободит `_resolve`
+            if granted and not waiter.future.cancelled():
+                self.release(waiter.priority)
+            raise
+
+    def release(self, priority: str = 'normal'):
+        """
+        Освобождает место после окончания решения капчи
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._stats[priority]['in_flight'] -= 1
+            self._dispatch()
+
+    def stats(self) -> dict:
+        """
+        :return: Статистика по классам приоритета: кол-во отправленных, ожидающих и решаемых капч, отправленных
+                 по старению, превышений целевого времени, среднее, максимальное и 95-й перцентиль времени в очереди
+        """
+        with self._lock:
+            report = {}
+            for priority, stats in self._stats.items():
+                queue_times = sorted(stats['queue_times'])
+                report[priority] = {key: value for key, value in stats.items() if key != 'queue_times'}
+                report[priority].update({
+                    'queue_time_avg': stats['queue_time_total'] / stats['submitted'] if stats['submitted'] else 0.0,
+                    'queue_time_p95': queue_times[int(len(queue_times) * 0.95)] if queue_times else 0.0,
+                    })
+            return report
+
+    def transport(self, priority: str = 'normal', transport = None) -> 'ScheduledTransport':
+        """
+        Синхронный транспорт, отправляющий капчи через планировщик
+        :param priority: Класс приоритета капч этого транспорта
+        :param transport: Транспорт или название бэкенда(см. `transport.make_transport`)
+        """
+        self._check_priority(priority)
+        return ScheduledTransport(self, priority, make_transport(transport))
+
+    def aio_transport(self, priority: str = 'normal', transport = None) -> 'AioScheduledTransport':
+        """
+        Асинхронный транспорт, отправляющий капчи через планировщик
+        :param priority: Класс приоритета капч этого транспорта
+        :param transport: Транспорт или название бэкенда(см. `transport.make_aio_transport`)
+        """
+        self._check_priority(priority)
+        return AioScheduledTransport(self, priority, make_aio_transport(transport))
+
+
+def _finished(answer: dict) -> bool:
+    """
+    True - ответ res.php окончательный(решение или ошибка)
+    """
+    return answer.get('request') != 'CAPCHA_NOT_READY'
+
+
+class ScheduledTransport(Transport):
+    """
+    Синхронный транспорт с местами планировщика: `submit` ждёт места в очереди своего приоритета,
+    место освобождается окончательным ответом res.php или вызовом `finish`.
+    """
+
+    def __init__(self, scheduler: SubmitScheduler, priority: str, transport: Transport):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.transport = transport
+        self.name = transport.name
+        # ID решаемых капч, занимающих место
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def _release(self, captcha_id):
+        with self._lock:
+            if captcha_id not in self._tasks:
+                return
+            self._tasks.discard(captcha_id)
+        self.scheduler.release(self.priority)
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        start = time.monotonic()
+        self.scheduler.acquire(self.priority, timeout)
+        if timeout is not None:
+            timeout = max(timeout - (time.monotonic() - start), 1)
+        try:
+            answer = self.transport.submit(url_request, payload, files = files, timeout = timeout)
+        except BaseException:
+            self.scheduler.release(self.priority)
+            raise
+        if answer.get('status') != 1:
+            self.scheduler.release(self.priority)
+        else:
+            with self._lock:
+                self._tasks.add(answer['request'])
+        return answer
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        answer = self.transport.get(url_response, payload, timeout = timeout)
+        if _finished(answer):
+            self._release(payload.get('id'))
+        return answer
+
+    def finish(self, captcha_id: str):
+        self._release(captcha_id)
+
+    def close(self):
+        self.transport.close()
+
+
+class AioScheduledTransport(AioTransport):
+    """
+    Асинхронный транспорт с местами планировщика, аналог `ScheduledTransport`
+    """
+
+    def __init__(self, scheduler: SubmitScheduler, priority: str, transport: AioTransport):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.transport = transport
+        self.name = transport.name
+        self._tasks = set()
+
+    def _release(self, captcha_id):
+        if captcha_id in self._tasks:
+            self._tasks.discard(captcha_id)
+            self.scheduler.release(self.priority)
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        await self.scheduler.aio_acquire(self.priority)
+        try:
+            answer = await self.transport.submit(url_request, payload, files = files, timeout = timeout)
+        except BaseException:
+            self.scheduler.release(self.priority)
+            raise
+        if answer.get('status') != 1:
+            self.scheduler.release(self.priority)
+        else:
+            self._tasks.add(answer['request'])
+        return answer
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        answer = await self.transport.get(url_response, payload, timeout = timeout)
+        if _finished(answer):
+            self._release(payload.get('id'))
+        return answer
+
+    def finish(self, captcha_id: str):
+        self._release(captcha_id)
+
+    async def close(self):
+        await self.transport.close()
@@ -0,0 +1,409 @@
+"""
+Объединение одинаковых одновременно решаемых капч(single-flight).
+Если капча с тем же содержимым уже отправлена и ещё решается, новая отправка не выполняется: вызов получает ID уже
+решаемой задачи, а опросы res.php по этой задаче выполняются одним запросом и их ответы получают все ожидающие.
+Одинаковыми считаются капчи:
+    `ImageCaptcha` - с одинаковым изображением(хэш `body` или файла после обработки) и параметрами пайлоада;
+    `TextCaptcha` - с одинаковым текстом после нормализации(`normalize_text`) и параметрами пайлоада.
+Капчи без изображения или текста(ReCaptcha и т.д.) не объединяются - их решения одноразовые.
+
+Объединение работает между потоками и asyncio задачами одного процесса, объект передаётся параметром `single_flight`:
+    flights = SingleFlight()
+    ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, single_flight = flights)
+    ImageCaptcha.aioImageCaptcha(rucaptcha_key = KEY, single_flight = flights)
+Дублирующая отправка(`hedging`) объединилась бы с исходной капчей, поэтому вместе с ней не используется.
+"""
+import time
+import hashlib
+import threading
+import unicodedata
+
+from .transport import CHUNK_SIZE, Transport, AioTransport, make_transport, make_aio_transport
+
+# поля пайлоада с содержимым капчи, по которым она объединяется
+CONTENT_FIELDS = ('textcaptcha', 'body')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация текста капчи: юникод NFKC, без учёта регистра и лишних пробелов
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+def flight_key(payload: dict, files: dict = None):
+    """
+    Ключ объединения капчи: хэш содержимого и остальных параметров пайлоада
+    :param files: Файлы multipart запроса, содержимое берётся из них, если его нет в пайлоаде
+    :return: Ключ или None, если капча не объединяется
+    """
+    for field in CONTENT_FIELDS:
+        content = payload.get(field)
+        if isinstance(content, str):
+            break
+    else:
+        # изображение отправляется байтами(`upload_method='post'`)
+        if not files or not all(isinstance(value, bytes) for value in files.values()):
+            return None
+        key = hashlib.sha256()
+        for name, value in sorted(files.items()):
+            key.update(f'\0{name}:{len(value)}\0'.encode())
+            key.update(value)
+        for name, value in sorted(payload.items()):
+            key.update(f'\0{name}={value}'.encode())
+        return key.hexdigest()
+    if field == 'textcaptcha':
+        content = normalize_text(content)
+    key = hashlib.sha256(content.encode())
+    for name, value in sorted(payload.items()):
+        if name != field:
+            key.update(f'\0{name}={value}'.encode())
+    return key.hexdigest()
+
+
+def _finished(answer: dict) -> bool:
+    return answer.get('request') != 'CAPCHA_NOT_READY'
+
+
+class _Flight:
+    """
+    Одна решаемая капча и её ожидающие
+    """
+    __slots__ = ('key', 'submit', 'captcha_id', 'waiters', 'polling', 'polled_at', 'last', 'answer')
+
+    def __init__(self, key: str):
+        # `concurrent.futures` загружается при первой капче, а не при импорте библиотеки
+        import concurrent.futures
+
+        self.key = key
+        # ответ in.php для всех ожидающих
+        self.submit = concurrent.futures.Future()
+        self.captcha_id = None
+        # кол-во вызовов, ожидающих решения этой задачи
+        self.waiters = 1
+        # выполняемый опрос res.php
+        self.polling = None
+        self.polled_at = 0.0
+        # последний ответ `CAPCHA_NOT_READY` и окончательный ответ
+        self.last = None
+        self.answer = None
+
+
+class SingleFlight:
+    """
+    Общее для потоков и asyncio задач состояние объединяемых капч
+    """
+
+    def __init__(self, poll_interval: float = 1, key = flight_key):
+        """
+        :param poll_interval: Ответ `CAPCHA_NOT_READY` моложе этого кол-ва секунд отдаётся ожидающим без запроса
+        :param key: Функция (пайлоад, файлы multipart запроса) -> ключ объединения или None
+        """
+        self.poll_interval = poll_interval
+        self.key = key
+        self._lock = threading.Lock()
+        # ключ -> ещё не решённая капча
+        self._flights = {}
+        # ID капчи -> капча
+        self._tasks = {}
+        self._stats = {'submitted': 0, 'coalesced': 0, 'polls': 0, 'polls_shared': 0}
+
+    def join(self, payload: dict, files: dict = None):
+        """
+        Находит решаемую капчу с таким же содержимым или регистрирует новую
+        :return: (капча, True - вызов отправляет капчу сам) или (None, True), если капча не объединяется
+        """
+        key = self.key(payload, files)
+        if key is None:
+            return None, True
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self._stats['coalesced'] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight(key)
+            self._stats['submitted'] += 1
+            return flight, True
+
+    def submitted(self, flight: _Flight, answer: dict = None, error: BaseException = None):
+        """
+        Передаёт ожидающим ответ in.php или ошибку отправки.
+        Ответ None(отправка отменена) - ожидающие отправят капчу заново.
+        """
+        with self._lock:
+            if answer is not None and answer.get('status') == 1:
+                flight.captcha_id = answer['request']
+                self._tasks[flight.captcha_id] = flight
+            elif self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if error is not None:
+            flight.submit.set_exception(error)
+        else:
+            flight.submit.set_result(answer)
+
+    def poll(self, captcha_id: str):
+        """
+        :return: (капча, готовый ответ, Future выполняемого опроса, True - вызов выполняет опрос сам)
+        """
+        with self._lock:
+            flight = self._tasks.get(captcha_id)
+            if flight is None:
+                return None, None, None, True
+            if flight.answer is not None:
+                self._stats['polls_shared'] += 1
+                return flight, dict(flight.answer), None, False
+            if flight.polling is not None:
+                self._stats['polls_shared'] += 1
+                return flight, None, flight.polling, False
+            if flight.last is not None and time.monotonic() - flight.polled_at < self.poll_interval:
+                self._stats['polls_shared'] += 1
+                return flight, dict(flight.last), None, False
+            import concurrent.futures
+
+            flight.polling = concurrent.futures.Future()
+            self._stats['polls'] += 1
+            return flight, None, flight.polling, True
+
+    def polled(self, flight: _Flight, answer: dict = None, error: BaseException = None):
+        """
+        Передаёт ожидающим ответ res.php или ошибку запроса.
+        Ответ None(опрос отменён) - ожидающие выполнят опрос заново.
+        """
+        with self._lock:
+            future, flight.polling = flight.polling, None
+            if answer is not None:
+                flight.polled_at = time.monotonic()
+                if _finished(answer):
+                    flight.answer = answer
+                    # новые такие же капчи отправляются заново
+                    if self._flights.get(flight.key) is flight:
+                        del self._flights[flight.key]
+                else:
+                    flight.last = answer
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(answer)
+
+    def leave(self, captcha_id: str) -> bool:
+        """
+        Учитывает окончание ожидания решения одним из вызовов
+        :return: True - ожиданий этой капчи больше нет
+        """
+        with self._lock:
+            flight = self._tasks.get(captcha_id)
+            if flight is None:
+                return True
+            flight.waiters -= 1
+            if flight.waiters > 0:
+                return False
+            del self._tasks[captcha_id]
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return True
+
+    def abandon(self, flight: _Flight):
+        """
+        Учитывает вызов, переставший ждать ответа in.php(таймаут или отмена)
+        :return: ID капчи, если ожиданий этой капчи больше нет, иначе None
+        """
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters > 0 or flight.captcha_id is None or self._tasks.get(flight.captcha_id) is not flight:
+                return None
+            del self._tasks[flight.captcha_id]
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return flight.captcha_id
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во отправленных и объединённых капч, выполненных и сэкономленных опросов, решаемых капч
+        """
+        with self._lock:
+            return dict(self._stats, in_flight = len(self._tasks))
+
+    def transport(self, transport = None) -> 'SingleFlightTransport':
+        """
+        :param transport: Синхронный транспорт или название бэкенда(см. `transport.make_transport`)
+        """
+        return SingleFlightTransport(self, make_transport(transport))
+
+    def aio_transport(self, transport = None) -> 'AioSingleFlightTransport':
+        """
+        :param transport: Асинхронный транспорт или название бэкенда(см. `transport.make_aio_transport`)
+        """
+        return AioSingleFlightTransport(self, make_aio_transport(transport))
+
+
+class SingleFlightTransport(Transport):
+    """
+    Синхронный транспорт с объединением одинаковых капч
+    """
+
+    def __init__(self, flights: SingleFlight, transport: Transport):
+        self.flights = flights
+        self.transport = transport
+        self.name = transport.name
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        while True:
+            flight, leader = self.flights.join(payload, files)
+            if flight is None:
+                return self.transport.submit(url_request, payload, files = files, timeout = timeout)
+            if not leader:
+                try:
+                    answer = flight.submit.result(timeout)
+                except BaseException:
+                    self._abandon(flight)
+                    raise
+                if answer is not None:
+                    return dict(answer)
+                continue
+            try:
+                answer = self.transport.submit(url_request, payload, files = files, timeout = timeout)
+            except Exception as error:
+                self.flights.submitted(flight, error = error)
+                raise
+            except BaseException:
+                self.flights.submitted(flight)
+                raise
+            self.flights.submitted(flight, answer)
+            return answer
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        while True:
+            flight, answer, future, leader = self.flights.poll(payload.get('id'))
+            if flight is None:
+                return self.transport.get(url_response, payload, timeout = timeout)
+            if answer is not None:
+                return answer
+            if not leader:
+                answer = future.result(timeout)
+                if answer is not None:
+                    return dict(answer)
+                continue
+            try:
+                answer = self.transport.get(url_response, payload, timeout = timeout)
+            except Exception as error:
+                self.flights.polled(flight, error = error)
+                raise
+            except BaseException:
+                self.flights.polled(flight)
+                raise
+            self.flights.polled(flight, answer)
+            return answer
+
+    def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return self.transport.get_many(url_response, rucaptcha_key, ids, timeout = timeout)
+
+    def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self.transport.control(url_response, payload, timeout = timeout)
+
+    def _abandon(self, flight: _Flight):
+        captcha_id = self.flights.abandon(flight)
+        if captcha_id is not None:
+            self.transport.finish(captcha_id)
+
+    def finish(self, captcha_id: str):
+        if self.flights.leave(captcha_id):
+            self.transport.finish(captcha_id)
+
+    def close(self):
+        self.transport.close()
+
+
+class AioSingleFlightTransport(AioTransport):
+    """
+    Асинхронный транспорт с объединением одинаковых капч, аналог `SingleFlightTransport`.
+    Ожидающие из asyncio задач и потоков объединяются в одни и те же капчи.
+    """
+
+    def __init__(self, flights: SingleFlight, transport: AioTransport):
+        self.flights = flights
+        self.transport = transport
+        self.name = transport.name
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return await self.transport.request(url, data, files = files, timeout = timeout)
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        return self.transport.stream(url, timeout = timeout, chunk_size = chunk_size, **kwargs)
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        import asyncio
+
+        while True:
+            flight, leader = self.flights.join(payload, files)
+            if flight is None:
+                return await self.transport.submit(url_request, payload, files = files, timeout = timeout)
+            if not leader:
+                try:
+                    # отмена задачи не отменяет общий Future
+                    answer = await asyncio.shield(asyncio.wrap_future(flight.submit))
+                except BaseException:
+                    self._abandon(flight)
+                    raise
+                if answer is not None:
+                    return dict(answer)
+                continue
+            try:
+                answer = await self.transport.submit(url_request, payload, files = files, timeout = timeout)
+            except Exception as error:
+                self.flights.submitted(flight, error = error)
+                raise
+            except BaseException:
+                self.flights.submitted(flight)
+                raise
+            self.flights.submitted(flight, answer)
+            return answer
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        import asyncio
+
+        while True:
+            flight, answer, future, leader = self.flights.poll(payload.get('id'))
+            if flight is None:
+                return await self.transport.get(url_response, payload, timeout = timeout)
+            if answer is not None:
+                return answer
+            if not leader:
+                answer = await asyncio.shield(asyncio.wrap_future(future))
+                if answer is not None:
+                    return dict(answer)
+                continue
+            try:
+                answer = await self.transport.get(url_response, payload, timeout = timeout)
+            except Exception as error:
+                self.flights.polled(flight, error = error)
+                raise
+            except BaseException:
+                self.flights.polled(flight)
+                raise
+            self.flights.polled(flight, answer)
+            return answer
+
+    async def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return await self.transport.get_many(url_response, rucaptcha_key, ids, timeout = timeout)
+
+    async def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self.transport.control(url_response, payload, timeout = timeout)
+
+    def _abandon(self, flight: _Flight):
+        captcha_id = self.flights.abandon(flight)
+        if captcha_id is not None:
+            self.transport.finish(captcha_id)
+
+    def finish(self, captcha_id: str):
+        if self.flights.leave(captcha_id):
+            self.transport.finish(captcha_id)
+
+    async def close(self):
+        await self.transport.close()
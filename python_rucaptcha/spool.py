@@ -0,0 +1,327 @@
+"""
+Режим наблюдения за папкой-спулом.
+`SpoolWatcher` отправляет на решение изображения, которые сторонние программы складывают в общую папку, по мере
+их появления: на Linux новые файлы приходят событиями inotify(`IN_CLOSE_WRITE`, `IN_MOVED_TO`), на остальных
+системах папка опрашивается раз в `poll_interval` секунд. Решённые изображения атомарно переносятся в `done_dir`,
+нерешённые - в `failed_dir`, поэтому в спуле остаются только ожидающие и решаемые файлы, а после перезапуска
+недорешённые файлы отправляются заново.
+
+    captcha = ImageCaptcha.aioImageCaptcha(rucaptcha_key = KEY)
+    SpoolWatcher(captcha, 'spool', results_log = 'answers.jsonl').run_forever()
+
+Ответ записывается в файл рядом с перенесённым изображением(`<имя>.txt` с решением или `<имя>.error` с JSON ошибки)
+до переноса самого изображения, и/или строкой JSONL в общий журнал `results_log`.
+"""
+import os
+import json
+import time
+import ctypes
+import struct
+import asyncio
+import ctypes.util
+
+from .config import JSON_RESPONSE
+
+# расширения файлов изображений, которые берутся из спула
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+# флаги inotify из <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+# заголовок события: wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """
+    Наблюдение за одной папкой через inotify(вызовы libc через ctypes)
+    """
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify недоступен')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch', path)
+
+    def read(self):
+        """
+        Читает накопившиеся события
+        :return: Список имён файлов и флаг переполнения очереди событий ядра(нужен полный просмотр папки)
+        """
+        names = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names, overflow
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                    overflow = True
+                elif length:
+                    names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _write_atomic(path: str, content: str):
+    """
+    Запись файла через временный файл и переименование: читатель видит файл только целиком
+    """
+    part = f'{path}.part'
+    with open(part, 'w', encoding = 'utf-8') as out_file:
+        out_file.write(content)
+    os.replace(part, path)
+
+
+class SpoolWatcher:
+    """
+    Решение изображений, появляющихся в папке-спуле
+    """
+
+    def __init__(self, captcha, spool_dir: str, done_dir: str = None, failed_dir: str = None, sidecar: bool = True,
+                 results_log: str = None, concurrency: int = 500, poll_interval: float = 1, settle: float = 1,
+                 use_inotify: bool = True, extensions: tuple = IMAGE_EXTENSIONS):
+        """
+        :param captcha: `ImageCaptcha.aioImageCaptcha`, через который решаются изображения
+        :param spool_dir: Папка, в которую сторонние программы кладут изображения
+        :param done_dir: Папка для решённых изображений, по умолчанию - `<spool_dir>/done`.
+                         Должна быть на той же файловой системе, что и спул, чтобы перенос был атомарным
+        :param failed_dir: Папка для нерешённых изображений, по умолчанию - `<spool_dir>/failed`
+        :param sidecar: True - записывать ответ в файл рядом с перенесённым изображением
+        :param results_log: Файл журнала ответов JSONL, None - не вести журнал
+        :param concurrency: Максимальное кол-во одновременно решаемых изображений
+        :param poll_interval: Интервал просмотра папки в секундах, если inotify недоступен
+        :param settle: Файл из просмотра папки берётся, если он не изменялся это время в секундах(запись завершена)
+        :param use_inotify: False - всегда просматривать папку по таймеру
+        :param extensions: Расширения файлов, которые берутся из спула, остальные файлы(в том числе
+                           недописанные `.part`/`.tmp`) пропускаются
+        """
+        if concurrency < 1:
+            raise ValueError(f'Параметр `concurrency` должен быть больше 0. Вы передали - {concurrency}')
+        if not sidecar and results_log is None:
+            raise ValueError('Ответы некуда записывать: включите `sidecar` или передайте `results_log`')
+        self.captcha = captcha
+        self.spool_dir = spool_dir
+        self.done_dir = done_dir or os.path.join(spool_dir, 'done')
+        self.failed_dir = failed_dir or os.path.join(spool_dir, 'failed')
+        self.sidecar = sidecar
+        self.results_log = results_log
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.use_inotify = use_inotify
+        self.extensions = tuple(extension.lower() for extension in extensions)
+
+        # имена файлов в очереди и на решении - повторные события по ним пропускаются
+        self._pending = set()
+        self._queue = None
+        self._stopping = None
+        self._inotify = None
+        self._log = None
+        self._started = None
+        self._stats = {'queued': 0, 'solved': 0, 'failed': 0, 'missing': 0, 'scans': 0, 'events': 0}
+
+    @property
+    def mode(self) -> str:
+        """
+        :return: `inotify` или `polling` - способ обнаружения новых файлов
+        """
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во взятых, решённых и нерешённых файлов, файлов в очереди/на решении, просмотров папки,
+                 событий inotify и производительность в файлах в минуту
+        """
+        elapsed = time.monotonic() - self._started if self._started else 0
+        done = self._stats['solved'] + self._stats['failed']
+        return dict(self._stats, pending = len(self._pending), mode = self.mode,
+                    per_minute = round(done / elapsed * 60, 1) if elapsed else None)
+
+    def _accept(self, name: str) -> bool:
+        return not name.startswith('.') and name.lower().endswith(self.extensions) and name not in self._pending
+
+    def _enqueue(self, name: str):
+        self._pending.add(name)
+        self._stats['queued'] += 1
+        self._queue.put_nowait(name)
+
+    def scan(self) -> int:
+        """
+        Просмотр спула: в очередь добавляются новые файлы, не изменявшиеся `settle` секунд
+        :return: Кол-во добавленных файлов
+        """
+        self._stats['scans'] += 1
+        added = 0
+        settled = time.time() - self.settle
+        with os.scandir(self.spool_dir) as entries:
+            for entry in entries:
+                if not self._accept(entry.name):
+                    continue
+                try:
+                    if not entry.is_file() or entry.stat().st_mtime > settled:
+                        continue
+                except FileNotFoundError:
+                    continue
+                self._enqueue(entry.name)
+                added += 1
+        return added
+
+    def _on_events(self):
+        names, overflow = self._inotify.read()
+        self._stats['events'] += len(names)
+        for name in names:
+            if self._accept(name):
+                self._enqueue(name)
+        # ядро потеряло события - один раз просматриваем папку целиком
+        if overflow:
+            self.scan()
+
+    def _start_inotify(self, loop):
+        try:
+            self._inotify = _Inotify(self.spool_dir)
+        except (OSError, AttributeError):
+            self._inotify = None
+            return
+        loop.add_reader(self._inotify.fd, self._on_events)
+
+    async def _watch(self):
+        """
+        Первый просмотр спула и, без inotify, просмотры по таймеру.
+        С inotify папка просматривается ещё раз через `settle` секунд: файлы, дописанные до запуска наблюдения,
+        не дают событий
+        """
+        self.scan()
+        interval = self.settle if self._inotify is not None else self.poll_interval
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                self.scan()
+                if self._inotify is not None:
+                    await self._stopping.wait()
+
+    def _write_result(self, name: str, answer: dict, latency: float):
+        target_dir = self.failed_dir if answer['error'] else self.done_dir
+        if self.sidecar:
+            if answer['error']:
+                _write_atomic(os.path.join(target_dir, f'{name}.error'),
+                              json.dumps(answer, ensure_ascii = False, default = str))
+            else:
+                _write_atomic(os.path.join(target_dir, f'{name}.txt'), answer['captchaSolve'])
+        if self._log is not None:
+            line = dict(answer, file = name, latency = round(latency, 3))
+            self._log.write(json.dumps(line, ensure_ascii = False, default = str) + '\n')
+            self._log.flush()
+        # изображение переносится последним: рядом с ним уже лежит готовый ответ
+        os.replace(os.path.join(self.spool_dir, name), os.path.join(target_dir, name))
+
+    async def _worker(self):
+        while True:
+            name = await self._queue.get()
+            if name is None:
+                return
+            path = os.path.join(self.spool_dir, name)
+            try:
+                # файл мог быть удалён или перенесён другим наблюдателем
+                if not os.path.exists(path):
+                    self._stats['missing'] += 1
+                    continue
+                start = time.monotonic()
+                try:
+                    answer = await self.captcha.captcha_handler(captcha_file = path)
+                except Exception as error:
+                    # сбой решения одного файла не должен останавливать обработчик
+                    answer = dict(JSON_RESPONSE, error = True, errorBody = {'text': error, 'id': 0})
+                latency = time.monotonic() - start
+                try:
+                    self._write_result(name, answer, latency)
+                except FileNotFoundError:
+                    self._stats['missing'] += 1
+                    continue
+                except Exception:
+                    # ответ не записан - изображение всё равно убирается из спула, иначе оно будет взято снова
+                    self._stats['failed'] += 1
+                    try:
+                        os.replace(path, os.path.join(self.failed_dir, name))
+                    except OSError:
+                        pass
+                    continue
+                if answer['error']:
+                    self._stats['failed'] += 1
+                else:
+                    self._stats['solved'] += 1
+            finally:
+                self._pending.discard(name)
+
+    async def run(self):
+        """
+        Наблюдение за спулом до вызова `stop`. После остановки новые файлы не берутся, решаемые - дорешиваются,
+        файлы из очереди остаются в спуле
+        """
+        loop = asyncio.get_event_loop()
+        os.makedirs(self.done_dir, exist_ok = True)
+        os.makedirs(self.failed_dir, exist_ok = True)
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._started = time.monotonic()
+        if self.results_log is not None:
+            self._log = open(self.results_log, 'a', encoding = 'utf-8')
+        if self.use_inotify:
+            self._start_inotify(loop)
+
+        workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            await self._watch()
+        finally:
+            if self._inotify is not None:
+                loop.remove_reader(self._inotify.fd)
+                self._inotify.close()
+                self._inotify = None
+            # файлы из очереди не отправляются, они будут взяты при следующем запуске
+            while not self._queue.empty():
+                self._pending.discard(self._queue.get_nowait())
+            for _ in workers:
+                self._queue.put_nowait(None)
+            await asyncio.gather(*workers, return_exceptions = True)
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def stop(self):
+        """
+        Останавливает `run`, вызывается из того же цикла событий
+        """
+        if self._stopping is not None:
+            self._stopping.set()
+
+    def run_forever(self):
+        """
+        Синхронный запуск `run` в новом цикле событий, останавливается по Ctrl+C
+        """
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(self.run())
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            self.stop()
+            loop.run_until_complete(task)
+        finally:
+            loop.run_until_complete(self.captcha.close())
+            loop.close()
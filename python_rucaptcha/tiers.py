@@ -0,0 +1,195 @@
+"""
+Локальное распознавание изображения до отправки на сервис.
+Простые капчи(например, из цифр) локальная модель распознаёт за миллисекунды, а сервис - не быстрее `sleep_time`.
+`LocalTier` запускает пользовательский распознаватель в пуле процессов(не блокируя поток или цикл событий),
+и если уверенность ответа не ниже `threshold`, ответ возвращается без отправки капчи на сервис.
+Иначе капча решается сервисом как обычно.
+
+Распознаватель - функция(или объект с `__call__`), которая принимает изображение в байтах и возвращает
+пару (ответ, уверенность от 0 до 1) или None. Он передаётся в каждый процесс пула один раз, поэтому модель
+можно загрузить при создании объекта:
+    def recognize(image: bytes):
+        ...
+        return '088636', 0.97
+
+    tier = LocalTier(recognize, threshold = 0.9, workers = 2)
+    ImageCaptcha.ImageCaptcha(rucaptcha_key = KEY, local_tier = tier)
+Распознаётся изображение после `preprocessing`. Ответ локального распознавания отмечается в результате полем
+`tier`: `local`, у капч решённых сервисом - `service`.
+"""
+import time
+import base64
+import threading
+import collections
+
+from .hedging import _percentile
+
+# распознаватель процесса-воркера, передаётся при запуске процесса
+_worker_recognizer = None
+
+
+def _init_worker(recognizer):
+    global _worker_recognizer
+    _worker_recognizer = recognizer
+
+
+def _recognize_with(recognizer, body):
+    """
+    Декодирует изображение и распознаёт его
+    :param body: Изображение в кодировке base64 или байтами
+    """
+    return recognizer(base64.b64decode(body) if isinstance(body, str) else body)
+
+
+def _recognize(body):
+    """
+    Выполняется в процессе-воркере
+    """
+    return _recognize_with(_worker_recognizer, body)
+
+
+class LocalTier:
+    """
+    Локальное распознавание перед отправкой на сервис, со статистикой попаданий и времени обоих уровней
+    """
+
+    def __init__(self, recognizer, threshold: float = 0.9, workers: int = 1, timeout: float = 1, window: int = 1000,
+                 mp_context = None):
+        """
+        :param recognizer: Распознаватель: изображение в байтах -> (ответ, уверенность) или None
+        :param threshold: Минимальная уверенность, при которой используется локальный ответ
+        :param workers: Кол-во процессов распознавания, 0 - распознавать в вызывающем потоке
+                        (для асинхронных классов - в пуле потоков цикла событий)
+        :param timeout: Время ожидания локального ответа в секундах, после него капча отправляется на сервис
+        :param window: Кол-во последних решений каждого уровня, по которым считается время решения
+        :param mp_context: Контекст `multiprocessing`, по умолчанию - стандартный для платформы
+        """
+        if not 0 <= threshold <= 1:
+            raise ValueError(f'Параметр `threshold` должен быть от 0 до 1. Вы передали - {threshold}')
+        self.recognizer = recognizer
+        self.threshold = threshold
+        self.timeout = timeout
+        self._pool = None
+        if workers:
+            # модули пула процессов загружаются только при создании LocalTier, а не при импорте библиотеки
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(max_workers = workers,
+                                             mp_context = mp_context or multiprocessing.get_context(),
+                                             initializer = _init_worker, initargs = (recognizer,))
+        self._lock = threading.Lock()
+        self._latencies = {'local': collections.deque(maxlen = window),
+                           'service': collections.deque(maxlen = window),
+                           }
+        self._stats = {'calls': 0,
+                       'hits': 0,
+                       'low_confidence': 0,
+                       'errors': 0,
+                       'timeouts': 0,
+                       'service_calls': 0,
+                       'service_errors': 0,
+                       }
+
+    def _accept(self, recognized, latency: float):
+        """
+        Учитывает результат распознавания
+        :return: Ответ, если уверенность достаточна, иначе None
+        """
+        with self._lock:
+            if recognized is None or recognized[0] is None or recognized[1] < self.threshold:
+                self._stats['low_confidence'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._latencies['local'].append(latency)
+            return str(recognized[0])
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def recognize(self, body):
+        """
+        Синхронное локальное распознавание
+        :param body: Изображение в кодировке base64 или байтами(`upload_method='post'`)
+        :return: Ответ или None - капчу нужно отправить на сервис
+        """
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+
+        self._count('calls')
+        start = time.monotonic()
+        try:
+            if self._pool is None:
+                recognized = _recognize_with(self.recognizer, body)
+            else:
+                recognized = self._pool.submit(_recognize, body).result(timeout = self.timeout)
+        except FutureTimeoutError:
+            self._count('timeouts')
+            return None
+        except Exception:
+            # ошибка распознавателя не мешает решению через сервис
+            self._count('errors')
+            return None
+        return self._accept(recognized, time.monotonic() - start)
+
+    async def aio_recognize(self, body):
+        """
+        Асинхронный вариант `recognize`
+        """
+        import asyncio
+
+        self._count('calls')
+        loop = asyncio.get_event_loop()
+        start = time.monotonic()
+        try:
+            if self._pool is None:
+                future = loop.run_in_executor(None, _recognize_with, self.recognizer, body)
+            else:
+                future = asyncio.wrap_future(self._pool.submit(_recognize, body))
+            recognized = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._count('timeouts')
+            return None
+        except Exception:
+            self._count('errors')
+            return None
+        return self._accept(recognized, time.monotonic() - start)
+
+    def record_service(self, latency: float, error: bool):
+        """
+        Учитывает капчу, решённую сервисом после локального распознавания
+        :param latency: Время решения сервисом в секундах
+        :param error: True - сервис вернул ошибку
+        """
+        with self._lock:
+            self._stats['service_calls'] += 1
+            if error:
+                self._stats['service_errors'] += 1
+            else:
+                self._latencies['service'].append(latency)
+
+    def stats(self) -> dict:
+        """
+        :return: Кол-во локальных распознаваний, попаданий, ответов с низкой уверенностью, ошибок и превышений
+                 `timeout`, долю попаданий, кол-во капч решённых сервисом и время решения p50/p99 каждого уровня
+        """
+        with self._lock:
+            stats = dict(self._stats, hit_rate = round(self._stats['hits'] / self._stats['calls'], 3)
+                         if self._stats['calls'] else None)
+            for tier, latencies in self._latencies.items():
+                stats[f'{tier}_p50'] = round(_percentile(latencies, 0.5), 4) if latencies else None
+                stats[f'{tier}_p99'] = round(_percentile(latencies, 0.99), 4) if latencies else None
+            return stats
+
+    def close(self):
+        """
+        Останавливает процессы распознавания
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
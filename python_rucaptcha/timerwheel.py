@@ -0,0 +1,151 @@
+"""
+Иерархическое колесо таймеров.
+Время делится на тики по `tick` секунд. Нижний уровень колеса - `slots` ячеек по одному тику, каждый следующий
+уровень - `slots` ячеек по целому обороту предыдущего. Таймер кладётся в ячейку уровня, который покрывает его срок,
+и при повороте колеса спускается на нижние уровни. Добавление таймера и выдача сработавших - O(1) на таймер,
+независимо от кол-ва ожидающих, в отличие от кучи(`heapq`, `asyncio.sleep`) с O(log n) на операцию.
+
+Колесо не потокобезопасно и не хранит ничего кроме элементов в ячейках: отмена таймера - забота владельца
+(элемент просто пропускается при срабатывании).
+"""
+import time
+
+# кол-во ячеек на уровне и кол-во уровней по умолчанию: 64 ** 4 тиков по 0.05 секунды - больше 9 суток
+WHEEL_SLOTS = 64
+WHEEL_LEVELS = 4
+
+
+class TimerWheel:
+    """
+    Колесо таймеров, время - по `time.monotonic()`
+    """
+
+    def __init__(self, tick: float = 0.05, slots: int = WHEEL_SLOTS, levels: int = WHEEL_LEVELS, start: float = None):
+        """
+        :param tick: Длительность тика в секундах - точность срабатывания таймеров
+        :param slots: Кол-во ячеек на уровне, степень двойки
+        :param levels: Кол-во уровней, более поздние сроки откладываются в последнюю ячейку верхнего уровня
+        :param start: Начало отсчёта, по умолчанию - текущее время
+        """
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError(f'Параметр `slots` должен быть степенью двойки. Вы передали - {slots}')
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._start = time.monotonic() if start is None else start
+        # текущий тик: все таймеры со сроком до него включительно уже выданы
+        self._current = 0
+        self._wheel = [[[] for _ in range(slots)] for _ in range(levels)]
+        # кол-во элементов в колесе
+        self.count = 0
+
+    def _tick_of(self, when: float) -> int:
+        # таймер не срабатывает раньше срока: тик округляется вверх
+        return -int(-(when - self._start) // self.tick)
+
+    def time_of(self, tick: int) -> float:
+        return self._start + tick * self.tick
+
+    def _place(self, expire: int, item, due: bool = False):
+        """
+        :param due: True - ячейка текущего тика ещё не разобрана(спуск с верхних уровней),
+                    таймер с текущим сроком кладётся в неё
+        """
+        delta = expire - self._current
+        if delta < 0 or (delta == 0 and not due):
+            # срок уже прошёл - срабатывает на следующем тике
+            expire = self._current + 1
+            delta = 1
+        for level in range(self.levels):
+            if delta < 1 << (self._bits * (level + 1)):
+                self._wheel[level][(expire >> (self._bits * level)) & self._mask].append((expire, item))
+                return
+        # дальше последнего уровня - в ячейку, которая будет разобрана последней
+        top = self.levels - 1
+        self._wheel[top][((self._current >> (self._bits * top)) - 1) & self._mask].append((expire, item))
+
+    def schedule(self, when: float, item):
+        """
+        Добавляет таймер
+        :param when: Время срабатывания по `time.monotonic()`
+        :param item: Элемент, который будет выдан `expired`
+        """
+        self._place(self._tick_of(when), item)
+        self.count += 1
+
+    def _cascade(self, level: int):
+        """
+        Переносит таймеры текущей ячейки уровня `level` на нижние уровни
+        """
+        index = (self._current >> (self._bits * level)) & self._mask
+        slot = self._wheel[level][index]
+        if not slot:
+            return
+        self._wheel[level][index] = []
+        for expire, item in slot:
+            self._place(expire, item, due = True)
+
+    def expired(self, now: float = None) -> list:
+        """
+        Поворачивает колесо до текущего времени
+        :return: Элементы сработавших таймеров
+        """
+        target = int(((time.monotonic() if now is None else now) - self._start) // self.tick)
+        fired = []
+        if not self.count:
+            # пустое колесо поворачивается сразу
+            self._current = max(self._current, target)
+            return fired
+        while self._current < target and self.count:
+            self._current += 1
+            # начало оборота уровня - таймеры спускаются с верхних уровней, начиная с самого верхнего
+            levels = 1
+            while levels < self.levels and not self._current & ((1 << (self._bits * levels)) - 1):
+                levels += 1
+            for level in range(levels - 1, 0, -1):
+                self._cascade(level)
+            index = self._current & self._mask
+            slot = self._wheel[0][index]
+            if slot:
+                self._wheel[0][index] = []
+                for expire, item in slot:
+                    if expire <= self._current:
+                        fired.append(item)
+                        self.count -= 1
+                    else:
+                        # таймер на оборот позже(после переполнения последнего уровня)
+                        self._place(expire, item)
+        if not self.count:
+            self._current = max(self._current, target)
+        return fired
+
+    def next_expiry(self):
+        """
+        :return: Время ближайшего возможного срабатывания по `time.monotonic()` или None - колесо пустое.
+                 Если ближайший таймер ещё на верхних уровнях, возвращается время их спуска.
+        """
+        if not self.count:
+            return None
+        for offset in range(1, self.slots + 1):
+            tick = self._current + offset
+            if tick & self._mask == 0:
+                # граница оборота нижнего уровня - спуск таймеров сверху
+                return self.time_of(tick)
+            if self._wheel[0][tick & self._mask]:
+                return self.time_of(tick)
+        return self.time_of(self._current + self.slots)
+
+    def clear(self) -> list:
+        """
+        Убирает все таймеры из колеса
+        :return: Элементы всех таймеров
+        """
+        items = [item for level in self._wheel for slot in level for _, item in slot]
+        self._wheel = [[[] for _ in range(self.slots)] for _ in range(self.levels)]
+        self.count = 0
+        return items
+
+    def __len__(self):
+        return self.count
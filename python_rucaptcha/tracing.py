@@ -0,0 +1,178 @@
+"""
+Трассировка решения капчи спанами OpenTelemetry.
+Каждый `captcha_handler` создаёт спан `rucaptcha.solve`, внутри него - спаны этапов:
+    `rucaptcha.download` - скачивание изображения по ссылке;
+    `rucaptcha.encode` - обработка и кодирование изображения в base64;
+    `rucaptcha.submit` - каждый запрос на in.php(в т.ч. повторные и дублирующие отправки);
+    `rucaptcha.wait` - ожидание решения, внутри него `rucaptcha.poll` - каждый запрос решения на res.php.
+Атрибуты спанов: `rucaptcha.captcha`(класс капчи), `rucaptcha.method`, `rucaptcha.task_id`, `rucaptcha.payload_bytes`,
+`rucaptcha.attempt`, `rucaptcha.error_code`(код ошибки сервиса), `rucaptcha.error_id`(номер ошибки библиотеки).
+
+Трейсер берётся из `opentelemetry.trace.get_tracer`, если установлен `opentelemetry-api`
+(`pip install python-rucaptcha[tracing]`), и его провайдер настраивается приложением как обычно.
+Без `opentelemetry-api` или после `set_tracer(None)` трассировка ничего не делает.
+"""
+import os
+import functools
+
+# трейсер ещё не выбран
+_UNSET = object()
+_tracer = _UNSET
+
+
+class _NoopSpan:
+    """
+    Спан-заглушка при выключенной трассировке
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def set_tracer(tracer):
+    """
+    Задаёт трейсер для спанов библиотеки
+    :param tracer: `opentelemetry.trace.Tracer` или совместимый объект с методом
+                   `start_as_current_span(name, attributes=...)`, None - выключить трассировку
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    """
+    :return: Трейсер или None, если трассировка выключена
+    """
+    global _tracer
+    if _tracer is _UNSET:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            _tracer = None
+        else:
+            _tracer = trace.get_tracer(__package__)
+    return _tracer
+
+
+def _attributes(attributes: dict) -> dict:
+    return {f'rucaptcha.{key}': value for key, value in attributes.items() if value is not None}
+
+
+def span(name: str, **attributes):
+    """
+    Контекстный менеджер спана, дочернего к текущему
+    :param name: Название спана
+    :param attributes: Атрибуты без префикса `rucaptcha.`, None значения пропускаются
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return NOOP_SPAN
+    return tracer.start_as_current_span(name, attributes = _attributes(attributes))
+
+
+def set_attributes(span, **attributes):
+    """
+    Добавляет атрибуты в спан, если он записывается
+    """
+    if span.is_recording():
+        for key, value in _attributes(attributes).items():
+            span.set_attribute(key, value)
+
+
+def record_answer(span, answer: dict, submit: bool = False):
+    """
+    Записывает в спан ответ in.php/res.php: статус, ID отправленной задачи или код ошибки
+    :param submit: True - ответ in.php, в `request` находится ID задачи
+    """
+    if not span.is_recording():
+        return
+    span.set_attribute('rucaptcha.status', answer['status'])
+    if answer['status'] == 1:
+        if submit:
+            span.set_attribute('rucaptcha.task_id', answer['request'])
+    elif answer['request'] != 'CAPCHA_NOT_READY':
+        span.set_attribute('rucaptcha.error_code', answer['request'])
+
+
+def payload_size(payload: dict, files: dict = None) -> int:
+    """
+    Размер отправляемых данных в байтах: строковые значения пайлоада и файлы
+    """
+    size = sum(len(value) for value in payload.values() if isinstance(value, (str, bytes)))
+    for value in (files or {}).values():
+        if hasattr(value, 'getbuffer'):
+            size += value.getbuffer().nbytes
+        elif hasattr(value, 'fileno'):
+            size += os.fstat(value.fileno()).st_size
+        elif isinstance(value, (str, bytes)):
+            size += len(value)
+    return size
+
+
+def _solve_attributes(solver) -> dict:
+    method = (getattr(solver, 'post_payload', None) or {}).get('method')
+    # при `upload_method='post'` метод меняется в пайлоаде каждого вызова, а не в пайлоаде класса
+    if getattr(solver, 'upload_method', None) == 'post':
+        method = 'post'
+    return _attributes({'captcha': type(solver).__name__,
+                        'method': method,
+                        })
+
+
+def _record_result(span, result: dict):
+    # Future фонового опроса(`background.BackgroundPoller.submit`) - решение ещё не получено
+    if not span.is_recording() or not isinstance(result, dict):
+        return
+    set_attributes(span, task_id = result.get('taskId'), attempts = result.get('attempts'))
+    if result['error']:
+        error_body = result['errorBody']
+        span.set_attribute('rucaptcha.error', True)
+        if isinstance(error_body, dict) and error_body.get('id'):
+            span.set_attribute('rucaptcha.error_id', error_body['id'])
+
+
+def traced(handler):
+    """
+    Декоратор `captcha_handler` синхронных классов: спан `rucaptcha.solve` на всё решение капчи
+    """
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        tracer = get_tracer()
+        if tracer is None:
+            return handler(self, *args, **kwargs)
+        with tracer.start_as_current_span('rucaptcha.solve', attributes = _solve_attributes(self)) as solve_span:
+            result = handler(self, *args, **kwargs)
+            _record_result(solve_span, result)
+            return result
+
+    return wrapper
+
+
+def aio_traced(handler):
+    """
+    Декоратор `captcha_handler` асинхронных классов, аналог `traced`
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, *args, **kwargs):
+        tracer = get_tracer()
+        if tracer is None:
+            return await handler(self, *args, **kwargs)
+        with tracer.start_as_current_span('rucaptcha.solve', attributes = _solve_attributes(self)) as solve_span:
+            result = await handler(self, *args, **kwargs)
+            _record_result(solve_span, result)
+            return result
+
+    return wrapper
@@ -0,0 +1,675 @@
+"""
+Транспорт - единственное место, где библиотека обращается к сети.
+Все классы решения капчи и `RuCaptchaControl` отправляют запросы через объект транспорта:
+    submit   - отправка капчи на in.php
+    get      - получение решения одной капчи с res.php
+    get_many - получение решений нескольких капч одним запросом(`action=get&ids=...`)
+    control  - дополнительные действия с res.php(баланс, жалобы и т.д.)
+    stream   - потоковое скачивание изображения/аудио с сайта
+    finish   - уведомление об окончании ожидания решения капчи
+Все методы возвращают уже разобранный JSON ответ сервера(см. `decoding.decode_json`).
+
+Бэкенды(синхронные / асинхронные):
+    `requests` - RequestsTransport / `aiohttp` - AiohttpTransport(по умолчанию)
+    `httpx`    - HttpxTransport / AioHttpxTransport, HTTP/2 с мультиплексированием запросов
+    `fake`     - FakeTransport / AioFakeTransport, локальный сервер в памяти процесса для тестов и замеров
+Бэкенд выбирается параметром `transport` классов решения капчи: название из `TRANSPORTS`/`AIO_TRANSPORTS`
+или готовый объект транспорта.
+"""
+import time
+import itertools
+import threading
+import contextlib
+from urllib.parse import urlsplit
+
+from .config import url_request_2captcha, url_response_2captcha, url_request_rucaptcha, url_response_rucaptcha
+from .backends import requests_session, aiohttp_session, import_httpx
+from .decoding import decode_json
+from . import tracing
+
+# размер блока при потоковом скачивании
+CHUNK_SIZE = 16 * 1024
+
+
+def service_urls(service_type: str):
+    """
+    Выбирает URL на который будут отпраляться запросы и с которого будут приходить ответы
+    :param service_type: "2captcha"(стандартный) или "rucaptcha"
+    :return: (URL для отправки капчи, URL для получения ответа)
+    """
+    if service_type == '2captcha':
+        return url_request_2captcha, url_response_2captcha
+    elif service_type == 'rucaptcha':
+        return url_request_rucaptcha, url_response_rucaptcha
+    raise ValueError('\nПередан неверный параметр URL-сервиса капчи! Возможные варинты: `rucaptcha` и `2captcha`.'
+                     f'\n\tВы передали - `{service_type}`'
+                     '\nWrong `service_type` parameter. Valid formats: `rucaptcha` or `2captcha`.'
+                     f'\n\tYour param - `{service_type}`')
+
+
+def ids_payload(rucaptcha_key: str, ids) -> dict:
+    """
+    Пайлоад запроса решений нескольких капч
+    """
+    return {'key': rucaptcha_key,
+            'action': 'get',
+            'ids': ','.join(ids),
+            'json': 1,
+            }
+
+
+class Transport:
+    """
+    Базовый класс синхронного транспорта.
+    Бэкенд реализует `request` и `stream`, остальные методы выражены через них.
+    """
+    name = None
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        """
+        POST запрос к серверу сервиса
+        :param url: URL in.php/res.php
+        :param data: Пайлоад запроса
+        :param files: Файлы для отправки multipart запросом
+        :param timeout: Таймаут запроса в секундах
+        :return: Разобранный JSON ответ
+        """
+        raise NotImplementedError
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        """
+        Контекстный менеджер потокового скачивания, возвращает пару (заголовки ответа, итератор блоков)
+        :param kwargs: Параметры HTTP библиотеки бэкенда
+        """
+        raise NotImplementedError
+
+    def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        with tracing.span('rucaptcha.submit', method = payload.get('method')) as span:
+            answer = self.request(url_request, payload, files = files, timeout = timeout)
+            tracing.set_attributes(span, payload_bytes = tracing.payload_size(payload, files)
+                                   if span.is_recording() else None)
+            tracing.record_answer(span, answer, submit = True)
+            return answer
+
+    def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self.request(url_response, payload, timeout = timeout)
+
+    def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return self.request(url_response, ids_payload(rucaptcha_key, ids), timeout = timeout)
+
+    def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return self.request(url_response, payload, timeout = timeout)
+
+    def finish(self, captcha_id: str):
+        """
+        Вызывается после окончания ожидания решения капчи: решение, ошибка, таймаут или отмена
+        """
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AioTransport:
+    """
+    Базовый класс асинхронного транспорта, аналог `Transport`.
+    `stream` - асинхронный контекстный менеджер с асинхронным итератором блоков.
+    """
+    name = None
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        raise NotImplementedError
+
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        raise NotImplementedError
+
+    async def submit(self, url_request: str, payload: dict, files: dict = None, timeout: float = None) -> dict:
+        with tracing.span('rucaptcha.submit', method = payload.get('method')) as span:
+            answer = await self.request(url_request, payload, files = files, timeout = timeout)
+            tracing.set_attributes(span, payload_bytes = tracing.payload_size(payload, files)
+                                   if span.is_recording() else None)
+            tracing.record_answer(span, answer, submit = True)
+            return answer
+
+    async def get(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self.request(url_response, payload, timeout = timeout)
+
+    async def get_many(self, url_response: str, rucaptcha_key: str, ids, timeout: float = None) -> dict:
+        return await self.request(url_response, ids_payload(rucaptcha_key, ids), timeout = timeout)
+
+    async def control(self, url_response: str, payload: dict, timeout: float = None) -> dict:
+        return await self.request(url_response, payload, timeout = timeout)
+
+    def finish(self, captcha_id: str):
+        """
+        Вызывается после окончания ожидания решения капчи, как `Transport.finish`
+        """
+        pass
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class RequestsTransport(Transport):
+    """
+    Транспорт на `requests.Session`, соединения переиспользуются между запросами
+    """
+    name = 'requests'
+
+    def __init__(self, session = None, max_retries: int = 5):
+        """
+        :param session: Готовая сессия `requests`, по умолчанию создаётся новая
+        :param max_retries: Кол-во попыток подключения к серверу при ошибке
+        """
+        self.session = session or requests_session(max_retries)
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        return decode_json(self.session.post(url, data = data, files = files, timeout = timeout).content)
+
+    @contextlib.contextmanager
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        with self.session.get(url, stream = True, timeout = timeout, **kwargs) as resp:
+            yield resp.headers, resp.iter_content(chunk_size)
+
+    def close(self):
+        self.session.close()
+
+
+class AiohttpTransport(AioTransport):
+    """
+    Транспорт на `aiohttp.ClientSession`.
+    Сессия создаётся при первом запросе и пересоздаётся, если транспорт используется в другом event loop.
+    """
+    name = 'aiohttp'
+
+    def __init__(self, **session_kwargs):
+        """
+        :param session_kwargs: Параметры `aiohttp.ClientSession`
+        """
+        self.session_kwargs = session_kwargs
+        self._session = None
+        self._loop = None
+
+    def _get_session(self):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp_session(**self.session_kwargs)
+            self._loop = loop
+        return self._session
+
+    @staticmethod
+    def _timeout(timeout: float):
+        import aiohttp
+
+        return {'timeout': aiohttp.ClientTimeout(total = timeout)} if timeout is not None else {}
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        if files:
+            import aiohttp
+
+            form = aiohttp.FormData()
+            for key, value in data.items():
+                form.add_field(key, str(value))
+            for key, value in files.items():
+                form.add_field(key, value, filename = getattr(value, 'name', key))
+            data = form
+        async with self._get_session().post(url, data = data, **self._timeout(timeout)) as resp:
+            return decode_json(await resp.read())
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        async with self._get_session().get(url, **self._timeout(timeout), **kwargs) as resp:
+            yield resp.headers, resp.content.iter_chunked(chunk_size)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class ConnectionHealth:
+    """
+    Состояние соединений HTTP/2 транспорта.
+    Клиент(и все его соединения) пересоздаётся, если:
+        - подряд произошло `max_failures` ошибок соединения;
+        - соединения простаивали дольше `max_idle` секунд: промежуточные узлы молча закрывают долго простаивающие
+          соединения, и первый запрос после простоя зависает до таймаута.
+    """
+
+    def __init__(self, max_failures: int = 3, max_idle: float = 60):
+        """
+        :param max_failures: Кол-во ошибок соединения подряд, после которого клиент пересоздаётся
+        :param max_idle: Время простоя в секундах, после которого клиент пересоздаётся перед запросом
+        """
+        self.max_failures = max_failures
+        self.max_idle = max_idle
+        self.failures = 0
+        self.last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0,
+                      'errors': 0,
+                      'reconnects': 0,
+                      'in_flight': 0,
+                      'max_in_flight': 0,
+                      'http_version': None,
+                      }
+
+    def begin(self) -> bool:
+        """
+        Отмечает начало запроса
+        :return: True - соединения простаивали слишком долго и клиент нужно пересоздать
+        """
+        with self._lock:
+            now = time.monotonic()
+            reconnect = not self.stats['in_flight'] and now - self.last_activity > self.max_idle
+            if reconnect:
+                self.stats['reconnects'] += 1
+            self.last_activity = now
+            self.stats['requests'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+            return reconnect
+
+    def success(self, http_version: str):
+        """
+        Отмечает успешный ответ
+        :param http_version: Версия протокола ответа
+        """
+        with self._lock:
+            self.last_activity = time.monotonic()
+            self.stats['in_flight'] -= 1
+            self.stats['http_version'] = http_version
+            self.failures = 0
+
+    def failure(self) -> bool:
+        """
+        Отмечает ошибку соединения
+        :return: True - ошибок подряд набралось `max_failures` и клиент нужно пересоздать
+        """
+        with self._lock:
+            self.last_activity = time.monotonic()
+            self.stats['in_flight'] -= 1
+            self.stats['errors'] += 1
+            self.failures += 1
+            if self.failures < self.max_failures:
+                return False
+            self.failures = 0
+            self.stats['reconnects'] += 1
+            return True
+
+    def report(self) -> dict:
+        with self._lock:
+            return dict(self.stats, failures = self.failures, idle = time.monotonic() - self.last_activity)
+
+
+def _retry_errors(httpx, url: str, files: dict):
+    """
+    Ошибки, после которых запрос можно повторить в новом соединении.
+    Запросы к res.php повторяются при любой сетевой ошибке, кроме таймаута, а отправка капчи - только если
+    соединение не было установлено, иначе капча может быть отправлена дважды.
+    """
+    if files or not urlsplit(url).path.endswith('res.php'):
+        return httpx.ConnectError
+    return httpx.NetworkError, httpx.RemoteProtocolError
+
+
+class HttpxTransport(Transport):
+    """
+    Транспорт на `httpx.Client` с HTTP/2: одновременные запросы к сервису мультиплексируются потоками(streams)
+    в нескольких соединениях, вместо отдельного сокета на каждый запрос в HTTP/1.1.
+    Управление потоком: одновременно выполняется не больше `max_streams` запросов, остальные ждут освобождения
+    места, а не открывают новые соединения. Окна потоков HTTP/2 и SETTINGS сервера соблюдает сам `httpx`.
+    Состояние соединений отслеживает `ConnectionHealth`, отчёт - метод `health`.
+    Требует `pip install httpx[http2]`.
+    """
+    name = 'httpx'
+
+    def __init__(self, http2: bool = True, max_connections: int = 4, max_streams: int = 100, max_failures: int = 3,
+                 max_idle: float = 60, **client_kwargs):
+        """
+        :param http2: True - использовать HTTP/2, если сервер его поддерживает
+        :param max_connections: Максимальное кол-во соединений клиента
+        :param max_streams: Максимальное кол-во одновременных запросов
+        :param max_failures: Кол-во ошибок соединения подряд, после которого клиент пересоздаётся
+        :param max_idle: Время простоя в секундах, после которого клиент пересоздаётся перед запросом
+        :param client_kwargs: Параметры `httpx.Client`, например `http1=False` для HTTP/2 без TLS
+        """
+        self.httpx = import_httpx()
+        client_kwargs.setdefault('limits', self.httpx.Limits(max_connections = max_connections,
+                                                             max_keepalive_connections = max_connections))
+        self.client_kwargs = dict(client_kwargs, http2 = http2)
+        self.client = self.httpx.Client(**self.client_kwargs)
+        self.streams = threading.BoundedSemaphore(max_streams)
+        self.connection_health = ConnectionHealth(max_failures, max_idle)
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self.connection_health.begin():
+                self.client, old = self.httpx.Client(**self.client_kwargs), self.client
+                old.close()
+            return self.client
+
+    def _failed(self, client):
+        if self.connection_health.failure():
+            with self._lock:
+                if self.client is client:
+                    self.client = self.httpx.Client(**self.client_kwargs)
+                    client.close()
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        retry_errors = _retry_errors(self.httpx, url, files)
+        with self.streams:
+            for attempt in range(2):
+                client = self._acquire()
+                try:
+                    resp = client.post(url, data = data, files = files, timeout = timeout)
+                except self.httpx.TransportError as error:
+                    self._failed(client)
+                    if attempt or not isinstance(error, retry_errors):
+                        raise
+                    continue
+                self.connection_health.success(resp.http_version)
+                return decode_json(resp.content)
+
+    @contextlib.contextmanager
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        with self.client.stream('GET', url, timeout = timeout, **kwargs) as resp:
+            yield resp.headers, resp.iter_bytes(chunk_size)
+
+    def health(self) -> dict:
+        """
+        :return: Состояние соединений: кол-во запросов, ошибок, пересозданий клиента, одновременных запросов,
+                 версия протокола последнего ответа и время простоя
+        """
+        return self.connection_health.report()
+
+    def close(self):
+        self.client.close()
+
+
+class AioHttpxTransport(AioTransport):
+    """
+    Асинхронный транспорт на `httpx.AsyncClient` с HTTP/2, аналог `HttpxTransport`.
+    Клиент создаётся при первом запросе и пересоздаётся, если транспорт используется в другом event loop.
+    Требует `pip install httpx[http2]`.
+    """
+    name = 'httpx'
+
+    def __init__(self, http2: bool = True, max_connections: int = 4, max_streams: int = 100, max_failures: int = 3,
+                 max_idle: float = 60, **client_kwargs):
+        self.httpx = import_httpx()
+        client_kwargs.setdefault('limits', self.httpx.Limits(max_connections = max_connections,
+                                                             max_keepalive_connections = max_connections))
+        self.client_kwargs = dict(client_kwargs, http2 = http2)
+        self.max_streams = max_streams
+        self.connection_health = ConnectionHealth(max_failures, max_idle)
+        self.client = None
+        self._streams = None
+        self._loop = None
+
+    def _get_client(self):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        if self.client is None or self._loop is not loop:
+            self.client = self.httpx.AsyncClient(**self.client_kwargs)
+            self._streams = asyncio.Semaphore(self.max_streams)
+            self._loop = loop
+        return self.client
+
+    async def _acquire(self):
+        client = self._get_client()
+        if self.connection_health.begin():
+            self.client = self.httpx.AsyncClient(**self.client_kwargs)
+            await client.aclose()
+        return self.client
+
+    async def _failed(self, client):
+        if self.connection_health.failure() and self.client is client:
+            self.client = self.httpx.AsyncClient(**self.client_kwargs)
+            await client.aclose()
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        retry_errors = _retry_errors(self.httpx, url, files)
+        self._get_client()
+        async with self._streams:
+            for attempt in range(2):
+                client = await self._acquire()
+                try:
+                    resp = await client.post(url, data = data, files = files, timeout = timeout)
+                except self.httpx.TransportError as error:
+                    await self._failed(client)
+                    if attempt or not isinstance(error, retry_errors):
+                        raise
+                    continue
+                self.connection_health.success(resp.http_version)
+                return decode_json(resp.content)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        async with self._get_client().stream('GET', url, timeout = timeout, **kwargs) as resp:
+            yield resp.headers, resp.aiter_bytes(chunk_size)
+
+    def health(self) -> dict:
+        """
+        :return: Состояние соединений, как у `HttpxTransport.health`
+        """
+        return self.connection_health.report()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+        self.client = None
+
+
+class FakeServer:
+    """
+    Локальная замена in.php/res.php в памяти процесса.
+    Капча считается решённой после `ready_after` запросов решения, до этого отдаётся `CAPCHA_NOT_READY`.
+    Один сервер можно использовать одновременно из `FakeTransport` и `AioFakeTransport`.
+    """
+
+    def __init__(self, ready_after: int = 1, solution: str = 'OK', submit_error: str = None, balance: str = '100.0',
+                 images: dict = None, latency: float = 0):
+        """
+        :param ready_after: Кол-во запросов решения до готовности капчи, или функция без параметров, возвращающая
+                            его для каждой новой капчи(например, случайное - для имитации разброса времени решения)
+        :param solution: Решение, которое получат все капчи
+        :param submit_error: Код ошибки, которым in.php отвечает на каждую отправку
+        :param balance: Ответ на `action=getbalance`
+        :param images: Ссылка -> содержимое, для `stream`
+        :param latency: Задержка каждого запроса в секундах
+        """
+        self.ready_after = ready_after
+        self.solution = solution
+        self.submit_error = submit_error
+        self.balance = balance
+        self.images = dict(images or {})
+        self.latency = latency
+        self._ids = itertools.count(1)
+        # ID капчи -> кол-во запросов решения, оставшихся до готовности
+        self._polls = {}
+        self._lock = threading.Lock()
+        # кол-во запросов каждого вида
+        self.stats = {'submit': 0, 'get': 0, 'get_many': 0, 'control': 0}
+
+    def _submit_error(self):
+        """
+        :return: Код ошибки ответа in.php на новую отправку, None - капча принимается
+        """
+        return self.submit_error
+
+    def _new_task(self):
+        """
+        :return: Состояние новой капчи в `_polls`: кол-во запросов решения до готовности
+        """
+        return self.ready_after() if callable(self.ready_after) else self.ready_after
+
+    def delay(self, url: str, data: dict) -> float:
+        """
+        :return: Задержка ответа на запрос в секундах
+        """
+        return self.latency
+
+    def _answer(self, captcha_id: str) -> str:
+        remaining = self._polls.get(captcha_id)
+        if remaining is None:
+            return 'ERROR_WRONG_CAPTCHA_ID'
+        remaining -= 1
+        if remaining <= 0:
+            self._polls.pop(captcha_id)
+            return self.solution
+        self._polls[captcha_id] = remaining
+        return 'CAPCHA_NOT_READY'
+
+    def handle(self, url: str, data: dict) -> dict:
+        """
+        Обрабатывает запрос
+        :return: JSON ответ в формате сервиса
+        """
+        path = urlsplit(url).path
+        with self._lock:
+            if not data.get('key'):
+                return {'status': 0, 'request': 'ERROR_KEY_DOES_NOT_EXIST'}
+
+            if path.endswith('in.php'):
+                self.stats['submit'] += 1
+                error = self._submit_error()
+                if error:
+                    return {'status': 0, 'request': error}
+                captcha_id = str(next(self._ids))
+                self._polls[captcha_id] = self._new_task()
+                return {'status': 1, 'request': captcha_id}
+
+            if path.endswith('res.php'):
+                action = data.get('action')
+                if action == 'get' and data.get('ids'):
+                    self.stats['get_many'] += 1
+                    answers = [self._answer(captcha_id) for captcha_id in data['ids'].split(',')]
+                    return {'status': 1, 'request': '|'.join(answers)}
+                if action == 'get':
+                    self.stats['get'] += 1
+                    answer = self._answer(str(data.get('id')))
+                    if answer == 'CAPCHA_NOT_READY' or answer.startswith('ERROR'):
+                        return {'status': 0, 'request': answer}
+                    return {'status': 1, 'request': answer}
+                self.stats['control'] += 1
+                if action == 'getbalance':
+                    return {'status': 1, 'request': self.balance}
+                if action in ('reportbad', 'reportgood'):
+                    return {'status': 1, 'request': 'OK_REPORT_RECORDED'}
+                return {'status': 0, 'request': 'ERROR_BAD_PARAMETERS'}
+
+        raise ValueError(f'FakeServer не обслуживает URL: {url}')
+
+    def image(self, url: str) -> bytes:
+        try:
+            return self.images[url]
+        except KeyError:
+            raise IOError(f'FakeServer: нет изображения по ссылке {url}')
+
+
+class FakeTransport(Transport):
+    """
+    Синхронный транспорт без сети поверх `FakeServer`
+    """
+    name = 'fake'
+
+    def __init__(self, server: FakeServer = None, **server_kwargs):
+        """
+        :param server: Общий `FakeServer`, по умолчанию создаётся новый с параметрами `server_kwargs`
+        """
+        self.server = server or FakeServer(**server_kwargs)
+
+    def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        delay = self.server.delay(url, data)
+        if delay:
+            time.sleep(delay)
+        return self.server.handle(url, data)
+
+    @contextlib.contextmanager
+    def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        content = self.server.image(url)
+        yield ({'Content-Length': str(len(content))},
+               (content[i:i + chunk_size] for i in range(0, len(content), chunk_size)))
+
+
+class AioFakeTransport(AioTransport):
+    """
+    Асинхронный транспорт без сети поверх `FakeServer`
+    """
+    name = 'fake'
+
+    def __init__(self, server: FakeServer = None, **server_kwargs):
+        self.server = server or FakeServer(**server_kwargs)
+
+    async def request(self, url: str, data: dict, files: dict = None, timeout: float = None) -> dict:
+        delay = self.server.delay(url, data)
+        if delay:
+            import asyncio
+
+            await asyncio.sleep(delay)
+        return self.server.handle(url, data)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, timeout: float = None, chunk_size: int = CHUNK_SIZE, **kwargs):
+        content = self.server.image(url)
+
+        async def chunks():
+            for i in range(0, len(content), chunk_size):
+                yield content[i:i + chunk_size]
+
+        yield {'Content-Length': str(len(content))}, chunks()
+
+
+# название бэкенда -> класс транспорта
+TRANSPORTS = {'requests': RequestsTransport,
+              'httpx': HttpxTransport,
+              'fake': FakeTransport,
+              }
+AIO_TRANSPORTS = {'aiohttp': AiohttpTransport,
+                  'httpx': AioHttpxTransport,
+                  'fake': AioFakeTransport,
+                  }
+
+
+def _make(transport, registry: dict, default: str):
+    if transport is None:
+        transport = default
+    if isinstance(transport, str):
+        try:
+            transport_class = registry[transport]
+        except KeyError:
+            raise ValueError(f'Неизвестный транспорт `{transport}`. Возможные варианты: {", ".join(registry)}')
+        # KeyError из конструктора транспорта не выдаётся за неизвестное название
+        return transport_class()
+    return transport
+
+
+def make_transport(transport = None) -> Transport:
+    """
+    :param transport: Объект `Transport`, название бэкенда из `TRANSPORTS` или None - `requests`
+    """
+    return _make(transport, TRANSPORTS, 'requests')
+
+
+def make_aio_transport(transport = None) -> AioTransport:
+    """
+    :param transport: Объект `AioTransport`, название бэкенда из `AIO_TRANSPORTS` или None - `aiohttp`
+    """
+    return _make(transport, AIO_TRANSPORTS, 'aiohttp')
@@ -0,0 +1,140 @@
+"""
+Локальная проверка параметров капчи до отправки на in.php.
+Каждая функция порождает `LocalValidationError` с кодом ошибки, который вернул бы сервер,
+и не делает сетевых запросов.
+"""
+import re
+import base64
+import binascii
+from urllib.parse import urlsplit
+
+from .errors import LocalValidationError
+
+# сигнатуры форматов изображений поддерживаемых сервисом
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpeg',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
+# минимальный и максимальный размер изображения принимаемый сервисом
+MIN_IMAGE_SIZE = 100
+MAX_IMAGE_SIZE = 100 * 1024
+# максимальный размер аудио файла
+MAX_AUDIO_SIZE = 1024 * 1024
+
+# ключ ReCaptcha - 40 символов из латиницы, цифр, `-` и `_`
+_GOOGLEKEY_RE = re.compile(r'^[\w-]{40}$', re.ASCII)
+# обязательные параметры KeyCaptcha
+KEYCAPTCHA_PARAMS = ('s_s_c_user_id', 's_s_c_session_id', 's_s_c_web_server_sign', 's_s_c_web_server_sign2')
+
+
+def detect_image_format(content: bytes):
+    """
+    Определяет формат изображения по первым байтам файла
+    :return: `png`, `jpeg`, `gif` или None для неподдерживаемого формата
+    """
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if content.startswith(signature):
+            return image_format
+    return None
+
+
+def validate_image_head(head: bytes, size: int, min_size: int = MIN_IMAGE_SIZE, max_size: int = MAX_IMAGE_SIZE,
+                        formats: tuple = ('png', 'jpeg', 'gif')):
+    """
+    Проверка изображения по его размеру и первым байтам, без полного содержимого
+    :param head: Первые байты изображения(не менее 8)
+    :param size: Размер изображения в байтах
+    :param min_size: Минимальный размер изображения в байтах
+    :param max_size: Максимальный размер изображения в байтах
+    :param formats: Допустимые форматы изображения
+    """
+    if size < min_size:
+        raise LocalValidationError('ERROR_ZERO_CAPTCHA_FILESIZE')
+    if size > max_size:
+        raise LocalValidationError('ERROR_TOO_BIG_CAPTCHA_FILESIZE')
+    if detect_image_format(head) not in formats:
+        raise LocalValidationError('ERROR_WRONG_FILE_EXTENSION')
+
+
+def validate_image(content: bytes, min_size: int = MIN_IMAGE_SIZE, max_size: int = MAX_IMAGE_SIZE,
+                   formats: tuple = ('png', 'jpeg', 'gif')):
+    """
+    Проверка размера и формата изображения
+    :param content: Изображение
+    """
+    validate_image_head(content[:16], len(content), min_size, max_size, formats)
+
+
+def validate_image_base64(content: str, min_size: int = MIN_IMAGE_SIZE, max_size: int = MAX_IMAGE_SIZE,
+                          formats: tuple = ('png', 'jpeg', 'gif')):
+    """
+    Проверка изображения в кодировке base64 без декодирования всего изображения:
+    размер вычисляется по длине строки, формат - по первым байтам
+    """
+    try:
+        head = base64.b64decode(content[:16])
+    except (binascii.Error, ValueError):
+        raise LocalValidationError('ERROR_IMAGE_TYPE_NOT_SUPPORTED')
+    size = len(content) * 3 // 4 - content[-2:].count('=')
+    validate_image_head(head, size, min_size, max_size, formats)
+
+
+def validate_page_url(page_url: str):
+    """
+    Проверка ссылки на страницу с капчей: http(s) и домен
+    """
+    if not page_url or not isinstance(page_url, str):
+        raise LocalValidationError('ERROR_PAGEURL')
+    parts = urlsplit(page_url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        raise LocalValidationError('ERROR_PAGEURL')
+
+
+def validate_recaptcha(site_key: str, page_url: str):
+    """
+    Проверка параметров ReCaptcha v2
+    """
+    if not site_key or not isinstance(site_key, str) or not _GOOGLEKEY_RE.match(site_key):
+        raise LocalValidationError('ERROR_GOOGLEKEY')
+    validate_page_url(page_url)
+
+
+def validate_funcaptcha(public_key: str, page_url: str):
+    """
+    Проверка параметров FunCaptcha
+    """
+    if not public_key or not isinstance(public_key, str):
+        raise LocalValidationError('ERROR_BAD_PARAMETERS')
+    validate_page_url(page_url)
+
+
+def validate_keycaptcha(params: dict):
+    """
+    Проверка наличия обязательных `s_s_c_*` параметров KeyCaptcha и ссылки на страницу
+    """
+    for param in KEYCAPTCHA_PARAMS:
+        if not params.get(param):
+            raise LocalValidationError('ERROR_BAD_PARAMETERS')
+    validate_page_url(params.get('page_url'))
+
+
+def validate_text(captcha_text: str):
+    """
+    Проверка текста текстовой капчи
+    """
+    if not captcha_text or not captcha_text.strip():
+        raise LocalValidationError('ERROR_BAD_PARAMETERS')
+
+
+def validate_audio(content: bytes, max_size: int = MAX_AUDIO_SIZE):
+    """
+    Проверка аудио файла: размер и формат mp3(ID3 тег или заголовок MPEG кадра)
+    """
+    if not content:
+        raise LocalValidationError('ERROR_ZERO_CAPTCHA_FILESIZE')
+    if len(content) > max_size:
+        raise LocalValidationError('ERROR_TOO_BIG_CAPTCHA_FILESIZE')
+    if not (content.startswith(b'ID3') or (len(content) > 1 and content[0] == 0xFF and content[1] & 0xE0 == 0xE0)):
+        raise LocalValidationError('ERROR_WRONG_FILE_EXTENSION')
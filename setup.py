@@ -10,6 +10,20 @@ setup(
         'requests>=2.18',
         'aiohttp>=3'
         ],
+    extras_require = {
+        # обработка изображений через python_rucaptcha.preprocessing
+        'images': ['Pillow'],
+        # HTTP/2 транспорт python_rucaptcha.transport.HttpxTransport
+        'http2': ['httpx[http2]'],
+        # быстрый разбор JSON ответов, см. python_rucaptcha.decoding
+        'speedups': ['orjson'],
+        # спаны OpenTelemetry, см. python_rucaptcha.tracing
+        'tracing': ['opentelemetry-api'],
+        },
+    entry_points = {
+        # пакетное решение капч, см. python_rucaptcha.cli
+        'console_scripts': ['rucaptcha-solve = python_rucaptcha.cli:main'],
+        },
     description = 'Python 3 RuCaptcha library with AIO module.',
     author_email = 'drang.andray@gmail.com',
     url = 'https://github.com/AndreiDrang/python-rucaptcha',